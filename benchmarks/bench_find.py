@@ -0,0 +1,124 @@
+#! /usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Measure the time needed to look up schema versions with Schema.find() in a
+registry with many versions, as done by SchemaLoader.resolve_includes()
+and resolve_imports().
+
+The registry is populated with generated SchemaCommon and SchemaVersion
+records (10 versions per schema); each lookup is timed both with find()
+and with a scan that checks the common record of every version, as find()
+once did.
+
+This requires a scratch MongoDB database, given by the MONGO_TESTDB_URL
+environment variable (as for the unit tests); the database is dropped 
+before and after the benchmark runs.  To guard against dropping a real 
+database, the benchmark refuses to run unless the database name contains
+"test" or "bench".
+
+Usage:  MONGO_TESTDB_URL=mongodb://localhost/bench \\
+          python benchmarks/bench_find.py [NUMBER_OF_VERSIONS [REPETITIONS]]
+"""
+import os, sys, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'xmltemplate.settings')
+
+from mongoengine import connect
+from xmltemplate import audit
+from xmltemplate.models import SchemaCommon, SchemaVersion, Schema, RECORD
+
+VERSIONS_PER_SCHEMA = 10
+
+# a database is only dropped if its name contains one of these
+SCRATCH_MARKERS = ("test", "bench")
+
+def ns(i):
+    return "urn:bench:{0}".format(i)
+
+def populate(nversions):
+    nschemas = max(1, nversions / VERSIONS_PER_SCHEMA)
+    scs = [ SchemaCommon(name="s{0}".format(i), namespace=ns(i),
+                         current=VERSIONS_PER_SCHEMA)
+            for i in xrange(nschemas) ]
+    ids = SchemaCommon.objects.insert(scs, load_bulk=False)
+    for sc, id in zip(scs, ids):
+        sc.pk = id
+
+    svs = []
+    for i, sc in enumerate(scs):
+        for v in xrange(1, VERSIONS_PER_SCHEMA+1):
+            status = (v == VERSIONS_PER_SCHEMA and RECORD.IS_CURRENT) or \
+                     RECORD.AVAILABLE
+            svs.append(SchemaVersion(name=sc.name, version=v, common=sc,
+                                     namespace=sc.namespace,
+                                     location="s{0}.xsd".format(i),
+                                     content="<schema />",
+                                     digest="{0}-{1}".format(i, v),
+                                     status=status))
+    SchemaVersion.objects.insert(svs, load_bulk=False)
+    return nschemas
+
+def find_by_scan(**kwds):
+    # the way Schema.find() once matched the namespace and current flag
+    out = []
+    for ver in SchemaVersion.objects.all():
+        if 'location' in kwds and ver.location != kwds['location']:
+            continue
+        if 'namespace' in kwds and ver.common.namespace != kwds['namespace']:
+            continue
+        if kwds.get('current') and ver.common.current != ver.version:
+            continue
+        out.append(Schema(ver))
+    return out
+
+def lookups(nschemas):
+    # the lookups made while resolving includes and imports
+    i = nschemas / 2
+    return [ ("include by location",
+              dict(location="s{0}.xsd".format(i), namespace=ns(i))),
+             ("import by location",
+              dict(namespace=ns(i), location="s{0}.xsd".format(i),
+                   current=True)),
+             ("import by namespace", dict(namespace=ns(i), current=True)) ]
+
+def timeit(func, kwds, reps):
+    start = time.time()
+    for r in xrange(reps):
+        found = func(**kwds)
+    return (time.time() - start) / reps, len(found)
+
+def run(nversions, reps):
+    mc = connect(host=os.environ['MONGO_TESTDB_URL'])
+    db = mc.get_default_database()
+    if not any(m in db.name.lower() for m in SCRATCH_MARKERS):
+        raise SystemExit("Refusing to drop database, {0}: name does not "
+                         "contain any of: {1}"
+                         .format(db.name, ", ".join(SCRATCH_MARKERS)))
+    try:
+        mc.drop_database(db.name)
+        audit.ensure_indexes()
+        nschemas = populate(nversions)
+        print("{0} versions of {1} schemas".
+              format(SchemaVersion.objects.count(), nschemas))
+
+        print("{0:<22} {1:>6} {2:>12} {3:>12}".
+              format("lookup", "found", "find() ms", "scan ms"))
+        for label, kwds in lookups(nschemas):
+            secs, found = timeit(Schema.find, kwds, reps)
+            scansecs, scanfound = timeit(find_by_scan, kwds, 1)
+            assert found == scanfound
+            print("{0:<22} {1:>6} {2:>12.2f} {3:>12.2f}".
+                  format(label, found, 1000.0 * secs, 1000.0 * scansecs))
+    finally:
+        mc.drop_database(db.name)
+
+if __name__ == '__main__':
+    nversions = 10000
+    reps = 100
+    if len(sys.argv) > 1:
+        nversions = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        reps = int(sys.argv[2])
+    run(nversions, reps)
@@ -0,0 +1,69 @@
+#! /usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Report the time spent in each phase of schema ingestion (see
+SchemaLoader.prepare()) while loading the resmd schemas from the test data.
+
+This requires a scratch MongoDB database, given by the MONGO_TESTDB_URL
+environment variable (as for the unit tests); the database is dropped when
+the benchmark finishes.
+
+Usage:  MONGO_TESTDB_URL=mongodb://localhost/bench \\
+          python benchmarks/bench_ingest.py [REPETITIONS]
+"""
+import os, sys, time
+from collections import OrderedDict as ODict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'xmltemplate.settings')
+
+from mongoengine import connect
+from xmltemplate import schema
+
+resmddir = os.path.join(os.path.dirname(os.path.dirname(
+                            os.path.abspath(__file__))),
+                        "xmltemplate", "tests", "data", "resmd")
+
+# the schemas in the order they must be loaded, with the location to load
+# each under
+SCHEMAS = [ ("xml-2001.xsd", "http://www.w3.org/2009/01/xml.xsd"),
+            ("res-md.xsd", "res-md.xsd"),
+            ("res-app.xsd", "res-app.xsd"),
+            ("resmd-datacite.xsd", "resmd-datacite.xsd"),
+            ("resmd-access.xsd", "resmd-access.xsd"),
+            ("mat-sci_res-md.xsd", "mat-sci_res-md.xsd") ]
+
+def load_all(totals):
+    for name, location in SCHEMAS:
+        loader = schema.SchemaLoader.from_file(os.path.join(resmddir, name),
+                                               name, location)
+        loader.load()
+        for phase, secs in loader.timings.iteritems():
+            totals[phase] = totals.get(phase, 0.0) + secs
+
+def run(reps):
+    mc = connect(host=os.environ['MONGO_TESTDB_URL'])
+    db = mc.get_default_database()
+    totals = ODict()
+    try:
+        start = time.time()
+        for i in xrange(reps):
+            mc.drop_database(db.name)
+            load_all(totals)
+        elapsed = time.time() - start
+    finally:
+        mc.drop_database(db.name)
+
+    print("loaded {0} schemas {1} time(s) in {2:.2f} seconds".
+          format(len(SCHEMAS), reps, elapsed))
+    print("{0:<14} {1:>12}".format("phase", "ms per load"))
+    for phase, secs in totals.iteritems():
+        print("{0:<14} {1:>12.2f}".format(phase,
+                                         1000.0 * secs / (reps*len(SCHEMAS))))
+
+if __name__ == '__main__':
+    reps = 5
+    if len(sys.argv) > 1:
+        reps = int(sys.argv[1])
+    run(reps)
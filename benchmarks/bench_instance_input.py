@@ -0,0 +1,113 @@
+#! /usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Compare the memory needed to parse and validate a large instance document
+when it is given to the validator in different forms.
+
+The "StringIO copy" case reproduces the original input path in which the
+document is read into a string and copied into a StringIO before parsing;
+the others exercise the input forms accepted by lxmlValidator.validate()
+and parse().  Each case runs in a fresh process, and the growth in the
+process's peak resident memory is reported.
+
+Usage:  python benchmarks/bench_instance_input.py [NUMBER_OF_RECORDS]
+"""
+import os, sys, mmap, resource, tempfile, time
+from multiprocessing import Process, Queue
+from cStringIO import StringIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'xmltemplate.settings')
+
+from lxml import etree
+from xmltemplate import validate as val
+
+datadir = os.path.join(os.path.dirname(os.path.dirname(
+                           os.path.abspath(__file__))),
+                       "xmltemplate", "tests", "data")
+
+RECORD = '<equipment><vendor>FEI</vendor><model>Titan</model></equipment>\n'
+
+def write_instance(nrecs):
+    fd, path = tempfile.mkstemp(suffix=".xml")
+    with os.fdopen(fd, 'w') as out:
+        out.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        out.write('<Lab xmlns="urn:experiments">\n')
+        for i in xrange(nrecs):
+            out.write(RECORD)
+        out.write('</Lab>\n')
+    return path
+
+def stringio_copy(v8r, path):
+    with open(path) as fd:
+        content = fd.read()
+    doc = etree.parse(StringIO(content))
+    return v8r._valid8r.validate(doc)
+
+def str_in_place(v8r, path):
+    with open(path) as fd:
+        content = fd.read()
+    return v8r.validate(content)
+
+def file_path(v8r, path):
+    return v8r.validate(path, is_file=True)
+
+def mmapped(v8r, path):
+    with open(path, 'rb') as fd:
+        mm = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            return v8r.validate(mm)
+        finally:
+            mm.close()
+
+def open_file(v8r, path):
+    with open(path, 'rb') as fd:
+        return v8r.validate(fd)
+
+def streaming(v8r, path):
+    return v8r.validate(path, streaming=True, is_file=True)
+
+CASES = [ ("StringIO copy (original)", stringio_copy),
+          ("str parsed in place", str_in_place),
+          ("file path", file_path),
+          ("mmap", mmapped),
+          ("open file", open_file),
+          ("streaming file path", streaming) ]
+
+def _peak_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def _run_case(func, schema, path, q):
+    v8r = val.lxmlValidator(schema)
+    before = _peak_kb()
+    start = time.time()
+    valid = func(v8r, path)
+    q.put( (valid, _peak_kb() - before, time.time() - start) )
+
+def run(nrecs):
+    with open(os.path.join(datadir, "experiments.xsd")) as fd:
+        schema = fd.read()
+    path = write_instance(nrecs)
+    try:
+        size = os.path.getsize(path)
+        print("instance document: {0} records, {1:.1f} MB".
+              format(nrecs, size / 1048576.0))
+        print("{0:<28} {1:>6} {2:>14} {3:>9}".
+              format("input form", "valid", "peak growth", "seconds"))
+        for label, func in CASES:
+            q = Queue()
+            p = Process(target=_run_case, args=(func, schema, path, q))
+            p.start()
+            valid, grew, secs = q.get()
+            p.join()
+            print("{0:<28} {1:>6} {2:>11.1f} MB {3:>9.2f}".
+                  format(label, str(valid), grew / 1024.0, secs))
+    finally:
+        os.remove(path)
+
+if __name__ == '__main__':
+    nrecs = 500000
+    if len(sys.argv) > 1:
+        nrecs = int(sys.argv[1])
+    run(nrecs)
@@ -0,0 +1,72 @@
+#! /usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Measure the time needed to trace the ancestry of the global types in large
+generated type hierarchies with typegraph.TypeGraph.
+
+Three shapes are generated:
+  *  wide:    many types all deriving from one base type
+  *  shallow: many derivation chains, each 20 types long
+  *  deep:    fewer derivation chains, each 1000 types long
+In each, the types are declared in reverse order of derivation (i.e. each
+type before its base type), which is the worst case for a tracer that
+relies on declaration order.  (A single chain is not generated as the
+ancestry lists for a chain of N types hold N*(N-1)/2 names in all.)
+
+Usage:  python benchmarks/bench_typegraph.py [NUMBER_OF_TYPES]
+"""
+import os, sys, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'xmltemplate.settings')
+
+from xmltemplate.typegraph import TypeGraph
+
+NS = "urn:bench"
+STRING = "{http://www.w3.org/2001/XMLSchema}string"
+
+def q(name):
+    return "{" + NS + "}" + name
+
+def wide(ntypes):
+    out = [ ("T%d" % i, q("T0")) for i in xrange(ntypes-1, 0, -1) ]
+    out.append( ("T0", STRING) )
+    return out
+
+def chains(ntypes, depth):
+    out = []
+    for i in xrange(ntypes-1, -1, -1):
+        if i % depth == 0:
+            out.append( ("T%d" % i, STRING) )
+        else:
+            out.append( ("T%d" % i, q("T%d" % (i-1))) )
+    return out
+
+SHAPES = [ ("wide", wide),
+           ("shallow (depth 20)", lambda n: chains(n, 20)),
+           ("deep (depth 1000)", lambda n: chains(n, 1000)) ]
+
+def trace(types):
+    graph = TypeGraph(NS)
+    for name, parent in types:
+        graph.add(name, parent)
+    return graph.trace_all()
+
+def run(ntypes):
+    print("{0:<20} {1:>8} {2:>12} {3:>10}".
+          format("hierarchy", "types", "ancestors", "seconds"))
+    for label, gen in SHAPES:
+        types = gen(ntypes)
+        start = time.time()
+        out = trace(types)
+        elapsed = time.time() - start
+        nanc = sum(len(a) for a in out.itervalues())
+        print("{0:<20} {1:>8} {2:>12} {3:>10.3f}".
+              format(label, len(types), nanc, elapsed))
+
+if __name__ == '__main__':
+    ntypes = 20000
+    if len(sys.argv) > 1:
+        ntypes = int(sys.argv[1])
+    run(ntypes)
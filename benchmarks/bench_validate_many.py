@@ -0,0 +1,63 @@
+#! /usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Report the throughput of batch validation (see BaseValidator.validate_many())
+for different numbers of worker threads.
+
+Several batches are validated with the same validator, as a cached validator
+would be used; the first batch includes the cost of compiling any extra
+copies of the schema that the workers need.  The number of compiled copies
+held by the validator afterward, and the footprint it reports to the
+validator cache, are shown for each number of workers.
+
+Usage:  python benchmarks/bench_validate_many.py [NUMBER_OF_DOCUMENTS]
+"""
+import os, sys, time
+from multiprocessing import cpu_count
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'xmltemplate.settings')
+
+from xmltemplate import validate as val
+
+datadir = os.path.join(os.path.dirname(os.path.dirname(
+                           os.path.abspath(__file__))),
+                       "xmltemplate", "tests", "data")
+
+RECORD = '<equipment><vendor>FEI</vendor><model>Titan</model></equipment>\n'
+
+# the number of batches validated with each validator
+BATCHES = 5
+
+def make_instance(nrecs):
+    return '<Lab xmlns="urn:experiments">\n' + RECORD * nrecs + '</Lab>\n'
+
+def run(ndocs, nrecs=200):
+    with open(os.path.join(datadir, "experiments.xsd")) as fd:
+        schema = fd.read()
+    docs = [make_instance(nrecs)] * ndocs
+
+    print("{0} documents of {1} records per batch, {2} batches".
+          format(ndocs, nrecs, BATCHES))
+    print("{0:>7} {1:>14} {2:>14} {3:>7} {4:>11}".
+          format("workers", "first docs/s", "later docs/s", "copies",
+                 "footprint"))
+    workers = sorted(set([1, 2, 4, cpu_count()]))
+    for n in workers:
+        v8r = val.lxmlValidator(schema)
+        rates = []
+        for i in xrange(BATCHES):
+            batch = v8r.validate_many(docs, workers=n)
+            assert batch.valid_count == ndocs
+            rates.append(batch.throughput)
+        later = sum(rates[1:]) / len(rates[1:])
+        print("{0:>7} {1:>14.0f} {2:>14.0f} {3:>7} {4:>9.1f}KB".
+              format(n, rates[0], later, getattr(v8r, 'copies', '?'),
+                     v8r.footprint / 1024.0))
+
+if __name__ == '__main__':
+    ndocs = 2000
+    if len(sys.argv) > 1:
+        ndocs = int(sys.argv[1])
+    run(ndocs)
@@ -3,17 +3,21 @@ This module processes calls to the web API for interacting with templates and
 the schemas they are based on.
 """
 import json, logging
+from cStringIO import StringIO
 
 from rest_framework.views import APIView
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, parser_classes
 from rest_framework.response import Response
 from rest_framework import authentication, permissions, status
+from rest_framework.exceptions import APIException, ParseError
 from rest_framework.parsers import JSONParser, BaseParser
 from rest_framework.renderers import JSONRenderer, BaseRenderer
 
-from . import models
+from . import models, warmup
 from .schema import (SchemaLoader, ValidationError, SchemaIngestError,
-                     UnresolvedSchemaInclude)
+                     UnresolvedSchemaInclude, StreamedSchema, SchemaTooLarge,
+                     max_upload_size, prepare_cache)
+from .validate import Validator, SchemaValidationError, ValidationOptions
 
 logger = logging.getLogger(__name__)
 
@@ -34,7 +38,8 @@ def loadSchemaDoc(content, name, location=None, about=None,
     will attempt to load it on the fly if it is referred to with a 
     schemaLocation that is a URL or loading will fail.  
 
-    :param content  str:  the text content of the XML Schema document
+    :param content  str:  the text content of the XML Schema document (or
+                          a StreamedSchema, as read from an upload)
     :param name     str:  the name to assign to the document
     :param location str:  the URL, file name, or file path to assign as the 
                           schema location for the document; this is used to 
@@ -47,7 +52,9 @@ def loadSchemaDoc(content, name, location=None, about=None,
     :param make_current bool:  if True, mark this schema as current after 
                           loading
     :param check_digest bool:  if True, compare this schemas digest hash with
-                          those already loaded with the given name.  If there
+                          those already loaded with the given name (first 
+                          exactly, then ignoring differences in formatting
+                          via its canonical digest).  If there
                           is a match, the schema will not be loaded; however,
                           if it in a deleted state, it will be undeleted, and
                           the location field will be updated if it is not None.
@@ -63,32 +70,40 @@ def loadSchemaDoc(content, name, location=None, about=None,
                           loaded into the system.  (See notes above.)
     :return dict:  a dictionary describing the success or failure of the load
                    attempt.  A boolean field 'ok' indicates whether the load 
-                   was successful; see notes above for more details.
+                   was successful; see notes above for more details.  If it 
+                   failed due to fixable errors, the 'digest' field gives the
+                   schema's digest, which can be used to retrieve the 
+                   diagnostics again (see schema_diagnostics()); a 
+                   subsequent attempt to load the same document will resume
+                   from where this one left off.
     """
     out = { "ok": True }
     isupdate = len(models.SchemaVersion.get_all_by_name(name, True)) > 0
     schema = None
 
     try:
-        loader = SchemaLoader(content, name, location)
+        if isinstance(content, StreamedSchema):
+            loader = content.loader(name, location)
+        else:
+            loader = SchemaLoader(content, name, location)
+
+        # pick up where a previous attempt to load this document left off
+        loader = prepare_cache.take(loader.digest, name, location) or loader
+
         if isupdate:
             loader.comment = about
         else:
             loader.description = about
 
-        if loc_finder:
-            for loc in loc_finder:
-                loader.recognize_location(loc, loc_finder[loc])
-
-        if ns_finder:
-            for ns in ns_finder:
-                loader.recognize_namespace(ns, ns_finder[ns])
+        loader.set_finders(loc_finder, ns_finder)
 
         schema = None
         if check_digest:
             # we're comparing the digest to prevent reloading the same schema
             # because PUT, according to the rules of REST, needs to be indepodent
-            sv = models.SchemaVersion.get_by_digest(loader.digest, name)
+            sv = models.SchemaVersion.get_by_digest(loader.digest, name) or \
+                 models.SchemaVersion.get_by_canon_digest(loader.canon_digest,
+                                                          name)
             if sv:
                 # we've already loaded this; undelete it if necessary
                 logger.info("posted schema is identical to existing schema; "+
@@ -116,7 +131,9 @@ def loadSchemaDoc(content, name, location=None, about=None,
 
         if not schema:
             if not loader.prepare():
+                prepare_cache.put_loader(loader)
                 out['ok'] = False
+                out['digest'] = loader.digest
                 out['errors'] = [str(e) for e in loader.errors]
                 unresolved = [e for e in loader.errors
                                 if isinstance(e, UnresolvedSchemaInclude)]
@@ -150,6 +167,7 @@ def loadSchemaDoc(content, name, location=None, about=None,
                 return out
 
             schema = loader.load()
+            prepare_cache.record(loader)
             out['message'] = \
                   "Schema document, {0}, successfully loaded".format(schema.name)
 
@@ -175,6 +193,30 @@ class _XSDParser(BaseParser):
     def parse(self, stream, media_type=None, parser_context=None):
         return stream.read()
 
+class _RequestTooLarge(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+
+class _XSDStreamParser(_XSDParser):
+    """
+    a parser for uploaded schema documents.  The document is parsed and 
+    hashed as it is read (decompressing it if the request has a 
+    Content-Encoding of gzip or deflate), and the result is returned as a 
+    StreamedSchema.  Uploads larger than the SCHEMA_MAX_UPLOAD_SIZE setting
+    are rejected.
+    """
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        encoding = None
+        request = (parser_context or {}).get('request')
+        if request is not None:
+            encoding = request.META.get('HTTP_CONTENT_ENCODING')
+        try:
+            return StreamedSchema.read(stream, max_upload_size(), encoding)
+        except SchemaTooLarge, ex:
+            raise _RequestTooLarge(ex.message)
+        except SchemaIngestError, ex:
+            raise ParseError(ex.message)
+
 class _XSDRenderer(BaseRenderer):
     """
     a renderer for sending a raw XML-XSD file
@@ -191,7 +233,7 @@ class AllSchemaDocs(APIView):
     """
     an interface to all schema documents currently in the system.  
     """
-    parser_classes = (JSONParser, _XSDParser,)
+    parser_classes = (JSONParser, _XSDStreamParser,)
 
     @classmethod
     def summarize(cls, schema):
@@ -290,7 +332,7 @@ class AllSchemaDocs(APIView):
         """
         out = { 'ok', True }
         
-        if isinstance(request.DATA, (str, unicode)):
+        if isinstance(request.DATA, (str, unicode, StreamedSchema)):
             # raw XML:  the XSD file contents
             data = {
                 'content': request.DATA,
@@ -351,7 +393,7 @@ class SchemaDoc(APIView):
                      (see patch()).
     """
 
-    parser_classes = (JSONParser, _XSDParser,)
+    parser_classes = (JSONParser, _XSDStreamParser,)
 
     @classmethod
     def summarize(cls, schema):
@@ -486,7 +528,7 @@ class SchemaDoc(APIView):
         ns_finder = {}
         loc_finder = {}
         
-        if isinstance(request.DATA, (str, unicode)):
+        if isinstance(request.DATA, (str, unicode, StreamedSchema)):
             # raw XML:  the XSD file contents
             content = request.DATA
             location = request.GET.get('location')
@@ -785,3 +827,116 @@ def list_elements_in(request, schemaname, version=None):
     out = [e.name for e in elements]
     return Response(out)
 
+@api_view(['GET'])
+def resolve_qname(request):
+    """
+    resolve a type or element qualified name to the current schema 
+    document that defines it.  The namespace and local name are given by 
+    the ns and name query parameters.  The response lists the matching 
+    global types and elements from the current versions of their schemas.
+    """
+    ns = request.GET.get('ns', '')
+    name = request.GET.get('name')
+    if not name:
+        out = { 'ok': False, 'message': "Missing name query parameter" }
+        return Response(out, status=status.HTTP_400_BAD_REQUEST)
+
+    types = [ { 'schema': t.schemaname, 'version': t.version, 
+                'abstract': t.abstract, 'anscestors': t.anscestors }
+              for t in models.GlobalType.find_current(ns, name) ]
+    elements = [ { 'schema': e.schemaname, 'version': e.version }
+                 for e in models.GlobalElement.find_current(ns, name) ]
+
+    out = { 'ok': True, 'ns': ns, 'name': name, 
+            'qname': "{{{0}}}{1}".format(ns, name),
+            'types': types, 'elements': elements }
+    if not types and not elements:
+        return Response(out, status=status.HTTP_404_NOT_FOUND)
+    return Response(out)
+
+@api_view(['POST'])
+@parser_classes((_XSDParser,))
+def validate_instance(request, name, version=None):
+    """
+    validate an XML instance document, given as the body of the request, 
+    against a given version of a named schema (or its current version if 
+    no version is given).  The compiled validator is drawn from the 
+    server-side cache of validators so that repeated validations against 
+    the same schema only incur the cost of parsing and validating the 
+    instance.  The response reports the version of the schema that was 
+    actually used.
+
+    The optional query parameter, max_errors, limits the number of errors 
+    reported; max_errors=1 stops validation at the first error.
+    """
+    if version is not None:
+        version = int(version)
+
+    options = None
+    max_errors = request.GET.get('max_errors')
+    if max_errors:
+        try:
+            options = ValidationOptions(int(max_errors))
+        except ValueError, ex:
+            out = { 'ok': False,
+                    'message': "max_errors: not a positive integer: " +
+                               max_errors }
+            return Response(out, status=status.HTTP_400_BAD_REQUEST)
+
+    content = request.DATA
+    if not content or not isinstance(content, (str, unicode)):
+        out = { 'ok': False, 'message': "Missing XML instance document" }
+        return Response(out, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        v8r = Validator.from_schema_name(name, version)
+    except SchemaValidationError, ex:
+        logger.error("registered schema, %s, failed to compile: %s",
+                     name, ex.message)
+        out = { 'ok': False,
+                'message': "Unable to compile schema: " + ex.message }
+        return Response(out, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    except ValidationError, ex:
+        out = { 'ok': False,
+                'message': 'schema not found: {0}/{1}'.
+                           format(name, version or "current") }
+        return Response(out, status=status.HTTP_404_NOT_FOUND)
+
+    # the body is always read as the document itself, never as the path 
+    # to one
+    if isinstance(content, str):
+        content = StringIO(content)
+    result = v8r.check(content, options=options)
+    return Response({ 'ok': True, 'schema': name, 
+                      'version': getattr(v8r, 'schema_version', version),
+                      'valid': result.valid,
+                      'errors': [e.to_dict() for e in result.errors] })
+
+@api_view(['GET'])
+def schema_diagnostics(request, digest):
+    """
+    return the diagnostics from the most recent attempt to load the schema 
+    document with the given digest (as returned by a failed load) without 
+    preparing it again.
+    """
+    out = prepare_cache.diagnostics(digest)
+    if out is None:
+        out = { 'ok': False, 
+                'message': "No diagnostics available for digest: " + digest }
+        return Response(out, status=status.HTTP_404_NOT_FOUND)
+    out = dict(out)
+    out['ok'] = True
+    return Response(out)
+
+@api_view(['GET'])
+def readiness(request):
+    """
+    report whether the validators for the current schemas have been 
+    compiled (see warmup).  The response status is 503 until the warm-up
+    is complete, including while a failed warm-up waits to be retried (the
+    failure is given as "error").
+    """
+    out = warmup.warmer.progress()
+    if not out['ready']:
+        return Response(out, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    return Response(out)
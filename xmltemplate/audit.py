@@ -0,0 +1,223 @@
+"""
+a module for checking that the queries made against the model collections
+are served by indexes.
+
+Each model in models.py declares the indexes that support its access
+paths.  The audit in this module runs explain() on a canonical instance of
+each of the frequently made queries and flags those whose winning plan
+scans a whole collection; such a query gets slower as the registry grows.
+The audit can be run via the audit_indexes management command or, when the
+SCHEMA_AUDIT_INDEXES setting is true, at startup (see wsgi.py).
+"""
+import logging
+
+from mongoengine import Q
+
+from .models import (SchemaCommon, SchemaVersion, GlobalElement, GlobalType,
+                     GlobalElementAnnots, GlobalTypeAnnots, TemplateCommon,
+                     TemplateVersion, RECORD)
+
+logger = logging.getLogger(__name__)
+
+# the models whose declared indexes are audited
+MODELS = [ SchemaCommon, SchemaVersion, GlobalElementAnnots, GlobalElement,
+           GlobalTypeAnnots, GlobalType, TemplateCommon, TemplateVersion ]
+
+# the values used in the canonical queries; what matters is the shape of
+# the query, not whether anything matches.
+_NAME = "audit"
+_NS = "urn:audit"
+_DIGEST = "0"*40
+
+def _extern_types_query():
+    pins = Q(schemaname=_NAME, version=1) | Q(schemaname=_NAME+"2", version=2)
+    return GlobalType.objects(pins)
+
+# the canonical queries:  each is a pair of a description and a function
+# that returns the (unevaluated) query set.
+CANONICAL_QUERIES = [
+    ("SchemaCommon by name",
+     lambda: SchemaCommon.objects.filter(name=_NAME, current__gt=0)),
+    ("SchemaCommon by namespace",
+     lambda: SchemaCommon.objects.filter(namespace=_NS)),
+    ("SchemaVersion by name and version",
+     lambda: SchemaVersion.objects.filter(name=_NAME, version=1,
+                                          status__ne=RECORD.DELETED)),
+    ("SchemaVersion latest version",
+     lambda: SchemaVersion.objects.filter(name=_NAME).order_by('-version')
+                                  .only('version')[:1]),
+    ("SchemaVersion by name and status",
+     lambda: SchemaVersion.objects.filter(name=_NAME,
+                                          status=RECORD.AVAILABLE)),
+    ("SchemaVersion by status",
+     lambda: SchemaVersion.objects.filter(status=RECORD.IS_CURRENT)),
+    ("SchemaVersion by digest",
+     lambda: SchemaVersion.objects.filter(digest=_DIGEST, name=_NAME)),
+    ("SchemaVersion by canonical digest",
+     lambda: SchemaVersion.objects.filter(canon_digest=_DIGEST)),
+    ("SchemaVersion current by namespace",
+     lambda: SchemaVersion.objects.filter(namespace=_NS,
+                                          status=RECORD.IS_CURRENT)),
+    ("SchemaVersion by location and namespace",
+     lambda: SchemaVersion.objects.filter(location=_NAME+".xsd",
+                                          namespace=_NS)),
+    ("SchemaVersion by pinned versions",
+     lambda: SchemaVersion.objects(Q(name=_NAME, version=1) |
+                                   Q(name=_NAME+"2", version=2))),
+    ("GlobalElement by schema version",
+     lambda: GlobalElement.objects.filter(schemaname=_NAME, version=1)),
+    ("GlobalElement current by qname",
+     lambda: GlobalElement.objects.filter(namespace=_NS, name=_NAME,
+                                          current=True)),
+    ("GlobalElement current flags",
+     lambda: GlobalElement.objects.filter(schemaname=_NAME, current=True,
+                                          version__ne=1)),
+    ("GlobalElementAnnots by name",
+     lambda: GlobalElementAnnots.objects.filter(namespace=_NS,
+                                                schemaname=_NAME,
+                                                name__in=[_NAME])),
+    ("GlobalType by schema version",
+     lambda: GlobalType.objects.filter(schemaname=_NAME, version=1)),
+    ("GlobalType current by qname",
+     lambda: GlobalType.objects.filter(namespace=_NS, name=_NAME,
+                                       current=True)),
+    ("GlobalType by pinned versions", _extern_types_query),
+    ("GlobalType by anscestor",
+     lambda: GlobalType.objects.filter(anscestors="{urn:audit}audit")),
+    ("GlobalTypeAnnots by name",
+     lambda: GlobalTypeAnnots.objects.filter(namespace=_NS,
+                                             schemaname=_NAME,
+                                             name__in=[_NAME])),
+    ("TemplateCommon by name",
+     lambda: TemplateCommon.objects.filter(name=_NAME, current__gt=0)),
+    ("TemplateVersion by name",
+     lambda: TemplateVersion.objects.filter(name=_NAME, deleted=False)),
+    ("TemplateVersion by root",
+     lambda: TemplateVersion.objects.filter(root="{urn:audit}audit",
+                                            deleted=False)),
+    ("TemplateVersion current by root",
+     lambda: TemplateVersion.objects.filter(current=True,
+                                            root="{urn:audit}audit")),
+    ("TemplateVersion current",
+     lambda: TemplateVersion.objects.filter(current=True)),
+    ("TemplateVersion by name and version",
+     lambda: TemplateVersion.objects.filter(name=_NAME, version=1,
+                                            deleted=False)),
+]
+
+def plan_stages(explanation):
+    """
+    return the names of the stages of the winning plan in the output of
+    explain(), from the root of the plan down.  For servers older than
+    MongoDB 3.0, which do not report stages, the cursor type (e.g.
+    "BasicCursor" or "BtreeCursor name_1") is returned instead.
+
+    :param explanation dict:  the output of explain()
+    :return list:  the stage names
+    """
+    if 'queryPlanner' not in explanation:
+        cursor = explanation.get('cursor')
+        out = (cursor and [cursor]) or []
+        for clause in explanation.get('clauses', []):
+            out += plan_stages(clause)
+        return out
+
+    out = []
+    plans = [ explanation['queryPlanner'].get('winningPlan', {}) ]
+    while plans:
+        plan = plans.pop(0)
+        if 'stage' in plan:
+            out.append(plan['stage'])
+        if 'inputStage' in plan:
+            plans.append(plan['inputStage'])
+        plans.extend(plan.get('inputStages', []))
+    return out
+
+def is_collection_scan(explanation):
+    """
+    return True if the winning plan in the output of explain() scans a
+    whole collection.
+
+    :param explanation dict:  the output of explain()
+    """
+    for stage in plan_stages(explanation):
+        if stage == 'COLLSCAN' or stage.startswith('BasicCursor'):
+            return True
+    return False
+
+def ensure_indexes():
+    """
+    create any of the indexes declared by the models that do not yet exist
+    """
+    for model in MODELS:
+        model.ensure_indexes()
+
+def audit_indexes(ensure=True):
+    """
+    run explain() on each of the canonical queries and report on how it
+    would be executed.
+
+    :param ensure bool:  if True, first create any declared indexes that
+                         do not yet exist
+    :return list:  a dictionary for each canonical query with its
+                   "query" description, the name of its "collection", the
+                   "stages" of its winning plan, and "scan", True if it
+                   scans a whole collection.  If explain() failed, the
+                   dictionary instead has an "error" message and "scan"
+                   is None.
+    """
+    if ensure:
+        ensure_indexes()
+
+    out = []
+    for desc, query in CANONICAL_QUERIES:
+        qs = query()
+        result = { "query": desc,
+                   "collection": qs._document._get_collection_name() }
+        try:
+            explanation = qs.explain()
+            result["stages"] = plan_stages(explanation)
+            result["scan"] = is_collection_scan(explanation)
+        except Exception, ex:
+            result["error"] = str(ex)
+            result["scan"] = None
+        out.append(result)
+    return out
+
+def log_audit(ensure=True):
+    """
+    run the audit (see audit_indexes()) and log a warning for each
+    canonical query that scans a collection.
+
+    :return int:  the number of queries that scan a collection
+    """
+    scans = 0
+    for result in audit_indexes(ensure):
+        if result["scan"] is None:
+            logger.warn("Unable to explain query, %s: %s", result["query"],
+                        result["error"])
+        elif result["scan"]:
+            scans += 1
+            logger.warn("Query scans the %s collection: %s",
+                        result["collection"], result["query"])
+    return scans
+
+def audit_at_startup():
+    """
+    run the audit (see log_audit()) if the SCHEMA_AUDIT_INDEXES setting is
+    true.  Failures are logged rather than raised.
+    """
+    try:
+        from django.conf import settings
+        if not getattr(settings, 'SCHEMA_AUDIT_INDEXES', False):
+            return
+    except Exception, ex:
+        # settings not configured (e.g. outside of the web service)
+        return
+
+    try:
+        scans = log_audit()
+        if not scans:
+            logger.info("All canonical queries are served by indexes")
+    except Exception, ex:
+        logger.exception("Unable to audit indexes: %s", str(ex))
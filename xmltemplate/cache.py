@@ -0,0 +1,117 @@
+"""
+a module providing a size-bounded, least-recently-used cache.  It is used
+for the process-wide caches of compiled validators and doctored schemas
+(see validate.py), of prepared schema loaders (see schema.py), and of 
+retrieved schema documents (see fetch.py).
+"""
+import threading
+from collections import OrderedDict
+
+class LRUCache(object):
+    """
+    a thread-safe cache that evicts its least-recently used items when the 
+    total size of its contents exceeds a given budget.  
+
+    The size of an item is given when it is added; by default, each item 
+    counts as 1, making the budget a simple limit on the number of items.  
+    The cache keeps counts of its hits, misses, and evictions.
+    """
+
+    def __init__(self, max_size):
+        """
+        create the cache
+
+        :param max_size int:  the budget for the total size of the cached items
+        """
+        self.max_size = max_size
+        self._data = OrderedDict()   # values are (item, size) tuples
+        self._size = 0
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def size(self):
+        """
+        the current total size of the cached items
+        """
+        return self._size
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def keys(self):
+        """
+        return the keys of the cached items, from least to most recently used
+        """
+        with self._lock:
+            return self._data.keys()
+
+    def get(self, key, default=None):
+        """
+        return the item cached under the given key, or default if it is not 
+        in the cache.  A successful lookup marks the item as most recently used.
+        """
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return default
+            self._data[key] = entry
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, item, size=1):
+        """
+        add an item to the cache, evicting other items as necessary to keep 
+        within the size budget.  An item larger than the entire budget is 
+        not cached.  
+        """
+        if size > self.max_size:
+            return
+        with self._lock:
+            self._remove(key)
+            self._data[key] = (item, size)
+            self._size += size
+            while self._size > self.max_size:
+                oldkey = next(iter(self._data))
+                self._remove(oldkey)
+                self.evictions += 1
+
+    def discard(self, key):
+        """
+        remove the item with the given key if it is in the cache
+        """
+        with self._lock:
+            self._remove(key)
+
+    def _remove(self, key):
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self._size -= entry[1]
+        return entry
+
+    def clear(self):
+        """
+        empty the cache (without resetting the counters)
+        """
+        with self._lock:
+            self._data.clear()
+            self._size = 0
+
+    def stats(self):
+        """
+        return a dictionary summarizing the use of the cache
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "items": len(self._data), "size": self._size,
+                "max_size": self.max_size, "hits": self.hits,
+                "misses": self.misses, "evictions": self.evictions,
+                "hit_rate": (lookups and float(self.hits) / lookups) or 0.0
+            }
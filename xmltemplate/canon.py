@@ -0,0 +1,176 @@
+"""
+a module for computing canonical digests of schema documents.
+
+Two schema documents that differ only in their formatting--indentation,
+line endings, the order of attributes, the prefixes bound to namespaces,
+or comments--have different raw content digests.  The canonical digest
+computed here is the same for both, so that a re-upload of a schema that
+has not really changed can be recognized.
+
+The digest is computed over the Canonical XML (C14N) serialization of a
+normalized copy of the parsed document:
+  *  the namespaces declared in the document are bound to generated
+     prefixes (in order of their URIs) on the root element, so that the
+     prefixes chosen by the author do not matter; no declaration is
+     dropped.
+  *  the values of XML Schema attributes that hold QNames (e.g. type and
+     base), and the prefixed names in the XPaths of selector and field
+     elements, are resolved to namespace-qualified names.
+  *  whitespace is normalized only where XML Schema allows it:  in the
+     values of attributes of schema elements whose types collapse it (i.e.
+     all except facet values, fixed, and default) and in the element-only
+     content of schema elements.  The content of documentation and appinfo
+     elements is kept as is.
+  *  comments and processing instructions are removed.
+"""
+import re, hashlib
+
+from lxml import etree
+
+XSD_NS = "http://www.w3.org/2001/XMLSchema"
+
+# the attributes of XML Schema elements that hold QNames
+QNAME_ATTRS = frozenset("type base ref itemType substitutionGroup refer".split())
+
+# the attributes of XML Schema elements that hold lists of QNames
+QNAMES_ATTRS = frozenset(["memberTypes"])
+
+# the XML Schema elements whose xpath attribute may contain prefixed names
+XPATH_ELEMENTS = frozenset(["{%s}selector" % XSD_NS, "{%s}field" % XSD_NS])
+
+# the attributes of XML Schema elements whose values are strings in which
+# whitespace is significant
+PRESERVE_ATTRS = frozenset("fixed default".split())
+
+# the XML Schema facets whose values are strings in which whitespace is
+# significant
+PRESERVE_FACETS = frozenset(["{%s}%s" % (XSD_NS, f) for f in
+                             "pattern enumeration assertion".split()])
+
+# the XML Schema elements whose content is not schema markup
+FREE_CONTENT = frozenset(["{%s}documentation" % XSD_NS,
+                          "{%s}appinfo" % XSD_NS])
+
+# matches a prefixed name test in an XPath (but not an axis, like child::)
+_XPATH_QNAME_RE = re.compile(
+    r'(?<![\w.\-:])([A-Za-z_][\w.\-]*):(?!:)([A-Za-z_][\w.\-]*|\*)')
+
+def _resolve_qname(qname, el):
+    # return the qname in {ns}local form using the prefixes in scope at el
+    if ':' in qname:
+        prefix, local = qname.split(':', 1)
+    else:
+        prefix, local = None, qname
+    ns = el.nsmap.get(prefix)
+    if ns is None:
+        return qname
+    return "{" + ns + "}" + local
+
+def _resolve_xpath(xpath, el):
+    # resolve the prefixed names in an XPath; unprefixed names are in no
+    # namespace, so they are left as they are
+    def resolve(m):
+        ns = el.nsmap.get(m.group(1))
+        if ns is None:
+            return m.group(0)
+        return "{" + ns + "}" + m.group(2)
+    return _XPATH_QNAME_RE.sub(resolve, xpath)
+
+def _attr_value(el, name, value):
+    if not el.tag.startswith("{" + XSD_NS + "}") or name.startswith("{"):
+        # not a schema attribute
+        return value
+    if name in QNAME_ATTRS:
+        return _resolve_qname(value.strip(), el)
+    if name in QNAMES_ATTRS:
+        return " ".join([_resolve_qname(q, el) for q in value.split()])
+    if name == "xpath" and el.tag in XPATH_ELEMENTS:
+        value = _resolve_xpath(value, el)
+    elif name in PRESERVE_ATTRS or \
+         (name == "value" and el.tag in PRESERVE_FACETS):
+        return value
+    return " ".join(value.split())
+
+def _namespaces(root):
+    # return the canonical prefixes for the namespaces declared in the
+    # document
+    uris = set()
+    for el in root.iter(etree.Element):
+        uris.update(el.nsmap.values())
+    return dict([("n{0}".format(i), uri)
+                 for i, uri in enumerate(sorted(uris))])
+
+def _is_free(el, free):
+    # True if the content of el is not schema markup
+    return free or el.tag in FREE_CONTENT or \
+           not el.tag.startswith("{" + XSD_NS + "}")
+
+def _text(text, free):
+    # whitespace between schema elements is insignificant
+    if not text or free or text.strip():
+        return text
+    return None
+
+def _copy(el, parent, free):
+    # copy a normalized element, and its descendants, under parent
+    attrib = dict([(name, _attr_value(el, name, value))
+                   for name, value in el.attrib.items()])
+    out = etree.SubElement(parent, el.tag, attrib)
+    _copy_content(el, out, _is_free(el, free))
+    return out
+
+def _copy_content(el, out, free):
+    text = [el.text or '']
+    last = None
+    for child in el:
+        if isinstance(child.tag, basestring):
+            _set_text(out, last, "".join(text), free)
+            last = _copy(child, out, free)
+            text = []
+        # the tail of a comment or processing instruction is joined to the
+        # text around it
+        text.append(child.tail or '')
+    _set_text(out, last, "".join(text), free)
+
+def _set_text(parent, last, text, free):
+    text = _text(text, free)
+    if last is None:
+        parent.text = text
+    else:
+        last.tail = text
+
+def canonical_tree(tree):
+    """
+    return a normalized copy of a parsed document from which its canonical
+    form is serialized (see canonical_form()).
+
+    :param tree ElementTree:  the parsed document (or its root element)
+    :return Element:  the root of the copy
+    """
+    root = tree
+    if hasattr(tree, 'getroot'):
+        root = tree.getroot()
+
+    attrib = dict([(name, _attr_value(root, name, value))
+                   for name, value in root.attrib.items()])
+    out = etree.Element(root.tag, attrib, nsmap=_namespaces(root))
+    _copy_content(root, out, _is_free(root, False))
+    return out
+
+def canonical_form(tree):
+    """
+    return the Canonical XML serialization of a normalized copy of a parsed
+    document.
+
+    :param tree ElementTree:  the parsed document (or its root element)
+    """
+    return etree.tostring(canonical_tree(tree).getroottree(), method="c14n",
+                          with_comments=False)
+
+def canonical_digest(tree):
+    """
+    return the canonical digest (a hex string) of a parsed document.
+
+    :param tree ElementTree:  the parsed document (or its root element)
+    """
+    return hashlib.sha1(canonical_form(tree)).hexdigest()
@@ -0,0 +1,283 @@
+"""
+a module for resolving schema locations and namespaces via OASIS XML
+catalogs.
+
+An XMLCatalog maps the schemaLocation URLs and namespaces that appear in
+include and import statements to local copies of the schema documents, so
+that schemas can be ingested without network access.  A catalog can be read
+from an OASIS XML catalog file (supporting the uri, system, public,
+rewriteURI, rewriteSystem, and nextCatalog entries) and/or configured with
+directory mirrors that map a base URL to a local directory.  A catalog entry
+may also map a reference to a schema already loaded into the database by
+giving a URI of the form "schemaname:NAME".
+"""
+import os, threading, logging
+from urlparse import urljoin, urlparse
+from urllib import pathname2url
+
+from lxml import etree
+
+logger = logging.getLogger(__name__)
+
+CATALOG_NS = "urn:oasis:names:tc:entity:xmlns:xml:catalog"
+XML_NS = "http://www.w3.org/XML/1998/namespace"
+
+# the prefix of catalog URIs that refer to schemas loaded into the database
+SCHEMANAME_SCHEME = "schemaname:"
+
+class CatalogError(Exception):
+    """
+    An indication that an XML catalog could not be read.
+    """
+    pass
+
+def _file_url(path):
+    return urljoin("file:", pathname2url(os.path.abspath(path)))
+
+class XMLCatalog(object):
+    """
+    a class for mapping references to schema documents to local copies.
+
+    Exact matches (via uri, system, and public entries) are looked up in
+    dictionaries; rewrite entries and mirrors are matched by the longest
+    matching prefix.  Catalogs named by nextCatalog entries are read (once)
+    only when no match is found in this one.  Each catalog file is consulted
+    at most once per lookup, so catalogs that chain back to each other are
+    safe.
+    """
+
+    def __init__(self):
+        self._uri = {}
+        self._system = {}
+        self._public = {}
+        self._rewrite_uri = []     # (prefix, replacement) pairs
+        self._rewrite_system = []
+        self._next = []            # paths or loaded XMLCatalogs
+        self._paths = set()        # the canonical paths of the files read
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_file(cls, path):
+        """
+        read an OASIS XML catalog from a file
+
+        :param path str:  the path to the catalog file
+        :raises CatalogError:  if the file cannot be read or parsed
+        """
+        out = cls()
+        out.read(path)
+        return out
+
+    def read(self, path):
+        """
+        add the entries from an OASIS XML catalog file to this catalog.
+        Relative URIs in the file are resolved against the file's location
+        (or its xml:base attributes).
+
+        :param path str:  the path to the catalog file
+        :raises CatalogError:  if the file cannot be read or parsed
+        """
+        try:
+            root = etree.parse(path).getroot()
+        except (IOError, etree.XMLSyntaxError), ex:
+            raise CatalogError("Unable to read XML catalog, {0}: {1}".
+                               format(path, str(ex)))
+        if root.tag != "{%s}catalog" % CATALOG_NS:
+            raise CatalogError("Not an OASIS XML catalog: " + path)
+        self._paths.add(os.path.realpath(path))
+        self._read_entries(root, _file_url(path))
+
+    def _read_entries(self, parent, base):
+        base = urljoin(base, parent.get("{%s}base" % XML_NS, ""))
+        for el in parent:
+            if not isinstance(el.tag, basestring) or \
+               not el.tag.startswith("{%s}" % CATALOG_NS):
+                continue
+            tag = el.tag[len(CATALOG_NS)+2:]
+
+            if tag == "group":
+                self._read_entries(el, base)
+            elif tag == "uri":
+                self.add_uri(el.get("name"), self._target(el.get("uri"), base))
+            elif tag == "system":
+                self.add_system(el.get("systemId"),
+                                self._target(el.get("uri"), base))
+            elif tag == "public":
+                self._public[el.get("publicId")] = \
+                    self._target(el.get("uri"), base)
+            elif tag == "rewriteURI":
+                self.add_rewrite_uri(el.get("uriStartString"),
+                                     self._target(el.get("rewritePrefix"),base))
+            elif tag == "rewriteSystem":
+                self.add_rewrite_system(el.get("systemIdStartString"),
+                                     self._target(el.get("rewritePrefix"),base))
+            elif tag == "nextCatalog":
+                path = urlparse(urljoin(base, el.get("catalog"))).path
+                self._next.append(os.path.realpath(path))
+
+    def _target(self, uri, base):
+        if uri.startswith(SCHEMANAME_SCHEME):
+            return uri
+        return urljoin(base, uri)
+
+    def add_uri(self, name, uri):
+        """
+        map a URI (or namespace) to the URI of a local copy
+        """
+        self._uri[name] = uri
+
+    def add_system(self, systemid, uri):
+        """
+        map a system identifier (i.e. a schemaLocation) to the URI of a local
+        copy
+        """
+        self._system[systemid] = uri
+
+    def add_rewrite_uri(self, prefix, replacement):
+        """
+        map all URIs that start with a prefix to local copies by replacing
+        the prefix
+        """
+        self._add_rewrite(self._rewrite_uri, prefix, replacement)
+
+    def add_rewrite_system(self, prefix, replacement):
+        """
+        map all system identifiers that start with a prefix to local copies
+        by replacing the prefix
+        """
+        self._add_rewrite(self._rewrite_system, prefix, replacement)
+
+    def add_mirror(self, baseurl, directory):
+        """
+        map all locations under a base URL to files under a local directory
+        that mirrors it.
+        """
+        if not baseurl.endswith('/'):
+            baseurl += '/'
+        target = _file_url(directory) + '/'
+        self.add_rewrite_uri(baseurl, target)
+        self.add_rewrite_system(baseurl, target)
+
+    def _add_rewrite(self, rewrites, prefix, replacement):
+        rewrites.append( (prefix, replacement) )
+        # the longest matching prefix wins
+        rewrites.sort(key=lambda r: len(r[0]), reverse=True)
+
+    def _rewrite(self, rewrites, ref):
+        for prefix, replacement in rewrites:
+            if ref.startswith(prefix):
+                return replacement + ref[len(prefix):]
+        return None
+
+    def _next_catalogs(self):
+        # return (path, XMLCatalog) pairs for the nextCatalog entries, 
+        # reading them if necessary
+        with self._lock:
+            for i in xrange(len(self._next)):
+                if not isinstance(self._next[i], tuple):
+                    path = self._next[i]
+                    try:
+                        self._next[i] = (path, XMLCatalog.from_file(path))
+                    except CatalogError, ex:
+                        logger.warn("Skipping nextCatalog: %s", str(ex))
+                        self._next[i] = (path, XMLCatalog())
+            return list(self._next)
+
+    def _match(self, kind, ref):
+        # look up a reference in this catalog's own entries
+        if kind == "uri":
+            return self._uri.get(ref) or self._rewrite(self._rewrite_uri, ref)
+        if kind == "system":
+            return self._system.get(ref) or \
+                   self._rewrite(self._rewrite_system, ref)
+        return self._public.get(ref)
+
+    def _resolve(self, kind, ref, visited=None):
+        # look up a reference in this catalog and then in the next catalogs,
+        # skipping any catalog file already consulted
+        out = self._match(kind, ref)
+        if out:
+            return out
+        if visited is None:
+            visited = set(self._paths)
+        for path, cat in self._next_catalogs():
+            if path in visited:
+                continue
+            visited.add(path)
+            out = cat._resolve(kind, ref, visited)
+            if out:
+                return out
+        return None
+
+    def resolve_uri(self, uri):
+        """
+        return the URI of a local copy of the resource with the given URI,
+        or None if the catalog has no mapping for it.
+        """
+        return self._resolve("uri", uri)
+
+    def resolve_system(self, systemid):
+        """
+        return the URI of a local copy of the resource with the given system
+        identifier, or None if the catalog has no mapping for it.
+        """
+        return self._resolve("system", systemid)
+
+    def resolve_public(self, publicid):
+        """
+        return the URI of a local copy of the resource with the given public
+        identifier, or None if the catalog has no mapping for it.
+        """
+        return self._resolve("public", publicid)
+
+    def resolve(self, location=None, namespace=None):
+        """
+        return the URI of a local copy of a schema referenced by an include
+        or import statement, or None if the catalog has no mapping for it.
+        The schemaLocation is looked up first (as a system identifier, then
+        as a URI), followed by the namespace (as a URI, then as a public
+        identifier).  A returned URI that starts with "schemaname:" refers
+        to a schema already loaded into the database.
+
+        :param location  str:  the schemaLocation value
+        :param namespace str:  the namespace (for an import)
+        """
+        out = None
+        if location:
+            out = self.resolve_system(location) or self.resolve_uri(location)
+        if not out and namespace:
+            out = self.resolve_uri(namespace) or self.resolve_public(namespace)
+        return out
+
+_default = None
+_default_lock = threading.Lock()
+
+def get_catalog():
+    """
+    return the process-wide catalog.  It is built from the catalog files
+    listed in the SCHEMA_CATALOG_FILES setting and the directory mirrors
+    given in the SCHEMA_MIRRORS setting (a dictionary mapping base URLs to
+    directories), when available.
+    """
+    global _default
+    with _default_lock:
+        if _default is None:
+            catfiles = []
+            mirrors = {}
+            try:
+                from django.conf import settings
+                catfiles = getattr(settings, 'SCHEMA_CATALOG_FILES', [])
+                mirrors = getattr(settings, 'SCHEMA_MIRRORS', {})
+            except Exception, ex:
+                # settings not configured (e.g. outside of the web service)
+                pass
+
+            _default = XMLCatalog()
+            for path in catfiles:
+                try:
+                    _default.read(path)
+                except CatalogError, ex:
+                    logger.error(str(ex))
+            for baseurl, directory in mirrors.iteritems():
+                _default.add_mirror(baseurl, directory)
+        return _default
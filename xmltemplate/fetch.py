@@ -0,0 +1,255 @@
+"""
+a module for retrieving schema documents from remote locations.
+
+The SchemaFetcher class in this module retrieves documents over HTTP(S)
+through persistent, connection-pooled sessions (one per thread, as a 
+requests Session is not safe to share between threads) and keeps a cache 
+of what it has retrieved.  Cached documents are stored under the hash of their
+content (so identical documents retrieved from different URLs are stored
+once) and are revalidated with the server using the ETag and Last-Modified
+values it provided; a document that has not changed is not downloaded
+again.  The cache can be kept on disk so that it persists across ingests
+and server restarts; otherwise, it is kept in memory within a size budget.
+"""
+import os, json, hashlib, threading, logging, tempfile
+from urlparse import urlparse
+from urllib import url2pathname
+
+import requests
+
+from .cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+# the default number of seconds to wait for a remote server to respond
+DEFAULT_TIMEOUT = 30
+
+# the default memory budget, in bytes, for a cache kept in memory
+DEFAULT_MEMORY_CACHE_BYTES = 32 * 1024 * 1024
+
+class SchemaFetchError(Exception):
+    """
+    An indication that a schema document could not be retrieved.
+    """
+    def __init__(self, url, message):
+        super(SchemaFetchError, self).__init__(
+            "Unable to retrieve schema at URL={0}: {1}".format(url, message))
+        self.url = url
+
+class _MemoryStore(object):
+    # a cache store that keeps everything in memory, evicting the least 
+    # recently used entries and documents when their total size exceeds 
+    # a budget.  An entry whose document was evicted is simply a miss.
+
+    def __init__(self, max_bytes=DEFAULT_MEMORY_CACHE_BYTES):
+        self._cache = LRUCache(max_bytes)
+
+    def get_entry(self, url):
+        return self._cache.get(("entry", url))
+
+    def put_entry(self, url, entry):
+        self._cache.put(("entry", url), entry, len(json.dumps(entry)))
+
+    def get_content(self, digest):
+        return self._cache.get(("content", digest))
+
+    def put_content(self, digest, content):
+        self._cache.put(("content", digest), content, len(content))
+
+class _DiskStore(object):
+    # a cache store that keeps documents in a directory:  the metadata for
+    # each URL is kept in index/, and the documents in objects/, named by
+    # the hash of their content.
+
+    def __init__(self, cachedir):
+        self.cachedir = cachedir
+        self._indexdir = os.path.join(cachedir, "index")
+        self._objdir = os.path.join(cachedir, "objects")
+        for d in (self._indexdir, self._objdir):
+            if not os.path.isdir(d):
+                os.makedirs(d)
+
+    def _entry_path(self, url):
+        return os.path.join(self._indexdir,
+                            hashlib.sha1(url).hexdigest() + ".json")
+
+    def get_entry(self, url):
+        path = self._entry_path(url)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path) as fd:
+                return json.load(fd)
+        except (IOError, ValueError), ex:
+            logger.warn("Ignoring unreadable fetch cache entry, %s: %s",
+                        path, str(ex))
+            return None
+
+    def put_entry(self, url, entry):
+        self._write(self._entry_path(url), json.dumps(entry))
+
+    def get_content(self, digest):
+        path = os.path.join(self._objdir, digest)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as fd:
+            return fd.read()
+
+    def put_content(self, digest, content):
+        path = os.path.join(self._objdir, digest)
+        if not os.path.exists(path):
+            self._write(path, content)
+
+    def _write(self, path, data):
+        # write via a temporary file so that readers never see a partial file
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'wb') as out:
+            out.write(data)
+        os.rename(tmp, path)
+
+class SchemaFetcher(object):
+    """
+    a class for retrieving schema documents from URLs, caching them for
+    later retrievals.  "file:" URLs are read directly.
+
+    :property stats dict:  counts of the fetcher's activity:  "hits" (served
+                           from the cache after the server confirmed it was
+                           unchanged), "misses" (downloaded in full),
+                           "stale" (served from the cache because the server
+                           could not be reached), and "errors".
+    """
+
+    def __init__(self, cachedir=None, timeout=DEFAULT_TIMEOUT, session=None,
+                 max_bytes=DEFAULT_MEMORY_CACHE_BYTES):
+        """
+        create the fetcher
+
+        :param cachedir str:  the directory to keep cached documents in; if
+                                None, they are cached in memory for the life
+                                of the fetcher.
+        :param timeout float: the number of seconds to wait for a server to
+                                respond
+        :param session:       the requests.Session to use; if None, one is
+                                created for each thread that fetches.  A
+                                given session is shared by all threads,
+                                which take turns using it.
+        :param max_bytes int: the budget for the total size of the documents
+                                cached in memory (ignored if cachedir is 
+                                given); the least recently used are evicted
+                                to stay within it.
+        """
+        self._shared = session
+        self._shared_lock = threading.Lock()
+        self._local = threading.local()
+        self.timeout = timeout
+        if cachedir:
+            self._store = _DiskStore(cachedir)
+        else:
+            self._store = _MemoryStore(max_bytes)
+
+        self._lock = threading.Lock()
+        self.stats = { "hits": 0, "misses": 0, "stale": 0, "errors": 0 }
+
+    @property
+    def session(self):
+        """
+        the requests.Session used by the current thread
+        """
+        if self._shared is not None:
+            return self._shared
+        out = getattr(self._local, 'session', None)
+        if out is None:
+            out = requests.Session()
+            self._local.session = out
+        return out
+
+    def _get(self, url, headers):
+        if self._shared is not None:
+            with self._shared_lock:
+                return self._shared.get(url, headers=headers,
+                                        timeout=self.timeout)
+        return self.session.get(url, headers=headers, timeout=self.timeout)
+
+    def _count(self, stat):
+        with self._lock:
+            self.stats[stat] += 1
+
+    def fetch(self, url):
+        """
+        return the content of the document at the given URL
+
+        :param url str:  the URL of the document
+        :return str:  the document content (as retrieved, without decoding)
+        :raises SchemaFetchError:  if the document could not be retrieved
+        """
+        if url.startswith("file:"):
+            try:
+                with open(url2pathname(urlparse(url).path), 'rb') as fd:
+                    return fd.read()
+            except IOError, ex:
+                self._count("errors")
+                raise SchemaFetchError(url, str(ex))
+
+        entry = self._store.get_entry(url)
+        cached = None
+        headers = {}
+        if entry:
+            cached = self._store.get_content(entry['digest'])
+        if cached is not None:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+
+        try:
+            resp = self._get(url, headers)
+            if resp.status_code == 304 and cached is not None:
+                self._count("hits")
+                return cached
+            resp.raise_for_status()
+        except requests.RequestException, ex:
+            if cached is not None and not isinstance(ex, requests.HTTPError):
+                logger.warn("Using cached copy of %s: %s", url, str(ex))
+                self._count("stale")
+                return cached
+            self._count("errors")
+            raise SchemaFetchError(url, str(ex))
+
+        content = resp.content
+        digest = hashlib.sha1(content).hexdigest()
+        self._store.put_content(digest, content)
+        self._store.put_entry(url, {
+            'url': url, 'digest': digest,
+            'etag': resp.headers.get('ETag'),
+            'last_modified': resp.headers.get('Last-Modified')
+        })
+        self._count("misses")
+        return content
+
+_default = None
+_default_lock = threading.Lock()
+
+def get_fetcher():
+    """
+    return the process-wide fetcher.  Its cache directory, timeout, and 
+    memory budget are taken from the SCHEMA_FETCH_CACHE_DIR, 
+    SCHEMA_FETCH_TIMEOUT, and SCHEMA_FETCH_CACHE_BYTES settings when 
+    available.
+    """
+    global _default
+    with _default_lock:
+        if _default is None:
+            cachedir = None
+            timeout = DEFAULT_TIMEOUT
+            max_bytes = DEFAULT_MEMORY_CACHE_BYTES
+            try:
+                from django.conf import settings
+                cachedir = getattr(settings, 'SCHEMA_FETCH_CACHE_DIR', None)
+                timeout = getattr(settings, 'SCHEMA_FETCH_TIMEOUT', timeout)
+                max_bytes = getattr(settings, 'SCHEMA_FETCH_CACHE_BYTES',
+                                    max_bytes)
+            except Exception, ex:
+                # settings not configured (e.g. outside of the web service)
+                pass
+            _default = SchemaFetcher(cachedir, timeout, max_bytes=max_bytes)
+        return _default
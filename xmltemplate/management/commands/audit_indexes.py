@@ -0,0 +1,36 @@
+"""
+a management command that checks that the canonical model queries are
+served by indexes (see xmltemplate.audit).
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from xmltemplate import audit
+
+class Command(BaseCommand):
+    help = "Create the declared indexes and report any canonical query " \
+           "that scans a whole collection"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--no-ensure', action='store_false',
+                            dest='ensure', default=True,
+                            help="do not create missing declared indexes "+
+                                 "before auditing")
+
+    def handle(self, *args, **options):
+        scans = 0
+        for result in audit.audit_indexes(options['ensure']):
+            if result["scan"] is None:
+                status = "ERROR"
+                detail = result["error"]
+            else:
+                status = (result["scan"] and "SCAN") or "ok"
+                detail = " > ".join(result["stages"])
+                if result["scan"]:
+                    scans += 1
+            self.stdout.write("{0:5} {1}: {2}".format(status, result["query"],
+                                                      detail))
+
+        if scans:
+            raise CommandError("{0} canonical quer{1} scan{2} a collection".
+                               format(scans, (scans == 1 and "y") or "ies",
+                                      (scans == 1 and "s") or ""))
@@ -0,0 +1,17 @@
+"""
+a management command that fills in the denormalized fields of the records
+saved by earlier versions of this package (see 
+xmltemplate.models.sync_records()).  Run it after upgrading unless the 
+SCHEMA_SYNC_RECORDS setting is turned on.
+"""
+from django.core.management.base import BaseCommand
+
+from xmltemplate import models
+
+class Command(BaseCommand):
+    help = "Fill in the denormalized fields missing from records saved by " \
+           "earlier versions"
+
+    def handle(self, *args, **options):
+        models.sync_records()
+        self.stdout.write("Records are up to date")
@@ -2,9 +2,67 @@
 Models classes for data presisted in the MDCS MongoDB supporting XML-based
 curation templates.
 """
+import logging
+from collections import OrderedDict as ODict
 
 from django_mongoengine import fields, Document
 from django.db.models import Max
+from mongoengine import Q
+from lxml import etree
+
+from .canon import canonical_digest
+
+logger = logging.getLogger(__name__)
+
+_current_change_listeners = []
+
+def on_current_change(listener):
+    """
+    register a function to be called whenever the set of schema versions 
+    considered current (or available) changes--i.e. after a version is made 
+    current, deleted, or undeleted.  The function will be called with the 
+    name of the affected schema as its only argument.  This allows, for 
+    example, caches of compiled validators to be invalidated.
+
+    :param listener function:  the function to call
+    """
+    if listener not in _current_change_listeners:
+        _current_change_listeners.append(listener)
+
+def _notify_current_change(name):
+    # call each of the registered listeners, insulating the caller from 
+    # their failures
+    for listener in list(_current_change_listeners):
+        try:
+            listener(name)
+        except Exception, ex:
+            logger.exception("current-change listener failed for schema, "+
+                             "%s: %s", name, str(ex))
+
+def _latest_version(versioncls, name):
+    # return the highest version number stored for the given name (0 if 
+    # there are none), using the (name, version) index
+    vers = versioncls.objects.filter(name=name).order_by('-version') \
+                                               .only('version')[:1]
+    return (len(vers) > 0 and vers[0].version) or 0
+
+def _allocate_version(commoncls, versioncls, name):
+    # atomically increment and return the version counter (lastver) on the
+    # common record with the given name.  A record created before the 
+    # counter was introduced is first seeded with the highest version 
+    # already stored; the seeding is conditional, so concurrent callers 
+    # cannot seed it twice.
+    out = commoncls.objects(name=name, lastver__exists=True) \
+                   .modify(inc__lastver=1, new=True)
+    if out is None:
+        commoncls.objects(name=name, lastver__exists=False) \
+                 .update_one(set__lastver=_latest_version(versioncls, name))
+        out = commoncls.objects(name=name, lastver__exists=True) \
+                       .modify(inc__lastver=1, new=True)
+        if out is None:
+            raise commoncls.DoesNotExist("No {0} record with name={1}".
+                                         format(commoncls.__name__, name))
+    return out.lastver
 
 class SchemaCommon(Document):
     """
@@ -27,11 +85,17 @@ class SchemaCommon(Document):
     :property current int:    the version number of the schema that should be
                                  considered the current one.
     :property desc str:       a brief (displayable) description of the schema.  
+    :property lastver int:    the last version number allocated for the 
+                                 schema (see allocate_version()); unset 
+                                 until the first allocation.
     """
     name      = fields.StringField(unique=True)
     namespace = fields.StringField(blank=False)
     current   = fields.IntField(blank=False)
     desc      = fields.StringField(default="")
+    lastver   = fields.IntField()
+
+    meta = { 'indexes': [ 'namespace' ] }
 
     @classmethod
     def get_by_name(self, name, allowdeleted=False):
@@ -69,6 +133,14 @@ class SchemaCommon(Document):
         currently marked as current.
         """
         return SchemaVersion.get_by_version(self.name, self.current)
+
+    def allocate_version(self):
+        """
+        reserve and return the next version number for this schema.  The 
+        number is allocated with a single atomic update of this record, so 
+        concurrent loads of the same schema always get distinct numbers.
+        """
+        return _allocate_version(SchemaCommon, SchemaVersion, self.name)
         
     @classmethod
     def get_namespaces(self):
@@ -115,9 +187,18 @@ class SchemaVersion(Document):
                               more recent versions.  
     :property common ref:   a reference to the schema's common information
                               record in the Schema collection.
+    :property namespace str:  a copy of the namespace of the common record,
+                              so that versions can be selected by namespace
+                              without dereferencing it (see Schema.find());
+                              if not set, it is copied when the record is 
+                              saved.
     :property location str:   a location for the schema (as a URL or filename)
     :property content str:    the XML document defining the schema
     :property digest str:     the hash digest of the content value
+    :property canon_digest str:  the canonical digest of the content, which 
+                              is insensitive to formatting (see canon.py);
+                              empty for records loaded before it was 
+                              introduced.
     :property prefixes dict:  a mapping of prefixes to namespaces
     :property includes list:  a list of names for schemas that 
                               should be included as part of this one.  Each
@@ -127,6 +208,25 @@ class SchemaVersion(Document):
                               should be imported into this one.  Each
                               value corresponds to a SchemaCommon record
                               with this name.
+    :property doctored str:   a version of the content in which the 
+                              schemaLocations of the includes and imports 
+                              refer to the schemas by name (see 
+                              validate.SchemaProvider); empty if the 
+                              content needs no doctoring.
+    :property closure list:   the versions of all the schemas this one 
+                              depends on, directly or indirectly, via 
+                              includes and imports, each of the form 
+                              "NAME::VERSION".  These are the versions that 
+                              were current when this version was loaded.
+    :property flattened str:  a self-contained version of the content in 
+                              which the schemas it includes from the same 
+                              namespace are inlined (see 
+                              validate.SchemaFlattener); empty if it has 
+                              not been flattened.
+    :property bundle list:    the other schema documents that the flattened 
+                              content refers to (by name) via its imports and
+                              chameleon includes.  Each item is a dictionary 
+                              with a "name" and the flattened "content".
     :property status int:     integer indicating whether record is deleted (0),
                               current (2), or otherwise (1)
     :property comment str:    A brief (displayable) comment noting what is 
@@ -135,15 +235,31 @@ class SchemaVersion(Document):
     name      = fields.StringField(unique_with=['version'], required=True)
     version   = fields.IntField(unique_with=['name'], required=True)
     common    = fields.ReferenceField(SchemaCommon)
+    namespace = fields.StringField()
     location  = fields.StringField(blank=True)
     content   = fields.StringField(blank=False)
     digest    = fields.StringField(blank=False)
+    canon_digest = fields.StringField(default="")
     prefixes  = fields.DictField(default={}, blank=True)
     includes  = fields.ListField(fields.StringField(), default=[], blank=True)
     imports   = fields.ListField(fields.StringField(), default=[], blank=True)
+    doctored  = fields.StringField(default="")
+    closure   = fields.ListField(fields.StringField(), default=[], blank=True)
+    flattened = fields.StringField(default="")
+    bundle    = fields.ListField(fields.DictField(), default=[], blank=True)
     status    = fields.IntField(blank=False, default=1)
     comment   = fields.StringField(default="")
 
+    # (name, version) is indexed via its uniqueness constraint
+    meta = { 'indexes': [ ('name', 'status'), 'status', ('digest', 'name'),
+                          ('canon_digest', 'name'), ('namespace', 'status'),
+                          ('location', 'namespace') ] }
+
+    def save(self, *args, **kwargs):
+        if self.namespace is None and self.common:
+            self.namespace = self.common.namespace
+        return super(SchemaVersion, self).save(*args, **kwargs)
+
     @classmethod
     def get_all_by_name(cls, name, include_deleted=False):
         """
@@ -184,6 +300,21 @@ class SchemaVersion(Document):
         if name:
             svs = svs.filter(name=name)
         return (len(svs) > 0 and svs[0]) or None
+
+    @classmethod
+    def get_by_canon_digest(cls, canon_digest, name=None):
+        """
+        Return the SchemaVersion instance that matches a given canonical 
+        digest (i.e. one whose content differs from the digested content 
+        only in formatting).  Note that the returned instance may be marked 
+        as deleted.
+        """
+        if not canon_digest:
+            return None
+        svs = cls.objects.filter(canon_digest=canon_digest)
+        if name:
+            svs = svs.filter(name=name)
+        return (len(svs) > 0 and svs[0]) or None
             
 
     @classmethod
@@ -193,14 +324,42 @@ class SchemaVersion(Document):
         """
         return SchemaVersion.objects.filter(status=RECORD.IS_CURRENT)
 
+    @classmethod
+    def get_pinned(cls, pins):
+        """
+        return the SchemaVersion records for a list of pinned versions with 
+        a single query.  
+
+        :param pins list:  a list of pinned versions of the form 
+                             "NAME::VERSION" (as stored in the closure field)
+        :return dict:  a dictionary mapping schema names to SchemaVersion 
+                       records.  If a name is pinned more than once, the 
+                       first version listed is used.
+        """
+        wanted = ODict()
+        for pin in pins:
+            name, version = pin.rsplit('::', 1)
+            if name not in wanted:
+                wanted[name] = int(version)
+        if not wanted:
+            return {}
+
+        query = reduce(lambda q1, q2: q1 | q2,
+                       [Q(name=n, version=v) for n, v in wanted.iteritems()])
+        return dict([(sv.name, sv) for sv in SchemaVersion.objects(query)])
+
     @classmethod
     def next_version_for(self, name):
-        try: 
-            return max(map(lambda v: v.version,
-                           SchemaVersion.objects.filter(name=name))) + 1
-        except ValueError, ex:
-            # none found with this name
-            return 1
+        """
+        return the version number that the next version of the named schema
+        is expected to get.  The number is not reserved; use 
+        SchemaCommon.allocate_version() to reserve it.
+        """
+        latest = _latest_version(SchemaVersion, name)
+        sc = SchemaCommon.objects.filter(name=name).only('lastver')
+        if len(sc) > 0 and sc[0].lastver:
+            latest = max(latest, sc[0].lastver)
+        return latest + 1
         
 
 class Schema(object):
@@ -216,8 +375,10 @@ class Schema(object):
     get_by_name(), to select a desired, existing schema.  It does not 
     create new Schema instances (use SchemaLoader for that).  
     """
-    _ver_props = ("name version location content digest prefixes "+
-                  "includes imports status comment").split()
+    _ver_props = ("name version location content digest canon_digest "+
+                  "prefixes "+
+                  "includes imports doctored closure flattened bundle status "+
+                  "comment").split()
     _comm_props = "namespace current desc"
 
     def __init__(self, schemaVersion):
@@ -230,6 +391,8 @@ class Schema(object):
         if name == 'description':  name = "desc"
         if name in Schema._ver_props:
             return getattr(self._wrapped, name)
+        elif name == 'namespace' and self._wrapped.namespace is not None:
+            return self._wrapped.namespace
         elif name in Schema._comm_props:
             return getattr(self._wrapped.common, name)
         else:
@@ -274,6 +437,9 @@ class Schema(object):
                     oldcurr._wrapped.status = RECORD.AVAILABLE
                     oldcurr._wrapped.save()
 
+            _flag_current_defs(self.name, self.version)
+            _notify_current_change(self.name)
+
     def delete(self):
         """
         delete this version of the schema
@@ -297,9 +463,11 @@ class Schema(object):
                 # LOG that we're deleting the only current version
                 self._wrapped.common.current = 0
                 self._wrapped.common.save()
+                _flag_current_defs(self.name, 0)
 
         self._wrapped.status = RECORD.DELETED
         self._wrapped.save()
+        _notify_current_change(self.name)
 
     def undelete(self):
         """
@@ -309,6 +477,48 @@ class Schema(object):
         if self.status == RECORD.DELETED:
             self._wrapped.status = RECORD.AVAILABLE
             self._wrapped.save()
+            _notify_current_change(self.name)
+
+    @classmethod
+    def sync_current_flags(cls):
+        """
+        set the current flags on all GlobalType and GlobalElement records 
+        according to the current versions of their schemas.  The flags are 
+        normally kept up to date as versions are made current or deleted; 
+        this is needed only for records created before the flags were 
+        introduced.
+        """
+        for sc in SchemaCommon.objects.only('name', 'current'):
+            _flag_current_defs(sc.name, sc.current)
+
+    @classmethod
+    def sync_canon_digests(cls):
+        """
+        compute the canonical digests of the SchemaVersion records that 
+        were loaded before they were introduced.  Records whose content 
+        cannot be parsed are left without one.
+        """
+        missing = Q(canon_digest__exists=False) | Q(canon_digest="")
+        for sv in SchemaVersion.objects(missing).only('name', 'version',
+                                                      'content'):
+            try:
+                root = etree.fromstring(sv.content.encode('utf-8'))
+            except (etree.XMLSyntaxError, ValueError), ex:
+                logger.warn("Unable to parse schema, %s/%s: %s", sv.name,
+                            sv.version, str(ex))
+                continue
+            sv.update(set__canon_digest=canonical_digest(root))
+
+    @classmethod
+    def sync_namespaces(cls):
+        """
+        copy the namespaces of the SchemaCommon records onto the 
+        SchemaVersion records that were saved before SchemaVersion had 
+        a namespace of its own.
+        """
+        for sc in SchemaCommon.objects.only('name', 'namespace'):
+            SchemaVersion.objects(name=sc.name, namespace=None) \
+                         .update(set__namespace=sc.namespace)
 
     def find_including_schema_names(self):
         """
@@ -340,10 +550,14 @@ class Schema(object):
         :param digest     str:  the schema content digest to match
         :param deleted   bool:  whether the schema is marked as deleted
         :param current   bool:  if true, select only schemas marked as current
+
+        All of the keywords are matched against the SchemaVersion records 
+        with a single query.
         """
         versions = SchemaVersion.objects.all()
         for keywd in kwds:
-            if keywd in cls._ver_props or keywd in ['deleted', 'current']:
+            if keywd in cls._ver_props or \
+               keywd in ['namespace', 'deleted', 'current']:
                 if keywd == 'deleted':
                     op = (not kwds['deleted'] and "__ne") or ""
                     use = { 'status'+op: RECORD.DELETED }
@@ -353,23 +567,8 @@ class Schema(object):
                 else:
                     use = { keywd: kwds[keywd] }
                 versions = versions.filter(**use)
-        ided = []
-        for ver in versions:
-            if 'name' in kwds and ver.common.name != kwds['name']:
-                continue
-            if 'namespace' in kwds and ver.common.namespace != kwds['namespace']:
-                continue
-            if 'current' in kwds:
-                iscurrent = ver.common.current == ver.version
-                if kwds['current'] != iscurrent:
-                    continue
-            ided.append(ver)
 
-        out = []
-        for ver in ided:
-            out.append(Schema(ver))
-
-        return out
+        return [Schema(ver) for ver in versions]
 
     @classmethod
     def _find_one(cls, **kwds):
@@ -477,6 +676,27 @@ def _find_importers(name, found):
         _find_importers(sv.name, found)
 
     
+def _flag_current_defs(schemaname, version):
+    # update the denormalized current flags on the global types and elements
+    # defined in the named schema so that only those of the given version 
+    # (if greater than 0) are flagged.  (Records saved before the flags
+    # were introduced have no current field at all, hence current__ne.)
+    for defcls in (GlobalType, GlobalElement):
+        defcls.objects(schemaname=schemaname, current=True,
+                       version__ne=version).update(set__current=False)
+        if version > 0:
+            defcls.objects(schemaname=schemaname, version=version,
+                           current__ne=True).update(set__current=True)
+
+def _flag_current_templates(name, version):
+    # update the denormalized current flags on the versions of the named 
+    # template so that only the given version (if greater than 0) is flagged.
+    TemplateVersion.objects(name=name, current=True,
+                            version__ne=version).update(set__current=False)
+    if version > 0:
+        TemplateVersion.objects(name=name, version=version,
+                                current__ne=True).update(set__current=True)
+
 class GlobalElementAnnots(Document):
     """
     Storage model for annotations on a global element.  The purpose of this 
@@ -517,6 +737,9 @@ class GlobalElement(Document):
                               this version of the element is defined
     :property annots     ref: a reference to the GlobalElementAnnots that 
                               contains user annotations.  
+    :property current   bool: True if this element is defined in the current 
+                              version of its schema.  This is maintained by 
+                              Schema.make_current() and Schema.delete().
     """
     name      = fields.StringField(unique_with=["namespace",
                                                 "schemaname", "version"])
@@ -525,6 +748,10 @@ class GlobalElement(Document):
     version   = fields.IntField()
     schema    = fields.ReferenceField(SchemaVersion)
     annots    = fields.ReferenceField(GlobalElementAnnots)
+    current   = fields.BooleanField(default=False)
+
+    meta = { 'indexes': [ ('namespace', 'name', 'current'),
+                          ('schemaname', 'version') ] }
 
     @property
     def qname(self):
@@ -533,6 +760,18 @@ class GlobalElement(Document):
         """
         return "{{{0}}}{1}".format(self.namespace, self.name)
 
+    @classmethod
+    def find_current(cls, namespace, name):
+        """
+        return the elements with the given qualified name that are defined 
+        in the current versions of their schemas (normally, there is at most
+        one).  This is a single indexed query.
+
+        :param namespace str:  the namespace of the element
+        :param name      str:  the local name of the element
+        """
+        return cls.objects.filter(namespace=namespace, name=name, current=True)
+
     @classmethod
     def get_all_elements(cls):
         """
@@ -604,6 +843,9 @@ class GlobalType(Document):
                               Each type name is in "{NS}NAME" format.
     :property annots     ref: a reference to the GlobalElementAnnots that 
                               contains user annotations.  
+    :property current   bool: True if this type is defined in the current 
+                              version of its schema.  This is maintained by 
+                              Schema.make_current() and Schema.delete().
     """
     name      = fields.StringField(unique_with=["namespace",
                                                 "schemaname", "version"])
@@ -614,6 +856,10 @@ class GlobalType(Document):
     abstract  = fields.BooleanField(blank=False, default=False)
     anscestors= fields.ListField(fields.StringField(), default=[], blank=True)
     annots    = fields.ReferenceField(GlobalTypeAnnots)
+    current   = fields.BooleanField(default=False)
+
+    meta = { 'indexes': [ ('namespace', 'name', 'current'),
+                          ('schemaname', 'version'), 'anscestors' ] }
 
     @property
     def qname(self):
@@ -622,6 +868,18 @@ class GlobalType(Document):
         """
         return "{{{0}}}{1}".format(self.namespace, self.name)
 
+    @classmethod
+    def find_current(cls, namespace, name):
+        """
+        return the types with the given qualified name that are defined 
+        in the current versions of their schemas (normally, there is at most
+        one).  This is a single indexed query.
+
+        :param namespace str:  the namespace of the type
+        :param name      str:  the local name of the type
+        """
+        return cls.objects.filter(namespace=namespace, name=name, current=True)
+
     @classmethod
     def get_all_types(cls, include_abstract=False):
         """
@@ -714,11 +972,20 @@ class TemplateCommon(Document):
                                  "SCHEMANAME:ELNAME") for the root element of
                                  conforming instance documents.
     :property desc str:       a brief (displayable) description of the template.
+    :property lastver int:    the last version number allocated for the 
+                                 template (see allocate_version()); unset 
+                                 until the first allocation.
     """
     name    = fields.StringField(unique=True)
     current = fields.IntField(blank=False)
     root    = fields.StringField(blank=False)
     desc    = fields.StringField(default="")
+    lastver = fields.IntField()
+
+    def save(self, *args, **kwargs):
+        out = super(TemplateCommon, self).save(*args, **kwargs)
+        _flag_current_templates(self.name, self.current)
+        return out
 
     @classmethod
     def get_by_name(self, name, allowdeleted=False):
@@ -742,6 +1009,14 @@ class TemplateCommon(Document):
         currently marked as current.
         """
         return TemplateVersion.get_by_version(self.name, self.current)
+
+    def allocate_version(self):
+        """
+        reserve and return the next version number for this template.  The 
+        number is allocated with a single atomic update of this record, so 
+        concurrent saves of new versions always get distinct numbers.
+        """
+        return _allocate_version(TemplateCommon, TemplateVersion, self.name)
         
     @classmethod
     def get_names(self):
@@ -756,9 +1031,16 @@ class TemplateVersion(Document):
     Storage model for storing different versions of a template.
 
     :property name str:       the template name being versioned
-    :property version seq:    the version for this template
+    :property version int:    the version for this template; if not set, 
+                              the next one is allocated when the record is
+                              first saved (see 
+                              TemplateCommon.allocate_version()).
     :property common ref:   a reference to the common information record 
                                 in the Template collection
+    :property root str:       a copy of the root of the common record, so 
+                              that versions can be selected by root without
+                              dereferencing it (see Template.find()); if not
+                              set, it is copied when the record is saved.
     :property label str:      the label to give to the root element
     :property spec  ref:      the TypeRenderSpec object to use to render the 
                               root element; if not set, this will be generated 
@@ -768,10 +1050,14 @@ class TemplateVersion(Document):
     :property deleted bool:   True if this version is currently deleted
     :property comment str:    A brief (displayable) comment noting what is 
                               different about this version.
+    :property current bool:   True if this is the version named current by
+                              the common record; kept up to date when either
+                              record is saved (see Template.find()).
     """
     name    = fields.StringField(blank=False)
-    version = fields.SequenceField(blank=False)
+    version = fields.IntField(blank=False)
     common  = fields.ReferenceField(TemplateCommon, blank=False)
+    root    = fields.StringField()
     schema  = fields.ReferenceField(SchemaVersion, blank=False)
     extschemas = fields.ListField(SchemaVersion, blank=True, default=[])
     label   = fields.StringField()
@@ -779,6 +1065,20 @@ class TemplateVersion(Document):
     # transforms = fields.ReferenceField(Transforms, blank=True)
     deleted = fields.BooleanField(blank=False, default=False)
     comment = fields.StringField(default="")
+    current = fields.BooleanField(default=False)
+
+    meta = { 'indexes': [ ('name', 'version'), ('name', 'deleted'),
+                          'root', ('current', 'root') ] }
+
+    def save(self, *args, **kwargs):
+        if self.version is None:
+            self.version = _allocate_version(TemplateCommon, TemplateVersion,
+                                             self.name)
+        if self.common:
+            if self.root is None:
+                self.root = self.common.root
+            self.current = self.common.current == self.version
+        return super(TemplateVersion, self).save(*args, **kwargs)
 
     @classmethod
     def get_all_by_name(cls, name, include_deleted=False):
@@ -840,6 +1140,8 @@ class Template(object):
 
     @property
     def root(self):
+        if self._wrapped.root is not None:
+            return self._wrapped.root
         return self._wrapped.common.root
 
     @property
@@ -858,27 +1160,26 @@ class Template(object):
         :param label     str:  the template content digest to match
         :param spec     bool:  whether the template is marked as deleted
         :param deleted  bool:  if true, select only templates marked as current
+        :param root      str:  the root element to match
+        :param current  bool:  if true, select only the current versions of 
+                               the templates; if false, only the others
+
+        The keywords are matched against the TemplateVersion records with a
+        single query, using their stored root and current flag.
         """
         versions = TemplateVersion.objects
         for keywd in kwds:
-            if keywd in cls._data_dir:
+            if keywd in cls._data_dir or keywd == 'root':
                 use = { keywd: kwds[keywd] }
                 versions = versions.filter(**use)
-        ided = []
-        for ver in versions:
-            if 'root' in kwds and ver.common.root != kwds['root']:
-                continue
-            if 'current' in kwds:
-                iscurrent = ver.common.current == ver.version
-                if kwds['current'] != iscurrent:
-                    continue
-            ided.append(ver)
 
-        out = []
-        for ver in ided:
-            out.append(Template(ver))
+        if 'current' in kwds:
+            if kwds['current']:
+                versions = versions.filter(current=True)
+            else:
+                versions = versions.filter(current__ne=True)
 
-        return out
+        return [Template(ver) for ver in versions]
 
     @classmethod
     def _find_one(cls, **kwds):
@@ -919,7 +1220,43 @@ class Template(object):
             return None
         return Template(vers[0])
 
+    @classmethod
+    def sync_roots(cls):
+        """
+        copy the roots of the TemplateCommon records onto the 
+        TemplateVersion records that were saved before TemplateVersion had 
+        a root of its own.
+        """
+        for tc in TemplateCommon.objects.only('name', 'root'):
+            TemplateVersion.objects(name=tc.name, root=None) \
+                           .update(set__root=tc.root)
+
+    @classmethod
+    def sync_current_flags(cls):
+        """
+        set the current flags on all TemplateVersion records according to 
+        the current versions recorded in their TemplateCommon records.  The 
+        flags are normally kept up to date as the records are saved; this is
+        needed only for records saved before the flags were introduced.
+        """
+        for tc in TemplateCommon.objects.only('name', 'current'):
+            _flag_current_templates(tc.name, tc.current)
+
     @classmethod
     def get_names(self):
         return TemplateCommon.get_names()
     
+
+def sync_records():
+    """
+    bring the records saved by earlier versions of this package up to date
+    by filling in the denormalized fields that the queries now rely on.  
+    This is safe to run repeatedly; it is run by the sync_records 
+    management command and, if the SCHEMA_SYNC_RECORDS setting is turned 
+    on, at startup (see wsgi.py).
+    """
+    Schema.sync_current_flags()
+    Schema.sync_canon_digests()
+    Schema.sync_namespaces()
+    Template.sync_roots()
+    Template.sync_current_flags()
@@ -2,17 +2,35 @@
 a module that handles the business logic for loading schemas, elements, 
 types, and templates
 """
-import types, os, hashlib
-from urlparse import urlparse
+import types, os, sys, hashlib, time, threading, zlib
+from urlparse import urlparse, urljoin
+from multiprocessing.pool import ThreadPool
 from io import BytesIO
 from cStringIO import StringIO
 from collections import OrderedDict as ODict
 
-import requests
 from lxml import etree
+from mongoengine import Q
 
 from .models import *
-from validate import Validator, XSD_NS, ValidationError, SchemaValidationError
+from validate import (Validator, XSD_NS, ValidationError, SchemaValidationError,
+                      SchemaProvider, SchemaFlattener)
+from .cache import LRUCache
+from .typegraph import TypeGraph, MISSING, split_qname
+from .canon import canonical_digest
+from .fetch import get_fetcher
+from .catalog import get_catalog, SCHEMANAME_SCHEME
+
+# the default maximum number of dependencies to retrieve at once
+DEFAULT_RESOLVE_WORKERS = 4
+
+# the number of bytes read at a time from a schema document stream
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# the default number of prepared loaders and diagnostics kept by the 
+# PrepareCache
+DEFAULT_PREPARE_CACHE_SIZE = 32
+DEFAULT_DIAGNOSTICS_CACHE_SIZE = 256
 
 class SchemaIngestError(Exception):
     """
@@ -54,6 +72,17 @@ class FixableErrorsRemain(SchemaIngestError):
         self.errors.append(error)
         
 
+class SchemaTooLarge(SchemaIngestError):
+    """
+    An indication that a schema document exceeds the maximum size allowed 
+    for ingestion.
+    """
+    def __init__(self, maxsize):
+        super(SchemaTooLarge, self).__init__(
+            "Schema document exceeds the maximum allowed size ({0} bytes)".
+            format(maxsize))
+        self.maxsize = maxsize
+
 class UnresolvedSchemaInclude(SchemaIngestError):
     """
     An indication that an XML Schema could not be ingested because some include
@@ -175,6 +204,155 @@ class _SchemaResolver(etree.Resolver):
         return None
             
 
+class StreamedSchema(object):
+    """
+    a class that reads a schema document from a stream (e.g. the body of an
+    upload) in a single pass.  As each chunk is read, it is decompressed 
+    (if necessary), added to the digest, and fed to the XML parser; thus, 
+    the content is never read twice.  The chunks are gathered in a buffer
+    that the content is copied out of once the stream is finished; the 
+    buffer is then released, so the content is only held twice for the 
+    moment of that copy.  The loader() method creates a SchemaLoader that 
+    picks up the parsed document and digest.
+
+    :property content str:  the (decompressed) schema document
+    :property digest  str:  the hash digest of the content (the same as 
+                            SchemaLoader.digest)
+    :property size    int:  the length of the content in bytes
+    :property tree ElementTree:  the parsed document, or None if it is not 
+                            well-formed (in which case, the error is raised
+                            when the loader is prepared).
+    """
+
+    def __init__(self, maxsize=None, encoding=None):
+        """
+        start reading a schema document
+
+        :param maxsize int:   the maximum allowed length of the (decompressed)
+                                content in bytes; if None, there is no limit.
+        :param encoding str:  the content coding of the stream, either 
+                                "gzip", "deflate", or "identity" (or None) 
+                                for uncompressed content.
+        """
+        if not encoding or encoding == "identity":
+            self._inflater = None
+        elif encoding in ("gzip", "x-gzip"):
+            self._inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif encoding == "deflate":
+            self._inflater = zlib.decompressobj()
+        else:
+            raise SchemaIngestError("Unsupported content encoding: "+encoding)
+
+        self.maxsize = maxsize
+        self.size = 0
+        self.content = None
+        self.digest = None
+        self.tree = None
+        self._buf = StringIO()
+        self._hash = hashlib.md5()
+        self._resolver = Validator.schema_resolver(ODict(), ODict())
+        self._parser = Validator.feed_parser(self._resolver)
+
+    @classmethod
+    def read(cls, stream, maxsize=None, encoding=None):
+        """
+        read a schema document from a stream
+
+        :param stream file:   the stream to read
+        :param maxsize int:   the maximum allowed length of the (decompressed)
+                                content in bytes; if None, there is no limit.
+        :param encoding str:  the content coding of the stream (see the 
+                                constructor)
+        :raises SchemaTooLarge:  if the content exceeds maxsize
+        """
+        out = cls(maxsize, encoding)
+        while True:
+            chunk = stream.read(STREAM_CHUNK_SIZE)
+            if not chunk:
+                break
+            out.feed(chunk)
+        out.close()
+        return out
+
+    def feed(self, chunk):
+        """
+        process the next chunk read from the stream
+        """
+        if not self._inflater:
+            self._take(chunk)
+            return
+
+        try:
+            while chunk:
+                # inflate no more than would exceed the limit
+                room = 0
+                if self.maxsize is not None:
+                    room = self.maxsize - self.size + 1
+                self._take(self._inflater.decompress(chunk, room))
+                chunk = self._inflater.unconsumed_tail
+        except zlib.error, ex:
+            raise SchemaIngestError("Unable to decompress schema document: "+
+                                    str(ex))
+
+    def _take(self, data):
+        if not data:
+            return
+        self.size += len(data)
+        if self.maxsize is not None and self.size > self.maxsize:
+            raise SchemaTooLarge(self.maxsize)
+
+        self._hash.update(data)
+        self._buf.write(data)
+        if self._parser is not None:
+            try:
+                self._parser.feed(data)
+            except etree.XMLSyntaxError, ex:
+                # not well-formed; this will be reported by the loader
+                self._parser = None
+
+    def close(self):
+        """
+        finish reading the stream
+        """
+        if self._inflater:
+            try:
+                self._take(self._inflater.flush())
+            except zlib.error, ex:
+                raise SchemaIngestError("Unable to decompress schema "+
+                                        "document: "+str(ex))
+
+        self.content = self._buf.getvalue()
+        self._buf.close()
+        self._buf = None
+        self.digest = self._hash.hexdigest()
+        if self._parser is not None:
+            try:
+                self.tree = self._parser.close().getroottree()
+            except etree.XMLSyntaxError, ex:
+                self.tree = None
+            self._parser = None
+
+    def loader(self, name, location=None, session=None):
+        """
+        return a SchemaLoader for the schema that reuses the parsed document
+        and digest.
+
+        :param name str:      a unique name to give to the schema
+        :param location str:  a filename or other label indicating source
+                                of the stream
+        :param session LoadSession: the session to load it as part of
+        """
+        out = SchemaLoader(self.content, name, location, session=session)
+        out._hash = self.digest
+        if self.tree is not None:
+            # the resolver refers to the include and import maps, so the 
+            # loader must fill in the same ones
+            out.includes = self._resolver.incls
+            out.imports = self._resolver.imps
+            out._resolver = self._resolver
+            out.tree = self.tree
+        return out
+
 class SchemaLoader(object):
     """
     a class that prepares a schema for ingestion and executes ingestion.  
@@ -196,12 +374,15 @@ class SchemaLoader(object):
     lineages of all global elements and type in the schema.  
     """
 
-    def __init__(self, schema_content, name, location=None):
+    def __init__(self, schema_content, name, location=None, session=None):
         """
         initialize the loader
 
         :param schema_content str: the XML-encoded schema document as a string
         :param name str:           the name to assign to the schema.
+        :param session LoadSession: the session shared by the loaders taking
+                                   part in the current ingest; if None, a new
+                                   one is started.
         """
         if not name:
             raise ValueError("SchemaLoader: missing name")
@@ -230,8 +411,53 @@ class SchemaLoader(object):
         self.extern_by_loc = {} # keys are locations, values are Schema names 
         self.extern_by_ns = {}  # keys are namespaces, values are Schema names
 
+        # the XML catalog used to find local copies of included and imported
+        # schemas (see catalog.XMLCatalog)
+        self.catalog = get_catalog()
+
+        # the URL that relative schemaLocations in this schema are resolved
+        # against:  the URL the schema was actually retrieved from (e.g. a 
+        # local copy given by the catalog), if known
+        self.base_url = None
+        if location and urlparse(location).scheme:
+            self.base_url = location
+
+        # the maximum number of included and imported schemas to retrieve 
+        # and prepare at once (see resolve_dependencies())
+        self.max_workers = _default_max_workers()
+
+        # the state shared with the loaders of this schema's dependencies
+        if session is None:
+            session = LoadSession()
+        self.session = session
+
+        # the URLs of the schemas being prepared that (directly or 
+        # indirectly) include or import this one, and this one's own URL; 
+        # used to detect circular references.
+        self._chain = (location and (location,)) or ()
+
+        # the time, in seconds, spent in each phase of prepare()
+        self.timings = ODict()
+
+        # the schema is parsed with this resolver so that the parsed tree can
+        # be compiled into a validator once includes and imports are resolved
+        self._resolver = Validator.schema_resolver(self.includes, self.imports)
+        self._xsd_errors = None
+
+        # keys are the qnames of the global types defined in the schemas 
+        # this one includes or imports; values are their anscestors (see 
+        # prefetch_external_types())
+        self._extern_types = None
+
         self._calchash = _calc_hash_on_string
         self._hash = None
+        self._canon_hash = None
+
+        # the include and import resolution that the schema was last compiled
+        # with and the outcome (see prepare())
+        self._resolved_for = None
+        self._compile_error = None
+        self._incomplete = []
 
     @property
     def digest(self):
@@ -242,12 +468,28 @@ class SchemaLoader(object):
             self._hash = self._calchash(self.content)
         return self._hash
 
+    @property
+    def canon_digest(self):
+        """
+        return the canonical digest of the schema (see canon.py), which is 
+        the same for documents that differ only in formatting.  This 
+        requires the schema to be parsed (which will be done if needed).
+
+        :raises ValidationError:  if the schema is not well-formed XML
+        """
+        if not self._canon_hash:
+            if not self.tree:
+                self.xml_validate()
+            self._canon_hash = canonical_digest(self.tree)
+        return self._canon_hash
+
     @classmethod
     def from_stream(cls, schemastrm, name, location=None):
         """
         create a loader from an open stream.  This does not actually load the 
         stream; do that with a subsequent call to load() 
-        (or use load_from_stream() instead).
+        (or use load_from_stream() instead).  The stream is parsed and
+        hashed as it is read (see StreamedSchema).
 
         :param schemastrm file:  the stream containing the schema XML content
         :param name str:         a unique name to give to the schema
@@ -255,8 +497,7 @@ class SchemaLoader(object):
                                    of the stream; the default is None, indicating
                                    the location is unknown or undefined.
         """
-        content = schemastrm.read()
-        return cls(content, name=name, location=location)
+        return StreamedSchema.read(schemastrm).loader(name, location)
 
     @classmethod
     def load_from_stream(cls, schemastrm, name, location=None):
@@ -365,6 +606,54 @@ class SchemaLoader(object):
                                  + namespace)
         self.extern_by_ns[namespace] = schemaname
 
+    def set_finders(self, loc_finder=None, ns_finder=None):
+        """
+        replace all of the associations of locations and namespaces with 
+        previously loaded schemas (see recognize_location() and 
+        recognize_namespace()).  If they differ from the current ones, the 
+        includes and imports resolved so far are forgotten so that they are 
+        resolved anew by the next call to prepare().
+
+        :param loc_finder dict:  a dictionary mapping schemaLocation values to
+                                 names of schemas already in the system
+        :param ns_finder dict:   a dictionary mapping namespace values to 
+                                 names of schemas already in the system
+        """
+        old = (self.extern_by_loc, self.extern_by_ns)
+        self.extern_by_loc = {}
+        self.extern_by_ns = {}
+        for loc in (loc_finder or {}):
+            self.recognize_location(loc, loc_finder[loc])
+        for ns in (ns_finder or {}):
+            self.recognize_namespace(ns, ns_finder[ns])
+
+        if (self.extern_by_loc, self.extern_by_ns) != old:
+            # clear (rather than replace) these as the resolver refers to them
+            self.includes.clear()
+            self.imports.clear()
+
+    def diagnostics(self):
+        """
+        return a summary of the outcome of the last call to prepare() as a 
+        dictionary suitable for returning to a user.  It includes the
+        schema's name, digest, and namespace; whether it is "ready" for 
+        loading; the "errors" found (as strings); the "unresolved" includes
+        and imports (each a dictionary with a location, namespace, and list 
+        of candidate schema names); and the "timings" of the phases that 
+        were run.
+        """
+        return {
+            "name": self.name, "digest": self.digest, 
+            "namespace": self.namespace, "ready": len(self.errors) == 0,
+            "errors": [ str(e) for e in self.errors ],
+            "unresolved": [ { "location": e.location, 
+                              "namespace": e.namespace,
+                              "candidates": list(e.candidate) }
+                            for e in self.errors
+                            if isinstance(e, UnresolvedSchemaInclude) ],
+            "timings": dict(self.timings)
+        }
+
     def prepare(self):
         """
         read the schema, validate it, and read it to prepare for ingestion.
@@ -378,6 +667,12 @@ class SchemaLoader(object):
         implementation tries to gather all such errors so that the system can 
         offer suggestions for addressing them.
 
+        This may be called repeatedly as those errors are addressed (e.g. 
+        via recognize_location()).  A repeat call only redoes the work 
+        whose inputs have changed:  the document is not re-parsed, and it 
+        is only re-compiled (and its global definitions re-extracted) if 
+        the schemas its includes and imports resolve to have changed.
+
         :return bool:  true if the schema is ready for loading; false if some
                        fixable errors occurred
         :raises ValidationError:  if there is a validation error that has 
@@ -386,39 +681,68 @@ class SchemaLoader(object):
         :raises SchemaIngestError:  if a fatal error occured while extracting 
                                   needed information from the schema.
         """
+        self.timings = ODict()
+
         # trigger the digest calculation
-        self.digest
+        self._timed("digest", lambda: self.digest)
             
         # parse the schema and make sure it's well-formed XML; there's no 
-        # point in going further if it's not
-        self.xml_validate()
-
-        # find and check the namespace
-        self.check_namespace()
+        # point in going further if it's not.  The parsed tree is used by 
+        # all the following phases.
+        if not self.tree:
+            self._timed("parse", self.xml_validate)
 
-        # extract all the top-level prefix definitions
-        self.extract_prefixes()
+        # find and check the namespace, and extract all the top-level prefix
+        # definitions; these depend only on the content.
+        if self.namespace is None:
+            self._timed("namespace", self.check_namespace)
+        if not self.prefixes:
+            self._timed("prefixes", self.extract_prefixes)
 
-        # handle includes and imports
+        # handle includes and imports.  Those that were resolved by an 
+        # earlier call are skipped.
         self.errors = []
-        self.errors.extend( self.resolve_includes() )
-        self.errors.extend( self.resolve_imports() )
-
-        # parse the schema and make sure it's valid
+        self.errors.extend( self._timed("includes", self.resolve_includes) )
+        self.errors.extend( self._timed("imports", self.resolve_imports) )
+
+        # the remaining phases are only redone if the resolution of the 
+        # includes and imports has changed since they were last done.
+        resolved = (tuple(self.includes.items()), tuple(self.imports.items()))
+        if resolved == self._resolved_for:
+            if self._compile_error:
+                if len(self.errors) == 0:
+                    raise self._compile_error
+                self.errors.append(self._compile_error)
+            self.errors.extend( self._incomplete )
+            return len(self.errors) == 0
+
+        # compile the parsed schema and make sure it's valid
+        self._compile_error = None
         try:
-            self.xsd_validate()
+            self._timed("compile", self.xsd_validate)
         except ValidationError, ex:
             if len(self.errors) == 0:
                 # validation error apparently unrelated to missing includes
                 raise
             # LOG a problem
+            self._compile_error = ex
             self.errors.append(ex)
 
         # get the names of all global elements and types.  For each type, it 
         # will figure out its ancestors.
-        self.errors.extend( self.get_global_defs() )
+        self._incomplete = self._timed("global_defs", self.get_global_defs)
+        self.errors.extend( self._incomplete )
+        self._resolved_for = resolved
         return len(self.errors) == 0
 
+    def _timed(self, phase, func):
+        # call func(), recording the time it took as the given phase
+        start = time.time()
+        try:
+            return func()
+        finally:
+            self.timings[phase] = time.time() - start
+
     def beprepared(self):
         """
         read the schema, validate it, and read it to definitively prepare it
@@ -445,6 +769,9 @@ class SchemaLoader(object):
         imports  = map(lambda i: "{0}::{1}".format(i[0],i[1]),
                        self.imports.iteritems())
 
+        closure = self.dependency_closure()
+        flattened, bundle = self.flattened_content(closure)
+
         sc = SchemaCommon.get_by_name(name=self.name, allowdeleted=True) 
         if not sc:
             sc = SchemaCommon(namespace=self.namespace, name=self.name,
@@ -453,58 +780,139 @@ class SchemaLoader(object):
             if self.comment is None:
                 self.comment = "initial version"
 
-        sv = SchemaVersion(name=self.name, common=sc, content=self.content, 
+        sv = SchemaVersion(name=self.name, common=sc, namespace=sc.namespace,
+                           content=self.content, 
                            digest=self.digest, prefixes=self.prefixes, 
+                           canon_digest=self.canon_digest,
                            imports=imports, includes=includes,
+                           doctored=self.doctored_content(),
+                           closure=closure, flattened=flattened,
+                           bundle=bundle,
                            location=self.location, comment=self.comment,
-                           version=SchemaVersion.next_version_for(self.name))
+                           version=sc.allocate_version())
         sv.save()
         if sc.current <= 0:
             Schema(sv).make_current()
 
-        for tp in self.global_types:
-            gta = GlobalTypeAnnots.objects.filter(name=tp,
-                                                  namespace=self.namespace,
-                                                  schemaname=sc.name)
-            gta = (len(gta) > 0 and gta[0]) or None
-            if not gta:
-                gta = GlobalTypeAnnots(name=tp, namespace=self.namespace,
-                                       schemaname=sc.name)
-                gta.save()
-
-            gt = GlobalType(name=tp, namespace=self.namespace,
-                            schemaname=sc.name, version=sv.version,
-                            schema=sv, anscestors=self.global_types[tp],
-                            annots=gta, abstract=(tp in self.abstypes))
-            gt.save()
-
-        for el in self.global_elems:
-            gea = GlobalElementAnnots.objects.filter(name=el,
-                                                     namespace=self.namespace,
-                                                     schemaname=sc.name)
-            gea = (len(gea) > 0 and gea[0]) or None
-            if not gea:
-                gea = GlobalElementAnnots(name=el, namespace=self.namespace,
-                                          schemaname=sc.name)
-                gea.save()
-
-            ge = GlobalElement(name=el, namespace=self.namespace,
-                               schemaname=sc.name, version=sv.version,
-                               schema=sv, annots=gea)
-            ge.save()
-                                     
+        self._store_global_defs(sc, sv)
+
         return Schema.get_by_name(self.name, sv.version)
                             
-    def get_validation_errors(self):
+    def _store_global_defs(self, sc, sv):
+        # save the global types and elements for a newly loaded version with
+        # a fixed number of database round trips, regardless of how many
+        # there are.
+        typeannots = self._get_annots(GlobalTypeAnnots, self.global_types, 
+                                      sc.name)
+        elemannots = self._get_annots(GlobalElementAnnots, self.global_elems,
+                                      sc.name)
+
+        gts = [ GlobalType(name=tp, namespace=self.namespace, 
+                           schemaname=sc.name, version=sv.version, schema=sv,
+                           anscestors=self.global_types[tp],
+                           annots=typeannots[tp], 
+                           abstract=(tp in self.abstypes),
+                           current=(sc.current == sv.version))
+                for tp in self.global_types ]
+        if gts:
+            GlobalType.objects.insert(gts, load_bulk=False)
+
+        ges = [ GlobalElement(name=el, namespace=self.namespace,
+                              schemaname=sc.name, version=sv.version,
+                              schema=sv, annots=elemannots[el],
+                              current=(sc.current == sv.version))
+                for el in self.global_elems ]
+        if ges:
+            GlobalElement.objects.insert(ges, load_bulk=False)
+
+    def _get_annots(self, annotcls, names, schemaname):
+        # return a dictionary mapping the given names to their annotation 
+        # records, fetching the existing ones with one query and creating the 
+        # missing ones with one bulk insert.
+        if not names:
+            return {}
+        out = dict([(a.name, a) for a in 
+                    annotcls.objects.filter(namespace=self.namespace,
+                                            schemaname=schemaname,
+                                            name__in=list(names))])
+        missing = [annotcls(name=n, namespace=self.namespace,
+                            schemaname=schemaname)
+                   for n in names if n not in out]
+        if missing:
+            ids = annotcls.objects.insert(missing, load_bulk=False)
+            for annot, id in zip(missing, ids):
+                annot.pk = id
+                out[annot.name] = annot
+        return out
+
+    def doctored_content(self):
+        """
+        return the version of the schema content that the validator will 
+        consume when this schema is included or imported into another:  
+        the schemaLocations of its includes and imports refer to the 
+        resolved schemas by name (see validate.SchemaProvider).  An empty 
+        string is returned if no doctoring is necessary.  
+        """
+        if len(self.includes) == 0 and len(self.imports) == 0:
+            return ""
+        return SchemaProvider(self.includes,
+                              self.imports).transform_schema(self.content)
+
+    def dependency_closure(self):
+        """
+        return the versions of all the schemas this schema depends on, 
+        directly or indirectly, via its includes and imports.  The versions 
+        are those currently in force; each is given in the form 
+        "NAME::VERSION".  This should be called after the includes and 
+        imports have been resolved (see prepare()).
+        """
+        out = []
+        for name in self.includes.values() + self.imports.values():
+            dep = Schema.get_by_name(name)
+            if not dep:
+                continue
+            for pin in ["{0}::{1}".format(dep.name, dep.version)] + \
+                       list(dep.closure):
+                if pin not in out:
+                    out.append(pin)
+        return out
+
+    def flattened_content(self, closure=None):
         """
-        return an array of the validation errors found in the schema
+        return a self-contained version of the schema for compiling 
+        validators without database lookups (see validate.SchemaFlattener).
+        This should be called after the includes and imports have been 
+        resolved (see prepare()).
+
+        :param closure list:  the pinned versions of the schemas this one 
+                                depends on (see dependency_closure()); if 
+                                None, it will be determined.
+        :return tuple:  the flattened content and the bundle of schemas it 
+                        refers to (as a list of dictionaries, as stored in 
+                        SchemaVersion.bundle).  If the schema cannot be 
+                        flattened, the content is an empty string.
         """
-        errors = []
+        if closure is None:
+            closure = self.dependency_closure()
+        flattener = SchemaFlattener(SchemaVersion.get_pinned(closure))
         try:
-            self.xsd_validate()
-        except ValidationError, ex:
-            errors.extend(ex.errors)
-        return errors
+            content = flattener.flatten(self)
+        except (etree.XMLSyntaxError, ValidationError), ex:
+            # validators will be compiled from the original content
+            return ("", [])
+        return (content, flattener.bundle_records())
+
+    def get_validation_errors(self):
+        """
+        return an array of the validation errors found in the schema.  The 
+        result of a previous validation (e.g. via prepare()) is reused.
+        """
+        if self._xsd_errors is None:
+            try:
+                self.xsd_validate()
+            except ValidationError, ex:
+                pass
+        return list(self._xsd_errors)
 
     def xml_validate(self):
         """
@@ -512,18 +920,25 @@ class SchemaLoader(object):
         As a side effect, this will set the tree property to the parsed
         version of the schema.  
         """
-        self.tree = Validator.parse(self.content)
+        self.tree = Validator.parse(self.content, self._resolver)
 
     def xsd_validate(self):
         """
         raise a ValidationError if the document is not valid XML Schema.
         As a side effect, this will set the valid8r property to a validater
-        instance.
+        instance.  The already parsed tree is compiled; it is not re-parsed.
         """
-        if not self.tree:
-            self.xml_validate()
+        self._xsd_errors = None
+        try:
+            if not self.tree:
+                self.xml_validate()
 
-        self.valid8r = Validator(self.content, self.includes, self.imports)
+            self.valid8r = Validator.from_parsed(self.content, self.tree,
+                                                 self._resolver)
+        except ValidationError, ex:
+            self._xsd_errors = list(ex.errors)
+            raise
+        self._xsd_errors = []
 
     def _get_super_type(self, el):
         # find the xs:extension or xs:restrictin element and extract the
@@ -560,128 +975,80 @@ class SchemaLoader(object):
         return qname
 
     def _split_qname(self, qname):
-        if '}' in qname and qname.startswith('{'):
-            return qname.lstrip('{').split('}', 1)
-        elif ':' in qname:
-            return qname.split(':', 1)
-        return ('', qname)
+        return split_qname(qname)
 
     def _trace_anscestors(self, gllist):
         # gllist:  format: [ (TYPE-NAME, PARENT-QNAME) ]
-
-        def _name_in(name, gllist):
-            return name in map(lambda g: g[0], gllist)
-        def _first_item_in(name, gllist):
-            matches = filter(lambda g: g[0] == name, gllist)
-            return ((len(matches) > 0) and matches[0]) or None
-        def _circularly_derived_if(isso):
-            if isso:
-                msg = "Circular derivation detected: " + parent + \
-                      "derives from itself."
-                raise SchemaValidationError(msg)
-
-        out = {}
-        for tp in gllist:
-            if tp[0] in out:
-                raise SchemaValidationError("Multiple definitions found for "+
-                                            "global type, " + tp[0])
-            
-            ansc = []
-            out[tp[0]] = ansc
-            parent = tp[1]
-            if parent:
-                ansc.append( tp[1] )
-
-            while parent:
-                parentns, parentln = self._split_qname(parent)
-                includes = None
-
-                if parentns == XSD_NS:
-                    # parent is a built-in type; don't go any further
-                    parent = None
-
-                elif parentns == self.namespace:
-                    # parent is in the same namespace
-                    
-                    if parentln in out:
-                        # parent was defined in this document and we've already
-                        # traced its anscestors
-                        ansc.extend( out[parentln] )
-                        parent = None
-                    
-                    elif _name_in(parentln, gllist):
-                        # parent was defined in this document but we are still
-                        # tracing its anscestors
-                        _circularly_derived_if(gllist[parentns] in ansc)
-                        ansc.append( gllist[parentns] )
-                        parent = gllist[parentns]
-
-                    else:
-                        # we need search through the included & imported schemas:
-                        includes = self.includes.values() + self.imports.values()
-
-                else:
-                    includes = self.imports.values()
-
-                if parent:
-                    # still haven't found parent
-                    if includes:
-                        found = None
-                        for include in includes:
-                            found = self._find_type_in_schemadoc(parent, include)
-                            if found:
-                                _circularly_derived_if(found[0] in ansc)
-                                ansc.extend( found )
-                            if found is not None:
-                                # None means not found, keep searching includes;
-                                # an empty array means found but no more
-                                # anscestors
-                                parent = None
-
-                if parent:
-                    # includes didn't pan out; give up!
-                    ansc.append( "__missing__" )
-                    parent = None
-
-        return out
-
-    def _find_type_in_schemadoc(self, tpqname, schemaname):
-        # This looks for a GlobalType record for a given type QName in the
-        # named schema doc and returns its list of anscestors
-        
-        ns, lname = self._split_qname(tpqname)
-
-        # get schema info from the database
-        schema = Schema.get_by_name(schemaname)
-
-        found = GlobalType.objects.filter(schemaname=schema.name) \
-                                  .filter(version=schema.version) \
-                                  .filter(namespace=ns)           \
-                                  .filter(name=lname)
-        if len(found) > 0:
-            # (there should only be one)
-            return found[0].anscestors
-
-        # look through this schema's includes and imports
-        for include in (schema.includes + schema.imports):
-            found = _find_type_in_schemadoc(tpqname, include)
-            if found is not None:
-                return found
-        return None
+        graph = TypeGraph(self.namespace, self._find_external_type)
+        for name, parent in gllist:
+            graph.add(name, parent)
+        return graph.trace_all()
+
+    def _find_external_type(self, tpqname):
+        # look for a type not defined in this schema among the included and 
+        # imported schemas, returning its list of anscestors (or None if 
+        # not found)
+        if self._extern_types is None:
+            self.prefetch_external_types()
+        return self._extern_types.get(tpqname)
+
+    def prefetch_external_types(self):
+        """
+        fetch the anscestors of every global type defined in the schemas 
+        this one includes or imports, directly or indirectly, so that the 
+        base types defined in them can be looked up without further database
+        queries.  The versions of the indirectly included or imported 
+        schemas are those pinned by the directly included or imported ones 
+        (see dependency_closure()).  This is called at the start of 
+        get_global_defs(), after the includes and imports are resolved.
+
+        :return dict:  a dictionary mapping type qnames (of the form 
+                       "{NS}LOCAL-NAME") to their lists of anscestors
+        """
+        self._extern_types = {}
+        names = self.includes.values() + self.imports.values()
+        if not names:
+            return self._extern_types
+
+        deps = dict([(sv.name, sv) for sv in 
+                     SchemaVersion.objects.filter(name__in=names,
+                                                  status=RECORD.IS_CURRENT)])
+        rank = ODict()
+        for name in names:
+            dep = deps.get(name)
+            if not dep:
+                continue
+            for pin in ["{0}::{1}".format(dep.name, dep.version)] + \
+                       list(dep.closure):
+                pname, pver = pin.rsplit('::', 1)
+                rank.setdefault((pname, int(pver)), len(rank))
+        if not rank:
+            return self._extern_types
+
+        query = reduce(lambda q1, q2: q1 | q2,
+                       [Q(schemaname=n, version=v) for n, v in rank])
+        found = GlobalType.objects(query).only('name', 'namespace', 
+                                               'schemaname', 'version',
+                                               'anscestors')
         
+        # if a type is defined in more than one schema, the one closest to 
+        # this schema wins
+        for gt in sorted(found, key=lambda t: rank[(t.schemaname, t.version)],
+                         reverse=True):
+            self._extern_types[gt.qname] = list(gt.anscestors)
+        return self._extern_types
 
     def get_global_defs(self):
         """
         extract the names of all global elements and types.
         """
-        if not self.valid8r:
+        if not self.valid8r and self._xsd_errors is None:
+            # not compiled yet (if compiling failed, prepare() has already 
+            # recorded the errors)
             self.xsd_validate()
 
-        def _name_in(name, gllist):
-            return name in map(lambda g: g[0], gllist)
-        def _first_item_in(name, gllist):
-            matches = filter(lambda g: g[0] == name, gllist)
-            return ((len(matches) > 0) and matches[0]) or None
+        # get the anscestors of the types from other schemas in one go
+        self.prefetch_external_types()
 
         gltps = []
         glels = []
@@ -724,10 +1091,10 @@ class SchemaLoader(object):
         # build the type ancestry lines
         gltps = self._trace_anscestors( gltps )
         self.global_types = dict(
-                   filter(lambda t: len(t[1]) == 0 or t[1][-1] != "__missing__",
+                   filter(lambda t: len(t[1]) == 0 or t[1][-1] != MISSING,
                           gltps.iteritems()) )
         incomplete.extend( map(lambda t: IncompleteType(t[0], t[1]),
-                   filter(lambda t: len(t[1]) > 0 and t[1][-1] == "__missing__",
+                   filter(lambda t: len(t[1]) > 0 and t[1][-1] == MISSING,
                           gltps.iteritems())) )
 
         # Now make sure our global elements are all defined
@@ -747,10 +1114,7 @@ class SchemaLoader(object):
         ns, ln = self._split_qname(tpqname)
         if ln in self.global_types:
             return True
-        matches = GlobalType.objects.filter(namespace=ns).filter(name=ln)
-        matches = filter(lambda t: t.version == t.schema.common.current and
-                                   t.schema.status != RECORD.DELETED, matches)
-        return len(matches) > 0
+        return GlobalType.find_current(ns, ln).count() > 0
 
     def check_namespace(self):
         """
@@ -773,10 +1137,15 @@ class SchemaLoader(object):
         """
         examine any include statements and attempt to match them to previously
         loaded schemas.  Otherwise, attempt to load the schemas from their 
-        stated location.   Include locations that cannot be resolved are 
+        stated location (or from the local copy given by the loader's 
+        catalog).   Include locations that cannot be resolved are 
         returned as list of UnresolvedSchemaInclude instances.  Each one
         can include a list of possibly matching schema that have already been
         loaded.
+
+        Schemas that must be retrieved are fetched and prepared concurrently
+        (see resolve_dependencies()); they are then loaded, and any errors 
+        are reported, in the order they are included.
         """
         unresolved = []
         if not self.namespace:
@@ -784,6 +1153,7 @@ class SchemaLoader(object):
         
         # find any include statements
         nsm = {"xs": XSD_NS }
+        pending = []   # (location, URL to fetch, candidate matches, key)
         for incl in self.tree.getroot().findall("xs:include", nsm):
             
             loc = incl.get('schemaLocation')
@@ -791,8 +1161,8 @@ class SchemaLoader(object):
                 raise SchemaValidationError("include statement is missing "+
                                             "a schemaLocation: "+incl.tostring())
 
-            # See if we've already loaded it
-            if loc in self.includes:
+            # See if we've already loaded it (or are about to)
+            if loc in self.includes or loc in [p[0] for p in pending]:
                 continue
 
             # See if we've been tipped off: try our namespace-schemaname
@@ -800,11 +1170,23 @@ class SchemaLoader(object):
             if loc in self.extern_by_loc:
                 self.includes[loc] = self.extern_by_loc[loc]
                 continue
+
+            # See if the catalog knows where it is
+            fetchloc = self._catalog_lookup(loc)
+            if fetchloc and fetchloc.startswith(SCHEMANAME_SCHEME):
+                self.includes[loc] = fetchloc[len(SCHEMANAME_SCHEME):]
+                continue
                 
-            # is the location a URL; if so, we can try to load if necessary
-            urlloc = urlparse(loc)
-            if not urlloc.scheme:
-                urlloc = None
+            # is the location a URL (or relative to one); if so, we can try 
+            # to load if necessary
+            if not fetchloc:
+                fetchloc = self._absolute_url(loc)
+
+            # See if another loader in this session has resolved it
+            key = ("include", self._session_location(loc), self.namespace)
+            if self.session.resolved_name(key):
+                self.includes[loc] = self.session.resolved_name(key)
+                continue
 
             # See if this included schema appears to have been loaded already
             # Look templates in the same namespace and location (or from
@@ -814,45 +1196,40 @@ class SchemaLoader(object):
             if len(matches) == 1:
                 # we are confident that we have loaded this already
                 self.includes[loc] = matches[0].name
+                self.session.set_resolved_name(key, matches[0].name)
                 continue
 
-            elif urlloc:
-                # let's load the schema from it's url
-                inclhash = None
-                try:
-                    # pull the content and check its hash
-                    inclcontent = _retrieve_url_content(loc)
-                    inclhash = self._calchash(inclcontent)
-                except Exception, ex:
-                    unresolved.append(
-                        SchemaIngestError(
-                            "Unable to retrieve schema at URL={0}: {1}".
-                            format(urlloc, str(ex)))
-                    )
-
-                if inclhash:
-                    try:
-                        # do we recognize the hash?
-                        vers = Schema.find(namespace=self.namespace,
-                                           digest=inclhash)
-                        if len(vers) > 0:
-                            self.includes.append(vers[0].name)
-                        else:
-                            # no, so load it
-                            inclschema = SchemaLoader(inclcontent, urlloc,
-                                                      location=urlloc)
-                            self.includes.append(inclschema.load().name)
-                            continue
-                        
-                    except ValidationError, ex:
-                        raise SchemaIngestError(
-                           "Included schema at {0} has a validation issues: {1}".
-                           format(urlloc, str(ex.errors)))
+            elif fetchloc:
+                # we'll load the schema from it's url
+                pending.append( (loc, fetchloc, matches, key) )
+                continue
                     
             # we are left only with guesses:
             matches = map(lambda s: s.name, matches)
-            error = UnresolvedSchemaInclude(loc, candidates=matches)
-            unresolved.append( error )
+            unresolved.append( UnresolvedSchemaInclude(loc, candidates=matches) )
+
+        deps = self.resolve_dependencies(
+            [ (fetchloc, loc, self.namespace)
+              for loc, fetchloc, m, k in pending ])
+        for (loc, fetchloc, matches, key), dep in zip(pending, deps):
+            try:
+                name = dep.commit()
+                if name:
+                    self.includes[loc] = name
+                    self.session.set_resolved_name(key, name)
+                    continue
+            except ValidationError, ex:
+                raise SchemaIngestError(
+                   "Included schema at {0} has a validation issues: {1}".
+                   format(loc, str(ex.errors)))
+            except FixableErrorsRemain, ex:
+                unresolved.extend( ex.errors )
+                continue
+
+            # it could not be retrieved; we are left only with guesses:
+            unresolved.append( dep.error )
+            matches = map(lambda s: s.name, matches)
+            unresolved.append( UnresolvedSchemaInclude(loc, candidates=matches) )
 
         return unresolved
 
@@ -860,9 +1237,14 @@ class SchemaLoader(object):
         """
         examine any import statements and attempt to match them to previously
         loaded schemas.  Otherwise, attempt to load the schemas from their 
-        stated location.   Import namespaces that cannot be resolved are 
+        stated location (or from the local copy given by the loader's 
+        catalog).   Import namespaces that cannot be resolved are 
         returned as a dict that maps namespaces to stated locations (which will
         be none if no schemaLocation was provided).
+
+        Schemas that must be retrieved are fetched and prepared concurrently
+        (see resolve_dependencies()); they are then loaded, and any errors 
+        are reported, in the order they are imported.
         """
         unresolved = []
         if not self.tree:
@@ -870,6 +1252,7 @@ class SchemaLoader(object):
         
         # find any include statements
         nsm = {"xs": XSD_NS }
+        pending = []   # (namespace, location, URL to fetch, key)
         for incl in self.tree.getroot().findall("xs:import", nsm):
 
             ns = incl.get('namespace', "")
@@ -879,8 +1262,8 @@ class SchemaLoader(object):
                 # helpful)
                 continue
 
-            # See if we've already loaded it
-            if ns in self.imports:
+            # See if we've already loaded it (or are about to)
+            if ns in self.imports or (ns and ns in [p[0] for p in pending]):
                 continue
 
             # See if we've been tipped off: try our namespace-schemaname
@@ -889,6 +1272,18 @@ class SchemaLoader(object):
                 self.imports[ns] = self.extern_by_ns[ns]
                 continue
 
+            # See if the catalog knows where it is
+            fetchloc = self._catalog_lookup(loc, ns)
+            if fetchloc and fetchloc.startswith(SCHEMANAME_SCHEME):
+                self.imports[ns] = fetchloc[len(SCHEMANAME_SCHEME):]
+                continue
+
+            # See if another loader in this session has resolved it
+            key = ("import", ns, loc and self._session_location(loc))
+            if self.session.resolved_name(key):
+                self.imports[ns] = self.session.resolved_name(key)
+                continue
+
             # See if we've already loaded it: try to match the referenced
             # schema by namespace and location
             matches = Schema.find(namespace=ns, location=loc, current=True)
@@ -898,61 +1293,167 @@ class SchemaLoader(object):
                 elif loc:
                     matches = Schema.find(location=loc, current=True)
             if len(matches) == 1:
+                self.session.set_resolved_name(key, matches[0].name)
                 if not ns:
                     ns =  matches[0].namespace
                 self.imports[ns] = matches[0].name
                 continue
 
             # Try to load it.
-            urlloc = urlparse(loc)
-            if not urlloc.scheme:
-                # relative URL provided; don't know how to get it
-                # TODO: attempt to combine loc with self.location to form
-                # a full URL for the schema to be imported.
+            if not fetchloc and loc:
+                fetchloc = self._absolute_url(loc)
+            if not fetchloc:
+                # relative URL provided with nothing to resolve it against; 
+                # don't know how to get it
                 matches = map(lambda m: m.name, matches)
                 unresolved.append( UnresolvedSchemaInclude(loc, ns, matches) )
                 continue
-            
-            else:
-                imphash = None
-                try:
-                    impcontent = _retrieve_url_content(loc)
-                    imphash = self._calchash(impcontent)
-                except Exception, ex:
-                    unresolved.append(
-                        SchemaIngestError(
-                            "Failed to retrieve imported schema ({0}) from {1}: {2}".
-                            format(ns, loc, str(ex))
-                        )
-                    )
-                    continue
 
-                if imphash:
-                    try:
-                        impschema = SchemaLoader(impcontent, name=loc,
-                                                 location=loc)
-                        if not ns:
-                            impschema.prepare()
-                            ns = impschema.namespace
-
-                        # do we recognize the hash?
-                        vers = Schema.find(namespace=ns, digest=imphash)
-                        if len(vers) > 0:
-                            self.imports[ns] = vers[0].namespace
-                            continue
-
-                        impschema = impschema.load()
-                        self.imports[impschema.namespace] = impschema.name
-
-                    except ValidationError, ex:
-                        raise ValidationError(
-                            "Included schema at {0} has a validation issues: {1}".
-                            format(urlloc, str(ex.errors)))
-                    except FixableErrorsRemain, ex:
-                        unresolved.extend( ex.errors )
+            pending.append( (ns, loc, fetchloc, key) )
+
+        deps = self.resolve_dependencies(
+            [ (fetchloc, loc, ns or None)
+              for ns, loc, fetchloc, k in pending ])
+        for (ns, loc, fetchloc, key), dep in zip(pending, deps):
+            try:
+                name = dep.commit()
+                if name:
+                    self.imports[ns or dep.namespace] = name
+                    self.session.set_resolved_name(key, name)
+                else:
+                    unresolved.append( dep.error )
+            except ValidationError, ex:
+                raise ValidationError(
+                    "Included schema at {0} has a validation issues: {1}".
+                    format(fetchloc, str(ex.errors)))
+            except FixableErrorsRemain, ex:
+                unresolved.extend( ex.errors )
 
         return unresolved
 
+    def resolve_dependencies(self, refs):
+        """
+        retrieve and prepare the schemas at the given URLs.  The work is 
+        spread over a pool of up to `max_workers` threads, so that the time
+        spent waiting on remote servers overlaps; the returned list is in 
+        the same order as the input references, regardless of the order 
+        the work completes.  Only the loader of the schema being ingested 
+        uses a pool:  the loaders of its dependencies (which run in the 
+        pool's threads) prepare their own dependencies one at a time, so 
+        the number of threads stays bounded however deep the dependencies 
+        go.  Nothing is committed to the database:  the caller loads each 
+        returned dependency by calling its commit() method.
+
+        :param refs list:  a list of (url, location, namespace) tuples for 
+                           the schemas to retrieve, where location is the 
+                           schemaLocation given in the referencing statement
+                           (if any) and namespace is the expected namespace
+                           (None, if unknown).
+        :return list:  a list of _Dependency instances
+        """
+        if len(refs) < 2 or self.max_workers < 2:
+            return [ self._prepare_dependency(*ref) for ref in refs ]
+
+        pool = ThreadPool(min(len(refs), self.max_workers))
+        try:
+            return pool.map(lambda ref: self._prepare_dependency(*ref), refs)
+        finally:
+            pool.close()
+            pool.join()
+
+    def _prepare_dependency(self, url, location, namespace):
+        # retrieve and prepare the schema at a URL.  This may be run in a 
+        # worker thread, so all exceptions are captured in the returned 
+        # _Dependency to be raised in the caller's thread.
+        if url in self._chain:
+            dep = _Dependency(self.session, url, namespace)
+            dep.error = SchemaIngestError(
+                "Circular reference to schema at URL={0} (via {1})".
+                format(url, " -> ".join(self._chain)))
+            return dep
+
+        # each URL is prepared once per session:  if another thread has 
+        # prepared it or is preparing it, use (or wait for) its result
+        dep = self.session.prepared(url)
+        if dep:
+            return dep
+        dep = _Dependency(self.session, url, namespace)
+        try:
+            content, dep.digest = self.session.fetch(url, self._calchash)
+        except Exception, ex:
+            dep.error = SchemaIngestError(
+                "Unable to retrieve schema at URL={0}: {1}".format(url, str(ex)))
+            return self.session.set_prepared(url, dep)
+
+        try:
+            # do we recognize the hash?
+            if namespace is not None:
+                dep.name = self._find_name_by_digest(namespace, dep.digest)
+                if dep.name:
+                    return self.session.set_prepared(url, dep)
+
+            # a relative location is only unique relative to its base
+            name = url
+            if location:
+                name = self._session_location(location)
+            loader = SchemaLoader(content, name=name, location=name,
+                                  session=self.session)
+            loader.catalog = self.catalog
+            loader.base_url = url
+            loader.max_workers = 1   # see resolve_dependencies()
+            loader._hash = dep.digest
+            loader._chain = self._chain + (url,)
+            loader.prepare()
+
+            if namespace is None:
+                dep.namespace = loader.namespace
+                dep.name = self._find_name_by_digest(loader.namespace, 
+                                                     dep.digest)
+            dep.loader = loader
+        except BaseException, ex:
+            dep.exc_info = sys.exc_info()
+        return self.session.set_prepared(url, dep)
+
+    def _find_name_by_digest(self, namespace, digest):
+        vers = Schema.find(namespace=namespace, digest=digest)
+        if len(vers) > 0:
+            return vers[0].name
+        return None
+
+    def _absolute_url(self, location):
+        # return the URL to retrieve a referenced schema from, resolving a 
+        # relative location against the base URL, or None if it is relative
+        # and there is no base URL
+        if urlparse(location).scheme:
+            return location
+        if self.base_url:
+            return urljoin(self.base_url, location)
+        return None
+
+    def _session_location(self, location):
+        # return a referenced schema's location in the form that identifies
+        # it across the loaders of a session:  as an absolute URL, if it can
+        # be resolved to one.  (The same relative location refers to
+        # different schemas when it appears in schemas with different base
+        # URLs.)  It is resolved against this schema's own location, rather
+        # than a local copy it was retrieved from, when that is a URL.
+        if urlparse(location).scheme:
+            return location
+        base = self.base_url
+        if self.location and urlparse(self.location).scheme:
+            base = self.location
+        if base:
+            return urljoin(base, location)
+        return location
+
+    def _catalog_lookup(self, location, namespace=None):
+        # return the location of a local copy of a referenced schema (or 
+        # its registered name, prefixed by "schemaname:") as given by the 
+        # catalog, or None if it is not in the catalog
+        if not self.catalog:
+            return None
+        return self.catalog.resolve(location, namespace)
+
     def extract_prefixes(self):
         """
         collect namespace prefix definitions in the schema
@@ -977,18 +1478,289 @@ class SchemaLoader(object):
             
 
                
+class LoadSession(object):
+    """
+    a class that holds the state shared by all of the SchemaLoaders taking
+    part in one ingest:  the loader of the schema being ingested and the 
+    loaders it creates for the schemas it includes or imports (and so on).
+    It ensures that each distinct dependency is retrieved, hashed, and 
+    prepared only once, no matter how many times it is referenced.  It is 
+    safe to use from multiple threads:  a thread that needs a dependency 
+    another thread is working on waits for that thread's result.
+
+    :property stats dict:  counts of the session's activity:  "fetched" and
+                           "prepared" (the number of distinct URLs retrieved
+                           and prepared) and "reused" (the number of 
+                           references satisfied by earlier work).
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._fetched = {}       # keys are URLs, values are _Fetched
+        self._prepared = {}      # keys are URLs, values are _Prepared
+        self._waiting = {}       # keys are threads, values are the URLs
+                                 #   they are waiting to be prepared
+        self._names = {}         # keys are references, values are Schema names
+        self._loaded = {}        # keys are digests, values are Schema names
+        self._load_locks = {}    # keys are digests, values are locks
+        self.stats = { "fetched": 0, "prepared": 0, "reused": 0 }
+
+    def fetch(self, url, calchash):
+        """
+        return the content of the document at the given URL and its digest,
+        retrieving it if it has not been already.  If another thread is
+        currently retrieving it, this waits for that thread's result.
+
+        :param url str:            the URL of the document
+        :param calchash function:  the function that computes the digest
+        :return tuple:  the content and its digest
+        """
+        with self._lock:
+            fetched = self._fetched.get(url)
+            mine = fetched is None
+            if mine:
+                fetched = self._fetched[url] = _Fetched()
+                self.stats['fetched'] += 1
+            else:
+                self.stats['reused'] += 1
+
+        if mine:
+            try:
+                fetched.content = _retrieve_url_content(url)
+                fetched.digest = calchash(fetched.content)
+            except Exception, ex:
+                fetched.error = ex
+            finally:
+                fetched.done.set()
+        else:
+            fetched.done.wait()
+
+        if fetched.error:
+            raise fetched.error
+        return (fetched.content, fetched.digest)
+
+    def prepared(self, url):
+        """
+        return the dependency at the given URL if it has already been 
+        prepared, waiting for it if another thread is currently preparing 
+        it.  If it has not been, None is returned and the URL is marked as 
+        being prepared by the calling thread, which must then record the 
+        result with set_prepared().  If waiting would deadlock--because the
+        thread preparing it is itself waiting, directly or indirectly, for a
+        schema the calling thread is preparing--a dependency carrying a 
+        circular reference error is returned instead.
+        """
+        me = threading.current_thread()
+        with self._lock:
+            prep = self._prepared.get(url)
+            if prep is None:
+                self._prepared[url] = _Prepared(me)
+                self.stats['prepared'] += 1
+                return None
+            self.stats['reused'] += 1
+            if not prep.done.is_set():
+                if self._waits_for(prep.owner, me):
+                    dep = _Dependency(self, url)
+                    dep.error = SchemaIngestError(
+                        "Circular reference to schema at URL={0}".format(url))
+                    return dep
+                self._waiting[me] = url
+
+        try:
+            prep.done.wait()
+        finally:
+            with self._lock:
+                self._waiting.pop(me, None)
+        return prep.dep
+
+    def _waits_for(self, thread, other):
+        # return True if the thread is the other one or is waiting, directly
+        # or through the threads it is waiting for, on the other one.  
+        # Called with the lock held.
+        while thread is not None:
+            if thread is other:
+                return True
+            url = self._waiting.get(thread)
+            thread = url and self._prepared[url].owner
+        return False
+
+    def set_prepared(self, url, dep):
+        """
+        record the prepared dependency at the given URL (which the calling
+        thread had claimed via prepared()), releasing any threads waiting
+        for it, and return it.
+        """
+        with self._lock:
+            prep = self._prepared.setdefault(url, _Prepared(None))
+            prep.dep = dep
+            prep.done.set()
+            return dep
+
+    def resolved_name(self, ref):
+        """
+        return the name of the schema a reference was previously resolved 
+        to, or None if it has not been resolved.
+
+        :param ref tuple:  a hashable description of the include or import
+                           statement
+        """
+        with self._lock:
+            return self._names.get(ref)
+
+    def set_resolved_name(self, ref, name):
+        """
+        record the name of the schema a reference has been resolved to.
+        """
+        with self._lock:
+            self._names[ref] = name
+
+    def load(self, loader):
+        """
+        load the schema via its (prepared) loader, unless a schema with the 
+        same digest has already been loaded in this session, and return its
+        name.
+        """
+        with self._lock:
+            lock = self._load_locks.setdefault(loader.digest, threading.Lock())
+        with lock:
+            if loader.digest not in self._loaded:
+                self._loaded[loader.digest] = loader.load().name
+            return self._loaded[loader.digest]
+
+class PrepareCache(LRUCache):
+    """
+    a cache of prepared SchemaLoaders for schemas that could not be loaded 
+    because of (fixable) errors, so that a retry--e.g. after the user has 
+    picked the schemas that its includes or imports refer to--does not 
+    start from scratch (see SchemaLoader.prepare()).  Loaders are keyed by 
+    the schema's digest, name, and location; a loader is removed from the 
+    cache while it is in use.  
+
+    The cache also keeps the diagnostics (see SchemaLoader.diagnostics())
+    of the most recent attempts, keyed by digest, so that they can be 
+    reported without preparing the schema again.  
+
+    The cached loaders are dropped whenever the version of a schema 
+    considered current changes.
+    """
+
+    def __init__(self, max_loaders=DEFAULT_PREPARE_CACHE_SIZE,
+                 max_diagnostics=DEFAULT_DIAGNOSTICS_CACHE_SIZE):
+        super(PrepareCache, self).__init__(max_loaders)
+        self._diagnostics = LRUCache(max_diagnostics)
+
+    def take(self, digest, name, location=None):
+        """
+        remove and return the cached loader for a schema, or None if there 
+        is none.  The returned loader gets a new LoadSession.
+        """
+        with self._lock:
+            entry = self._remove( (digest, name, location) )
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        loader = entry[0]
+        loader.session = LoadSession()
+        return loader
+
+    def put_loader(self, loader):
+        """
+        cache a prepared loader (and its diagnostics)
+        """
+        self.record(loader)
+        self.put( (loader.digest, loader.name, loader.location), loader )
+
+    def record(self, loader):
+        """
+        save the diagnostics from a loader's last preparation
+        """
+        self._diagnostics.put(loader.digest, loader.diagnostics())
+
+    def diagnostics(self, digest):
+        """
+        return the diagnostics saved for the schema with the given digest,
+        or None if none are available.
+        """
+        return self._diagnostics.get(digest)
+
+    def invalidate(self, name=None):
+        """
+        drop all cached loaders
+        """
+        self.clear()
+
+prepare_cache = PrepareCache()
+on_current_change(prepare_cache.invalidate)
+
+class _Fetched(object):
+    # the result of retrieving a document (see LoadSession.fetch())
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.content = None
+        self.digest = None
+        self.error = None
+
+class _Prepared(object):
+    # the state of the preparation of a dependency (see 
+    # LoadSession.prepared())
+
+    def __init__(self, owner):
+        self.done = threading.Event()
+        self.owner = owner     # the thread preparing it
+        self.dep = None
+
+class _Dependency(object):
+    # the result of retrieving and preparing an included or imported schema
+    # (see SchemaLoader.resolve_dependencies())
+
+    def __init__(self, session, url, namespace=None):
+        self.session = session
+        self.url = url
+        self.namespace = namespace
+        self.digest = None
+        self.name = None       # the name of a matching, loaded schema
+        self.loader = None     # a prepared loader for a new schema
+        self.error = None      # a (fixable) error retrieving the schema
+        self.exc_info = None   # a (fatal) error preparing the schema
+
+    def commit(self):
+        """
+        load the schema if necessary, returning its name, or None if it could 
+        not be retrieved (see the error property).  An exception raised 
+        while preparing it is raised here.
+        """
+        if self.exc_info:
+            raise self.exc_info[0], self.exc_info[1], self.exc_info[2]
+        if not self.name and self.loader:
+            self.namespace = self.loader.namespace
+            self.name = self.session.load(self.loader)
+        return self.name
+
 def _retrieve_url_content(url):
-    if url.startswith("file:"):
-        urlp = urlparse(url)
-        with open(urlp.path) as fd:
-            return fd.read()
-    else:
-        r = requests.get(url)
-        r.raise_for_status()
-        return r.text
+    return get_fetcher().fetch(url)
         
 
 
+def _get_setting(name, default=None):
+    try:
+        from django.conf import settings
+        return getattr(settings, name, default)
+    except Exception, ex:
+        # settings not configured
+        return default
+
+def _default_max_workers():
+    return _get_setting('SCHEMA_RESOLVE_WORKERS', DEFAULT_RESOLVE_WORKERS)
+
+def max_upload_size():
+    """
+    return the maximum allowed size of an uploaded schema document in bytes
+    (from the SCHEMA_MAX_UPLOAD_SIZE setting), or None if there is no limit.
+    """
+    return _get_setting('SCHEMA_MAX_UPLOAD_SIZE', None)
+
 def _calc_hash_on_string(datastr):
     return hashlib.md5(datastr).hexdigest()
 
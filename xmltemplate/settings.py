@@ -10,6 +10,43 @@ UNIT_TESTING = not (not django_testing or
 MONGO_TESTDB_URL = "mongodb://localhost/xmltemplate"
 connect( host=MONGO_TESTDB_URL )
 
+# the directory for caching schema documents retrieved from remote URLs 
+# (see fetch.py); if None, they are cached in memory only.
+SCHEMA_FETCH_CACHE_DIR = None
+
+# the memory budget, in bytes, for schema documents cached in memory (when
+# SCHEMA_FETCH_CACHE_DIR is None)
+SCHEMA_FETCH_CACHE_BYTES = 32 * 1024 * 1024
+
+# the number of seconds to wait for a remote schema document
+SCHEMA_FETCH_TIMEOUT = 30
+
+# OASIS XML catalog files that map schema locations and namespaces to local
+# copies of schema documents (see catalog.py)
+SCHEMA_CATALOG_FILES = []
+
+# local directories that mirror remote schema repositories:  keys are base
+# URLs, values are directories
+SCHEMA_MIRRORS = {}
+
+# the maximum number of included and imported schemas to retrieve and 
+# prepare concurrently while loading a schema
+SCHEMA_RESOLVE_WORKERS = 4
+
+# the maximum size, in bytes, of an uploaded schema document (after 
+# decompression); None means no limit
+SCHEMA_MAX_UPLOAD_SIZE = 16 * 1024 * 1024
+
+# if True, create the declared model indexes at startup and log a warning 
+# for each canonical query that would scan a collection (see audit.py)
+SCHEMA_AUDIT_INDEXES = True
+
+# if True, fill in at startup the denormalized fields missing from records
+# saved by earlier versions (see models.sync_records()).  This rewrites 
+# records across all the collections in every worker process, so it is off
+# by default; run the sync_records management command after upgrading.
+SCHEMA_SYNC_RECORDS = False
+
 ALLOWED_HOSTS = [ '*' ]
 DEBUG = True
 
@@ -142,6 +142,45 @@ class TestLoadSchemaDoc(test.TestCase):
         self.assertEquals(schema.location, "goober.xsd")
         self.assertEquals(schema.comment, 'yeah!')
 
+    def test_checkdigest_canon(self):
+        filename = "mylab.xsd"
+        content = self.get_file_content(filename)
+        summ = api.loadSchemaDoc(content, "mylab", filename, check_digest=True)
+        schema = models.Schema.get_by_name("mylab")
+        self.assertTrue(schema.canon_digest)
+
+        # the same schema, differently formatted, is recognized
+        reformatted = content.replace("\n", "\r\n").replace("  ", "\t")
+        summ = api.loadSchemaDoc(reformatted, "mylab", filename,
+                                 check_digest=True)
+        self.assertTrue(summ['ok'])
+        self.assertEquals(summ['version'], 1)
+        self.assertEquals(models.SchemaVersion.objects.filter(name="mylab")
+                                                      .count(), 1)
+
+        # but a real change is not
+        changed = content.replace('name="', 'name="x', 1)
+        summ = api.loadSchemaDoc(changed, "mylab", filename, check_digest=True)
+        self.assertEquals(summ['version'], 2)
+
+    def test_retry(self):
+        content = self.get_file_content("microscopy.xsd")
+        summ = api.loadSchemaDoc(content, "mic", "microscopy.xsd")
+        self.assertFalse(summ['ok'])
+        digest = summ['digest']
+        diag = api.prepare_cache.diagnostics(digest)
+        self.assertFalse(diag['ready'])
+        self.assertEquals(diag['errors'], summ['errors'])
+
+        # load the missing schema and try again
+        summ = api.loadSchemaDoc(self.get_file_content("experiments.xsd"),
+                                 "exp", "experiments.xsd")
+        self.assertTrue(summ['ok'])
+        summ = api.loadSchemaDoc(content, "mic", "microscopy.xsd",
+                                 ns_finder={"urn:experiments": "exp"})
+        self.assertTrue(summ['ok'])
+        self.assertTrue(api.prepare_cache.diagnostics(digest)['ready'])
+
     def test_badschema(self):
         filename = "badxsd.xsd"
         content = self.get_file_content(filename)
@@ -623,9 +662,23 @@ class TestSchemaDocVersion(test.TestCase):
 
         schema = models.Schema.get_by_name("mylab")
         self.assertEqual(schema.current, 1)
+        self.assertEqual(
+            models.GlobalElement.find_current("urn:mylab", "MyLab").count(), 1)
+        self.assertEqual(
+            models.GlobalElement.find_current("urn:experiments", "Lab").count(),
+            0)
+
         summ = api.SchemaDocVersion.make_current("mylab", 2)
         schema = models.Schema.get_by_name("mylab")
         self.assertEqual(schema.current, 2)
+        self.assertEqual(
+            models.GlobalElement.find_current("urn:mylab", "MyLab").count(), 0)
+        self.assertEqual(
+            models.GlobalElement.find_current("urn:experiments", "Lab").count(),
+            1)
+        self.assertEqual(
+            models.GlobalType.find_current("urn:experiments", "Equipment")[0]
+                  .version, 2)
 
     def test_delete(self):
         filename = "mylab.xsd"
@@ -643,6 +696,11 @@ class TestSchemaDocVersion(test.TestCase):
 
         summ = api.SchemaDocVersion.delete_version("mylab", 2)
         self.assertTrue(summ['is_deleted'])
+        self.assertEqual(
+            models.GlobalElement.find_current("urn:mylab", "MyLab").count(), 1)
+        self.assertEqual(
+            models.GlobalElement.find_current("urn:experiments", "Lab").count(),
+            0)
 
         self.assertEquals(api.SchemaDoc.get_view("mylab", 'versions'), [1])
         summ = api.SchemaDocVersion.get_view("mylab", 1, "summary")
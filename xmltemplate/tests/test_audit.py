@@ -0,0 +1,89 @@
+import unittest as test
+import os, pdb
+from mongoengine import connect
+
+from xmltemplate import audit
+
+def setUpMongo():
+    return connect(host=os.environ['MONGO_TESTDB_URL'])
+
+def tearDownMongo(mc):
+    try:
+        db = mc.get_default_database()
+        mc.drop_database(db.name)
+    except Exception, ex:
+        pass
+
+IXPLAN = {
+    "queryPlanner": {
+        "winningPlan": {
+            "stage": "FETCH",
+            "inputStage": { "stage": "IXSCAN", "indexName": "name_1" }
+        }
+    }
+}
+
+ORPLAN = {
+    "queryPlanner": {
+        "winningPlan": {
+            "stage": "SUBPLAN",
+            "inputStage": {
+                "stage": "FETCH",
+                "inputStage": {
+                    "stage": "OR",
+                    "inputStages": [
+                        { "stage": "IXSCAN" }, { "stage": "COLLSCAN" }
+                    ]
+                }
+            }
+        }
+    }
+}
+
+class TestPlans(test.TestCase):
+
+    def test_stages(self):
+        self.assertEquals(audit.plan_stages(IXPLAN), ["FETCH", "IXSCAN"])
+        self.assertEquals(audit.plan_stages(ORPLAN),
+                          ["SUBPLAN", "FETCH", "OR", "IXSCAN", "COLLSCAN"])
+        self.assertEquals(audit.plan_stages({"cursor": "BtreeCursor name_1"}),
+                          ["BtreeCursor name_1"])
+
+    def test_is_collection_scan(self):
+        self.assertFalse(audit.is_collection_scan(IXPLAN))
+        self.assertTrue(audit.is_collection_scan(ORPLAN))
+        self.assertTrue(audit.is_collection_scan({"cursor": "BasicCursor"}))
+        self.assertFalse(audit.is_collection_scan(
+                                             {"cursor": "BtreeCursor name_1"}))
+
+@test.skipIf(not os.environ.get('MONGO_TESTDB_URL'),
+             "test mongodb not available")
+class TestAudit(test.TestCase):
+
+    def setUp(self):
+        self.mc = setUpMongo()
+
+    def tearDown(self):
+        tearDownMongo(self.mc)
+        self.mc.close()
+
+    def test_no_scans(self):
+        results = audit.audit_indexes()
+        self.assertEquals(len(results), len(audit.CANONICAL_QUERIES))
+        for result in results:
+            self.assertIsNotNone(result["scan"], result.get("error"))
+            self.assertFalse(result["scan"], "{0} scans {1}: {2}".format(
+                result["query"], result["collection"], result["stages"]))
+        self.assertEquals(audit.log_audit(ensure=False), 0)
+
+
+TESTS = "TestPlans TestAudit".split()
+
+def test_suite():
+    suite = test.TestSuite()
+    suite.addTests([test.makeSuite(TestPlans)])
+    suite.addTests([test.makeSuite(TestAudit)])
+    return suite
+
+if __name__ == '__main__':
+    test.main()
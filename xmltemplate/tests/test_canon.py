@@ -0,0 +1,132 @@
+import unittest as test
+import os, pdb
+
+from lxml import etree
+
+from xmltemplate.canon import canonical_digest, canonical_tree
+
+datadir = os.path.join(os.path.dirname(__file__), "data")
+
+SCHEMA = """<?xml version="1.0" encoding="UTF-8"?>
+<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema"
+           xmlns:ex="urn:experiments"
+           targetNamespace="urn:experiments" elementFormDefault="qualified">
+  <!-- a laboratory -->
+  <xs:complexType name="Lab">
+    <xs:sequence>
+      <xs:element name="room" type="xs:string" minOccurs="0"/>
+    </xs:sequence>
+  </xs:complexType>
+  <xs:simpleType name="Codes">
+    <xs:union memberTypes="xs:token ex:Code"/>
+  </xs:simpleType>
+  <xs:simpleType name="Code">
+    <xs:restriction base="xs:token">
+      <xs:pattern value="[A-Z]+ [0-9]+"/>
+    </xs:restriction>
+  </xs:simpleType>
+  <xs:element name="lab" type="ex:Lab">
+    <xs:annotation>
+      <xs:documentation>The  lab,
+         described</xs:documentation>
+    </xs:annotation>
+  </xs:element>
+</xs:schema>
+"""
+
+# the same schema, reformatted with different prefixes
+REFORMATTED = """<schema xmlns="http://www.w3.org/2001/XMLSchema" 
+        elementFormDefault="qualified" targetNamespace="urn:experiments"
+        xmlns:e="urn:experiments"><complexType name="Lab"><sequence>
+<element minOccurs="0" type="string" name="room"/></sequence></complexType>
+<simpleType name="Codes"><union memberTypes="token  e:Code"/></simpleType>
+<simpleType name="Code"><restriction base=" token"><pattern 
+value="[A-Z]+ [0-9]+"/></restriction></simpleType>
+<element type="e:Lab" name="lab"><annotation><documentation>The  lab,
+         described</documentation></annotation></element></schema>"""
+
+# a schema with an identity constraint
+KEYED = """<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema"
+           xmlns:%s="urn:labs" xmlns:%s="urn:other" 
+           targetNamespace="urn:experiments">
+  <xs:element name="labs">
+    <xs:key name="labKey">
+      <xs:selector xpath=".//%s:lab"/>
+      <xs:field xpath="@%s:id"/>
+    </xs:key>
+  </xs:element>
+</xs:schema>
+"""
+
+def digest(content):
+    return canonical_digest(etree.fromstring(content).getroottree())
+
+class TestCanonicalDigest(test.TestCase):
+
+    def test_same(self):
+        self.assertEquals(digest(SCHEMA), digest(REFORMATTED))
+        self.assertEquals(digest(SCHEMA.replace("\n", "\r\n")), digest(SCHEMA))
+
+    def test_different(self):
+        self.assertNotEquals(digest(SCHEMA),
+                             digest(SCHEMA.replace('minOccurs="0"',
+                                                   'minOccurs="1"')))
+        self.assertNotEquals(digest(SCHEMA),
+                             digest(SCHEMA.replace('type="ex:Lab"',
+                                                   'type="xs:string"')))
+        self.assertNotEquals(digest(SCHEMA),
+                             digest(SCHEMA.replace('The  lab', 'A lab')))
+
+    def test_whitespace(self):
+        # whitespace is significant in facet values and documentation
+        self.assertNotEquals(digest(SCHEMA),
+                             digest(SCHEMA.replace('+ [0-9]', '+  [0-9]')))
+        self.assertNotEquals(digest(SCHEMA),
+                             digest(SCHEMA.replace('The  lab', 'The lab')))
+
+    def test_qnames(self):
+        root = canonical_tree(etree.fromstring(SCHEMA))
+        el = root.find("{http://www.w3.org/2001/XMLSchema}element")
+        self.assertEquals(el.get('type'), "{urn:experiments}Lab")
+
+    def test_namespaces(self):
+        # declarations are kept (with generated prefixes) even if unused
+        root = canonical_tree(etree.fromstring(SCHEMA))
+        self.assertEquals(sorted(root.nsmap.values()),
+                          ["http://www.w3.org/2001/XMLSchema",
+                           "urn:experiments"])
+        self.assertNotEquals(digest(SCHEMA),
+                             digest(SCHEMA.replace('xmlns:ex=',
+                                      'xmlns:z="urn:z" xmlns:ex=')))
+
+    def test_xpath(self):
+        # the prefixes in identity constraint XPaths are resolved
+        self.assertEquals(digest(KEYED % ("ex", "o", "ex", "ex")),
+                          digest(KEYED % ("lb", "o", "lb", "lb")))
+
+        # the same prefix bound to a different namespace
+        self.assertNotEquals(digest(KEYED % ("ex", "o", "ex", "ex")),
+                             digest(KEYED % ("o", "ex", "ex", "ex")))
+
+        root = canonical_tree(etree.fromstring(KEYED % ("ex", "o", 
+                                                        "ex", "ex")))
+        xpaths = [el.get('xpath') for el in root.iter() if el.get('xpath')]
+        self.assertEquals(xpaths, [".//{urn:labs}lab", "@{urn:labs}id"])
+
+    def test_file(self):
+        with open(os.path.join(datadir, "experiments.xsd")) as fd:
+            content = fd.read()
+        self.assertEquals(digest(content), 
+                          canonical_digest(etree.parse(
+                              os.path.join(datadir, "experiments.xsd"))))
+
+
+TESTS = "TestCanonicalDigest".split()
+
+def test_suite():
+    suite = test.TestSuite()
+    suite.addTests([test.makeSuite(TestCanonicalDigest)])
+    return suite
+
+if __name__ == '__main__':
+    test.main()
@@ -0,0 +1,126 @@
+import unittest as test
+import os, pdb, shutil, tempfile
+
+from xmltemplate.catalog import XMLCatalog, CatalogError, SCHEMANAME_SCHEME
+from xmltemplate.fetch import SchemaFetcher
+
+datadir = os.path.abspath(os.path.join(os.path.dirname(__file__), "data"))
+
+CATALOG = """<catalog xmlns="urn:oasis:names:tc:entity:xmlns:xml:catalog">
+  <system systemId="http://example.com/experiments.xsd" 
+          uri="experiments.xsd"/>
+  <uri name="urn:experiments" uri="local/experiments.xsd"/>
+  <public publicId="urn:microscopy" uri="schemaname:microscopy"/>
+  <group xml:base="mirror/">
+    <rewriteSystem systemIdStartString="http://example.com/schemas/"
+                   rewritePrefix="schemas/"/>
+    <rewriteSystem systemIdStartString="http://example.com/schemas/nist/"
+                   rewritePrefix="nist/"/>
+  </group>
+  <nextCatalog catalog="next.xml"/>
+</catalog>
+"""
+
+NEXT = """<catalog xmlns="urn:oasis:names:tc:entity:xmlns:xml:catalog">
+  <uri name="urn:mylab" uri="mylab.xsd"/>
+</catalog>
+"""
+
+CYCLE = """<catalog xmlns="urn:oasis:names:tc:entity:xmlns:xml:catalog">
+  <uri name="urn:%s" uri="%s.xsd"/>
+  <nextCatalog catalog="%s"/>
+</catalog>
+"""
+
+class TestXMLCatalog(test.TestCase):
+
+    def setUp(self):
+        self.catdir = tempfile.mkdtemp()
+        self.catfile = os.path.join(self.catdir, "catalog.xml")
+        with open(self.catfile, 'w') as fd:
+            fd.write(CATALOG)
+        with open(os.path.join(self.catdir, "next.xml"), 'w') as fd:
+            fd.write(NEXT)
+        self.base = "file://" + self.catdir + "/"
+
+    def tearDown(self):
+        shutil.rmtree(self.catdir)
+
+    def test_system(self):
+        cat = XMLCatalog.from_file(self.catfile)
+        self.assertEquals(cat.resolve("http://example.com/experiments.xsd"),
+                          self.base + "experiments.xsd")
+        self.assertIsNone(cat.resolve("http://example.com/goober.xsd"))
+
+    def test_rewrite(self):
+        cat = XMLCatalog.from_file(self.catfile)
+        self.assertEquals(cat.resolve("http://example.com/schemas/a/b.xsd"),
+                          self.base + "mirror/schemas/a/b.xsd")
+        # the longest prefix wins
+        self.assertEquals(cat.resolve("http://example.com/schemas/nist/c.xsd"),
+                          self.base + "mirror/nist/c.xsd")
+
+    def test_namespace(self):
+        cat = XMLCatalog.from_file(self.catfile)
+        self.assertEquals(cat.resolve(None, "urn:experiments"),
+                          self.base + "local/experiments.xsd")
+
+        # the location takes precedence
+        self.assertEquals(cat.resolve("http://example.com/experiments.xsd",
+                                      "urn:experiments"),
+                          self.base + "experiments.xsd")
+        self.assertEquals(cat.resolve("http://example.com/goober.xsd",
+                                      "urn:experiments"),
+                          self.base + "local/experiments.xsd")
+
+    def test_schemaname(self):
+        cat = XMLCatalog.from_file(self.catfile)
+        self.assertEquals(cat.resolve(None, "urn:microscopy"),
+                          SCHEMANAME_SCHEME + "microscopy")
+
+    def test_next(self):
+        cat = XMLCatalog.from_file(self.catfile)
+        self.assertEquals(cat.resolve(None, "urn:mylab"),
+                          self.base + "mylab.xsd")
+        self.assertIsNone(cat.resolve(None, "urn:goober"))
+
+    def test_next_cycle(self):
+        # a.xml -> b.xml -> a.xml, and c.xml refers to itself
+        for name, nxt in (("a", "b.xml"), ("b", "./a.xml"), ("c", "c.xml")):
+            with open(os.path.join(self.catdir, name+".xml"), 'w') as fd:
+                fd.write(CYCLE % (name, name, nxt))
+
+        cat = XMLCatalog.from_file(os.path.join(self.catdir, "a.xml"))
+        self.assertEquals(cat.resolve(None, "urn:b"), self.base + "b.xsd")
+        self.assertIsNone(cat.resolve(None, "urn:goober"))
+        self.assertIsNone(cat.resolve("goober.xsd", "urn:goober"))
+
+        cat = XMLCatalog.from_file(os.path.join(self.catdir, "c.xml"))
+        self.assertIsNone(cat.resolve(None, "urn:goober"))
+
+    def test_badfile(self):
+        with self.assertRaises(CatalogError):
+            XMLCatalog.from_file(os.path.join(self.catdir, "goober.xml"))
+        with self.assertRaises(CatalogError):
+            XMLCatalog.from_file(os.path.join(datadir, "experiments.xsd"))
+
+    def test_mirror(self):
+        cat = XMLCatalog()
+        cat.add_mirror("http://example.com/schemas", datadir)
+        loc = cat.resolve("http://example.com/schemas/experiments.xsd")
+        self.assertEquals(loc, "file://" + datadir + "/experiments.xsd")
+
+        # the local copy can be retrieved
+        with open(os.path.join(datadir, "experiments.xsd")) as fd:
+            self.assertEquals(SchemaFetcher().fetch(loc), fd.read())
+
+
+TESTS = "TestXMLCatalog".split()
+
+def test_suite():
+    suite = test.TestSuite()
+    suite.addTests([test.makeSuite(TestXMLCatalog)])
+    return suite
+
+if __name__ == '__main__':
+    test.main()
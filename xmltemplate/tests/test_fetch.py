@@ -0,0 +1,147 @@
+import unittest as test
+import os, pdb, shutil, tempfile, threading
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+from xmltemplate.fetch import SchemaFetcher, SchemaFetchError
+
+datadir = os.path.join(os.path.dirname(__file__), "data")
+
+with open(os.path.join(datadir, "experiments.xsd")) as fd:
+    EXPERIMENTS = fd.read()
+
+class _SchemaHandler(BaseHTTPRequestHandler):
+    # serves experiments.xsd with an ETag, honoring If-None-Match
+
+    ETAG = '"exp-1"'
+    requests = []
+
+    def do_GET(self):
+        _SchemaHandler.requests.append(
+            (self.path, self.headers.get('If-None-Match')))
+        if self.path != "/experiments.xsd":
+            self.send_error(404)
+            return
+        if self.headers.get('If-None-Match') == self.ETAG:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/xml')
+        self.send_header('Content-Length', str(len(EXPERIMENTS)))
+        self.send_header('ETag', self.ETAG)
+        self.end_headers()
+        self.wfile.write(EXPERIMENTS)
+
+    def log_message(self, format, *args):
+        pass
+
+class TestSchemaFetcher(test.TestCase):
+
+    def setUp(self):
+        _SchemaHandler.requests = []
+        self.server = HTTPServer(('127.0.0.1', 0), _SchemaHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.baseurl = "http://127.0.0.1:{0}/".format(self.server.server_port)
+        self.cachedir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+        shutil.rmtree(self.cachedir)
+
+    def test_fetch(self):
+        fetcher = SchemaFetcher(timeout=5)
+        url = self.baseurl + "experiments.xsd"
+        self.assertEquals(fetcher.fetch(url), EXPERIMENTS)
+        self.assertEquals(fetcher.stats['misses'], 1)
+        self.assertEquals(_SchemaHandler.requests, [("/experiments.xsd", None)])
+
+        # revalidated rather than downloaded
+        self.assertEquals(fetcher.fetch(url), EXPERIMENTS)
+        self.assertEquals(fetcher.stats['hits'], 1)
+        self.assertEquals(fetcher.stats['misses'], 1)
+        self.assertEquals(_SchemaHandler.requests[1],
+                          ("/experiments.xsd", _SchemaHandler.ETAG))
+
+    def test_memory_budget(self):
+        url = self.baseurl + "experiments.xsd"
+        fetcher = SchemaFetcher(timeout=5, max_bytes=len(EXPERIMENTS) - 1)
+        self.assertEquals(fetcher.fetch(url), EXPERIMENTS)
+        self.assertLessEqual(fetcher._store._cache.size, len(EXPERIMENTS) - 1)
+
+        # too big to keep, so it is downloaded again
+        self.assertEquals(fetcher.fetch(url), EXPERIMENTS)
+        self.assertEquals(fetcher.stats['misses'], 2)
+        self.assertEquals(_SchemaHandler.requests[1], ("/experiments.xsd", None))
+
+    def test_disk_cache(self):
+        url = self.baseurl + "experiments.xsd"
+        fetcher = SchemaFetcher(self.cachedir, timeout=5)
+        fetcher.fetch(url)
+        self.assertEquals(len(os.listdir(os.path.join(self.cachedir,
+                                                      "objects"))), 1)
+
+        # a new fetcher picks up where the last left off
+        fetcher = SchemaFetcher(self.cachedir, timeout=5)
+        self.assertEquals(fetcher.fetch(url), EXPERIMENTS)
+        self.assertEquals(fetcher.stats['hits'], 1)
+        self.assertEquals(fetcher.stats['misses'], 0)
+
+    def test_notfound(self):
+        fetcher = SchemaFetcher(timeout=5)
+        with self.assertRaises(SchemaFetchError):
+            fetcher.fetch(self.baseurl + "goober.xsd")
+        self.assertEquals(fetcher.stats['errors'], 1)
+
+    def test_stale(self):
+        url = self.baseurl + "experiments.xsd"
+        fetcher = SchemaFetcher(self.cachedir, timeout=5)
+        fetcher.fetch(url)
+
+        # the server goes away
+        self.server.shutdown()
+        self.server.server_close()
+        self.server = None
+
+        self.assertEquals(fetcher.fetch(url), EXPERIMENTS)
+        self.assertEquals(fetcher.stats['stale'], 1)
+
+    def test_session_per_thread(self):
+        fetcher = SchemaFetcher(timeout=5)
+        url = self.baseurl + "experiments.xsd"
+        sessions = []
+        def fetch():
+            self.assertEquals(fetcher.fetch(url), EXPERIMENTS)
+            sessions.append(fetcher.session)
+        threads = [threading.Thread(target=fetch) for i in range(3)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEquals(len(set([id(s) for s in sessions])), 3)
+        self.assertIs(fetcher.session, fetcher.session)
+        self.assertEquals(fetcher.stats['errors'], 0)
+
+    def test_file(self):
+        fetcher = SchemaFetcher(timeout=5)
+        url = "file://" + os.path.abspath(os.path.join(datadir,
+                                                       "experiments.xsd"))
+        self.assertEquals(fetcher.fetch(url), EXPERIMENTS)
+
+        with self.assertRaises(SchemaFetchError):
+            fetcher.fetch("file:///goober/experiments.xsd")
+
+
+TESTS = "TestSchemaFetcher".split()
+
+def test_suite():
+    suite = test.TestSuite()
+    suite.addTests([test.makeSuite(TestSchemaFetcher)])
+    return suite
+
+if __name__ == '__main__':
+    test.main()
@@ -6,6 +6,8 @@ from mongoengine import connect
 
 from xmltemplate import models
 from xmltemplate.models import RECORD
+from xmltemplate.canon import canonical_digest
+from lxml import etree
 #from mgi import settings
 
 def setUpMongo():
@@ -157,6 +159,34 @@ class TestSchemaModels(test.TestCase):
         
         self.assertEquals(models.SchemaVersion.next_version_for('foofoo'), 1)
         
+    def test_allocate_version(self):
+        # the counter is seeded from versions saved without it
+        self.test_load_schema()
+        sc = models.SchemaCommon.objects.get(name='goober')
+        self.assertIsNone(sc.lastver)
+        self.assertEquals(sc.allocate_version(), 2)
+        self.assertEquals(sc.allocate_version(), 3)
+        self.assertEquals(models.SchemaVersion.next_version_for('goober'), 4)
+
+        sc = models.SchemaCommon(namespace="urn:foo", name="foofoo", current=0)
+        sc.save()
+        self.assertEquals(sc.allocate_version(), 1)
+
+    def test_allocate_version_concurrently(self):
+        import threading
+        self.test_load_schema()
+        sc = models.SchemaCommon.objects.get(name='goober')
+        got = []
+        def allocate():
+            for i in range(10):
+                got.append(sc.allocate_version())
+        threads = [threading.Thread(target=allocate) for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEquals(sorted(got), range(2, 42))
+        
     def test_find(self):
         ns = "urn:experiments"
         self.test_load_schema()
@@ -165,6 +195,79 @@ class TestSchemaModels(test.TestCase):
         self.assertEquals(found[0].namespace, ns)
         self.assertEquals(found[0].name, "goober")
         
+    def test_find_current(self):
+        ns = "urn:experiments"
+        self.test_load_schema()
+        sc = models.SchemaCommon.objects.get(name="goober")
+        newver = models.SchemaVersion(name="goober", common=sc, 
+                                      location="goober.xsd",
+                                      status=RECORD.AVAILABLE, 
+                                      content="<schema></schema>", digest="yyz",
+                                      version=sc.allocate_version())
+        newver.save()
+        self.assertEquals(newver.namespace, ns)
+
+        found = models.Schema.find(namespace=ns, location="goober.xsd")
+        self.assertEquals(sorted([s.version for s in found]), [1, 2])
+        found = models.Schema.find(namespace=ns, current=True)
+        self.assertEquals([s.version for s in found], [1])
+        found = models.Schema.find(namespace=ns, current=False)
+        self.assertEquals([s.version for s in found], [2])
+        self.assertEquals(models.Schema.find(namespace="urn:goob"), [])
+
+    def test_sync_current_flags(self):
+        ns = "urn:experiments"
+        self.test_load_schema()
+
+        # a type saved before the current flags were introduced
+        models.GlobalType._get_collection().insert_one(
+            { "name": "Goob", "namespace": ns, "schemaname": "goober",
+              "version": 1 })
+        self.assertEquals(models.GlobalType.find_current(ns, "Goob").count(),
+                          0)
+
+        models.sync_records()
+        found = models.GlobalType.find_current(ns, "Goob")
+        self.assertEquals([t.version for t in found], [1])
+
+        # running it again changes nothing
+        models.sync_records()
+        self.assertEquals(models.GlobalType.find_current(ns, "Goob").count(),
+                          1)
+
+    def test_sync_namespaces(self):
+        ns = "urn:experiments"
+        self.test_load_schema()
+
+        # a version saved before it had a namespace of its own
+        models.SchemaVersion._get_collection().update_many(
+            {}, { "$unset": { "namespace": "" } })
+        self.assertEquals(models.Schema.find(namespace=ns, current=True), [])
+
+        models.sync_records()
+        found = models.Schema.find(namespace=ns, current=True)
+        self.assertEquals([s.name for s in found], ["goober"])
+
+    def test_sync_canon_digests(self):
+        content = '<schema xmlns="http://www.w3.org/2001/XMLSchema">' \
+                  '<element name="a"/></schema>'
+        self.load_schema("goober", "goober.xsd", content=content)
+
+        # a version saved before canonical digests were introduced
+        models.SchemaVersion._get_collection().update_many(
+            {}, { "$unset": { "canon_digest": "" } })
+        self.assertIsNone(models.SchemaVersion.get_by_canon_digest(
+            canonical_digest(etree.fromstring(content))))
+
+        models.sync_records()
+        reformatted = '<xs:schema ' \
+                      'xmlns:xs="http://www.w3.org/2001/XMLSchema">\n' \
+                      '  <xs:element name="a" />\n</xs:schema>'
+        found = models.SchemaVersion.get_by_canon_digest(
+            canonical_digest(etree.fromstring(reformatted)))
+        self.assertIsNotNone(found)
+        self.assertEquals(found.name, "goober")
+
     def test_find_one(self):
         ns = "urn:experiments"
         self.test_load_schema()
@@ -400,6 +503,25 @@ class TestTemplateModels(test.TestCase):
         self.assertEquals(ver.schema.digest, "xxx")
         self.assertEquals(ver.label, "Title")
 
+    def test_template_versions(self):
+        self.test_load_template()
+        tmpl = models.TemplateCommon.objects.get(name="experiments")
+        schemaVer = models.SchemaVersion.objects.get(name="goober")
+        tmplVer = models.TemplateVersion(name=tmpl.name, common=tmpl,
+                                         schema=schemaVer, label="Title 2")
+        tmplVer.save()
+        self.assertEquals(tmplVer.version, 2)
+
+        # versions are numbered per template
+        other = models.TemplateCommon(name="others", current=1,
+                                      root="{urn:experiments}lab")
+        other.save()
+        otherVer = models.TemplateVersion(name=other.name, common=other,
+                                          schema=schemaVer, label="Other")
+        otherVer.save()
+        self.assertEquals(otherVer.version, 1)
+        self.assertEquals(tmpl.allocate_version(), 3)
+
     def test_template(self):
         ns = "urn:experiments"
         nm = "experiments"
@@ -425,6 +547,48 @@ class TestTemplateModels(test.TestCase):
         self.assertEquals(found[0].name, nm)
         self.assertEquals(found[0].label, "Title")
         
+    def test_find_current(self):
+        nm = "experiments"
+        self.test_load_template()
+        tmpl = models.TemplateCommon.objects.get(name=nm)
+        schemaVer = models.SchemaVersion.objects.get(name="goober")
+        tmplVer = models.TemplateVersion(name=nm, common=tmpl,
+                                         schema=schemaVer, label="Title 2")
+        tmplVer.save()
+        self.assertEquals(tmplVer.root, "{urn:experiments}lab")
+
+        found = models.Template.find(root="{urn:experiments}lab")
+        self.assertEquals(sorted([t.version for t in found]), [1, 2])
+        found = models.Template.find(root="{urn:experiments}lab", current=True)
+        self.assertEquals([t.version for t in found], [1])
+        found = models.Template.find(name=nm, current=False)
+        self.assertEquals([t.version for t in found], [2])
+        self.assertEquals(models.Template.find(root="{urn:goob}lab"), [])
+
+        # the flags follow the common record's current version
+        tmpl.current = 2
+        tmpl.save()
+        found = models.Template.find(name=nm, current=True)
+        self.assertEquals([t.version for t in found], [2])
+        found = models.Template.find(name=nm, current=False)
+        self.assertEquals([t.version for t in found], [1])
+
+    def test_sync_records(self):
+        nm = "experiments"
+        self.test_load_template()
+
+        # a version saved before it had its own root and current flag
+        models.TemplateVersion._get_collection().update_many(
+            {}, { "$unset": { "root": "", "current": "" } })
+        self.assertEquals(models.Template.find(root="{urn:experiments}lab"),
+                          [])
+        self.assertEquals(models.Template.find(name=nm, current=True), [])
+
+        models.sync_records()
+        found = models.Template.find(root="{urn:experiments}lab",
+                                     current=True)
+        self.assertEquals([t.version for t in found], [1])
+
     def test_find_one(self):
         nm = "experiments"
         self.test_load_template()
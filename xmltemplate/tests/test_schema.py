@@ -1,12 +1,14 @@
 # import mgi.settings as settings
 # from django import test
 import unittest as test
-import os, pdb
+import os, pdb, shutil, tempfile, gzip, threading, time
+from cStringIO import StringIO
 from mongoengine import connect
 
 from xmltemplate import models
 from xmltemplate import schema
 from xmltemplate import validate as val
+from xmltemplate.catalog import XMLCatalog, SCHEMANAME_SCHEME
 
 datadir = os.path.join(os.path.dirname(__file__), "data")
 
@@ -41,6 +43,41 @@ class TestSchemaLoader(test.TestCase):
         self.assertIsNone(loader.location)
         self.assertTrue("<?xml" in loader.content)
 
+    def test_streamed_schema(self):
+        schemafile = os.path.join(datadir, "experiments.xsd")
+        with open(schemafile) as fd:
+            content = fd.read()
+
+        buf = StringIO()
+        with gzip.GzipFile(fileobj=buf, mode='wb') as fd:
+            fd.write(content)
+        strm = schema.StreamedSchema.read(StringIO(buf.getvalue()),
+                                          encoding="gzip")
+        self.assertEquals(strm.content, content)
+        self.assertEquals(strm.size, len(content))
+        self.assertIsNotNone(strm.tree)
+
+        # the read buffer is released once the content is extracted
+        self.assertIsNone(strm._buf)
+
+        # the loader reuses the parsed tree and digest
+        loader = strm.loader("exp", "experiments.xsd")
+        self.assertIs(loader.tree, strm.tree)
+        self.assertEquals(loader.digest, 
+                          schema._calc_hash_on_string(content))
+        loader.check_namespace()
+        self.assertEquals(loader.namespace, "urn:experiments")
+
+        with self.assertRaises(schema.SchemaTooLarge):
+            schema.StreamedSchema.read(StringIO(buf.getvalue()),
+                                       maxsize=len(content)-1, encoding="gzip")
+
+        # not well-formed:  reported when the loader is used
+        strm = schema.StreamedSchema.read(StringIO("<xs:schema>"))
+        self.assertIsNone(strm.tree)
+        with self.assertRaises(val.ValidationError):
+            strm.loader("bad").xml_validate()
+
     def test_from_file(self):
         schemafile = os.path.join(datadir, "experiments.xsd")
         loader = schema.SchemaLoader.from_file(schemafile, "exp",
@@ -123,6 +160,24 @@ class TestSchemaLoader(test.TestCase):
         self.assertIsNotNone(loader.tree)
         self.assertEquals(len(errors), 1)
 
+    def test_parse_once(self):
+        loader = create_loader("mylab.xsd")
+        loader.xsd_validate()
+        tree = loader.tree
+        valid8r = loader.valid8r
+
+        # the earlier result is reused
+        self.assertEquals(loader.get_validation_errors(), [])
+        self.assertIs(loader.tree, tree)
+        self.assertIs(loader.valid8r, valid8r)
+
+        loader = create_loader("badxsd.xsd")
+        with self.assertRaises(val.SchemaValidationError):
+            loader.xsd_validate()
+        tree = loader.tree
+        self.assertEquals(len(loader.get_validation_errors()), 1)
+        self.assertIs(loader.tree, tree)
+
     def test_check_namespace(self):
         loader = create_loader("mylab.xsd")
         self.assertIsNone(loader.tree)
@@ -176,6 +231,84 @@ class TestSchemaLoader(test.TestCase):
         self.assertEquals(loader.prefixes['xs'], "http://www.w3.org/2001/XMLSchema")
         self.assertEquals(len(loader.prefixes), 2)
 
+    def test_session_fetch(self):
+        session = schema.LoadSession()
+        url = "file://" + os.path.abspath(os.path.join(datadir, "mylab.xsd"))
+        content, digest = session.fetch(url, schema._calc_hash_on_string)
+        self.assertIn('targetNamespace="urn:mylab"', content)
+        self.assertEquals(digest, schema._calc_hash_on_string(content))
+
+        self.assertEquals(session.fetch(url, schema._calc_hash_on_string),
+                          (content, digest))
+        self.assertEquals(session.stats['fetched'], 1)
+        self.assertEquals(session.stats['reused'], 1)
+
+        with self.assertRaises(Exception):
+            session.fetch(url.replace("mylab", "goober"), 
+                          schema._calc_hash_on_string)
+
+    def wait_for_waiters(self, session, count):
+        for i in range(500):
+            with session._lock:
+                if len(session._waiting) >= count:
+                    return
+            time.sleep(0.01)
+        self.fail("no thread is waiting")
+
+    def test_session_prepared(self):
+        session = schema.LoadSession()
+        url = "file:///goober.xsd"
+        self.assertIsNone(session.prepared(url))
+
+        # another thread needing it waits for this one to prepare it
+        got = []
+        waiter = threading.Thread(
+            target=lambda: got.append(session.prepared(url)))
+        waiter.start()
+        self.wait_for_waiters(session, 1)
+        self.assertEquals(got, [])
+
+        dep = schema._Dependency(session, url)
+        self.assertIs(session.set_prepared(url, dep), dep)
+        waiter.join()
+        self.assertEquals(got, [dep])
+        self.assertIs(session.prepared(url), dep)
+        self.assertEquals(session.stats['prepared'], 1)
+        self.assertEquals(session.stats['reused'], 2)
+
+    def test_session_circular_wait(self):
+        session = schema.LoadSession()
+        a = "file:///a.xsd"
+        b = "file:///b.xsd"
+        self.assertIsNone(session.prepared(a))
+
+        # another thread preparing b waits for a...
+        got = []
+        def prepare_b():
+            session.prepared(b)
+            got.append(session.prepared(a))
+            session.set_prepared(b, schema._Dependency(session, b))
+        other = threading.Thread(target=prepare_b)
+        other.start()
+        self.wait_for_waiters(session, 1)
+
+        # ...so waiting for b would deadlock
+        dep = session.prepared(b)
+        self.assertIsInstance(dep.error, schema.SchemaIngestError)
+        self.assertIn("Circular", str(dep.error))
+
+        adep = schema._Dependency(session, a)
+        session.set_prepared(a, adep)
+        other.join()
+        self.assertEquals(got, [adep])
+
+    def test_chain(self):
+        loader = schema.SchemaLoader("<schema />", "a.xsd",
+                                     location="file:///a.xsd")
+        self.assertEquals(loader._chain, ("file:///a.xsd",))
+        loader = schema.SchemaLoader("<schema />", "a.xsd")
+        self.assertEquals(loader._chain, ())
+
 @test.skipIf(not os.environ.get('MONGO_TESTDB_URL'),
              "test mongodb not available")
 class TestSchemaLoaderDB(test.TestCase):
@@ -245,6 +378,27 @@ class TestSchemaLoaderDB(test.TestCase):
         self.assertEquals(schema.namespace, "urn:experiments")
         self.assertEquals(schema.prefixes['ex'], "urn:experiments")
         self.assertTrue('xs' in schema.prefixes)
+
+    def test_reload_shares_annots(self):
+        schemafile = "experiments.xsd"
+        create_loader(schemafile, schemafile).load()
+        ntypes = models.GlobalType.objects.count()
+        nelems = models.GlobalElement.objects.count()
+        ntannots = models.GlobalTypeAnnots.objects.count()
+        neannots = models.GlobalElementAnnots.objects.count()
+        self.assertTrue(ntypes > 0)
+        self.assertTrue(nelems > 0)
+        self.assertEquals(ntannots, ntypes)
+        self.assertEquals(neannots, nelems)
+
+        create_loader(schemafile, schemafile).load()
+        self.assertEquals(models.GlobalType.objects.count(), 2*ntypes)
+        self.assertEquals(models.GlobalElement.objects.count(), 2*nelems)
+        self.assertEquals(models.GlobalTypeAnnots.objects.count(), ntannots)
+        self.assertEquals(models.GlobalElementAnnots.objects.count(), neannots)
+
+        for tp in models.GlobalType.objects.filter(version=2):
+            self.assertEquals(tp.annots.name, tp.name)
         
     def test_import(self):
         schemafile = "experiments.xsd"
@@ -279,6 +433,108 @@ class TestSchemaLoaderDB(test.TestCase):
         self.assertEquals(imported.name, importedname)
         self.assertEquals(imported.name, "experiments.xsd")
         self.assertEquals(imported.namespace, "urn:experiments")
+        self.assertEquals(schema.closure, ["experiments.xsd::1"])
+        self.assertEquals(imported.closure, [])
+        self.assertIn('schemaLocation="schemaname:experiments.xsd"',
+                      schema.doctored)
+        self.assertEquals(imported.doctored, "")
+
+    def test_prepare_timings(self):
+        loader = create_loader("experiments.xsd")
+        loader.name = "experiments.xsd"
+        loader.load()
+
+        loader = create_loader("microscopy.xsd")
+        loader.name = "microscopy.xsd"
+        self.assertTrue(loader.prepare())
+        self.assertEquals(loader.timings.keys(),
+                          ["digest", "parse", "namespace", "prefixes",
+                           "includes", "imports", "compile", "global_defs"])
+
+        # the shared tree is left as it was parsed
+        nsm = {"xs": val.XSD_NS}
+        imp = loader.tree.getroot().find("xs:import", nsm)
+        self.assertFalse(imp.get("schemaLocation", "").startswith(
+                                             val.SchemaProvider.CACHE_SCHEME))
+
+    def test_prepare_again(self):
+        loader = create_loader("microscopy.xsd")
+        loader.name = "microscopy.xsd"
+        self.assertFalse(loader.prepare())
+        self.assertIn("compile", loader.timings)
+        diag = loader.diagnostics()
+        self.assertFalse(diag['ready'])
+        self.assertEquals([u['namespace'] for u in diag['unresolved']],
+                          ["urn:experiments"])
+
+        # nothing has changed, so nothing is redone
+        self.assertFalse(loader.prepare())
+        self.assertEquals(loader.timings.keys(), 
+                          ["digest", "includes", "imports"])
+        self.assertEquals(len(loader.errors), len(diag['errors']))
+
+        # the missing schema is now available
+        exp = create_loader("experiments.xsd")
+        exp.name = "experiments.xsd"
+        exp.load()
+        loader.set_finders(ns_finder={"urn:experiments": "experiments.xsd"})
+        self.assertTrue(loader.prepare())
+        self.assertNotIn("parse", loader.timings)
+        self.assertIn("compile", loader.timings)
+        self.assertTrue(loader.diagnostics()['ready'])
+
+        self.assertTrue(loader.prepare())
+        self.assertNotIn("compile", loader.timings)
+        loader.load()
+        self.assertIsNotNone(models.Schema.get_by_name("microscopy.xsd"))
+
+    def test_prepare_cache(self):
+        cache = schema.PrepareCache(2)
+        loader = create_loader("microscopy.xsd")
+        loader.prepare()
+        cache.put_loader(loader)
+
+        self.assertIsNone(cache.take(loader.digest, "goober.xsd", 
+                                     "microscopy.xsd"))
+        self.assertIs(cache.take(loader.digest, "microscopy.xsd", 
+                                 "microscopy.xsd"), loader)
+        self.assertIsNone(cache.take(loader.digest, "microscopy.xsd", 
+                                     "microscopy.xsd"))
+        self.assertFalse(cache.diagnostics(loader.digest)['ready'])
+
+        cache.put_loader(loader)
+        cache.invalidate("experiments.xsd")
+        self.assertIsNone(cache.take(loader.digest, "microscopy.xsd", 
+                                     "microscopy.xsd"))
+        self.assertIsNotNone(cache.diagnostics(loader.digest))
+
+    def test_pinned_validator(self):
+        self.test_import()
+
+        pinned = models.SchemaVersion.get_pinned(["experiments.xsd::1"])
+        self.assertEquals(pinned.keys(), ["experiments.xsd"])
+        self.assertEquals(pinned["experiments.xsd"].version, 1)
+
+        # without the flattened content, the pinned versions are used
+        sv = models.SchemaVersion.get_by_version("microscopy.xsd", 1)
+        sv.flattened = ""
+        v8r = val.Validator.from_schema(models.Schema(sv))
+        self.assertIn("experiments.xsd", v8r._pinned)
+        self.assertEquals(len(v8r.dependencies), 0)
+
+    def test_flattened_import(self):
+        self.test_import()
+
+        schema = models.Schema.get_by_name("microscopy.xsd")
+        self.assertIn('schemaLocation="schemaname:experiments.xsd"',
+                      schema.flattened)
+        self.assertEquals([p['name'] for p in schema.bundle],
+                          ["experiments.xsd"])
+
+        v8r = val.Validator.from_schema_name("microscopy.xsd", use_cache=False)
+        self.assertIn("experiments.xsd", v8r._bundle)
+        self.assertEquals(len(v8r._pinned), 0)
+        self.assertEquals(len(v8r.dependencies), 0)
         
     def test_include(self):
         schemafile = "experiments.xsd"
@@ -310,6 +566,165 @@ class TestSchemaLoaderDB(test.TestCase):
         self.assertEquals(included.location, schema.includes[0].split('::')[0])
         self.assertEquals(included.namespace, "urn:experiments")
 
+    def test_flattened_include(self):
+        self.test_include()
+
+        schema = models.Schema.get_by_name("microscopy-incl.xsd")
+        self.assertNotIn("xs:include", schema.flattened)
+        self.assertIn('name="Equipment"', schema.flattened)
+        self.assertIn('name="ElectronMicroscope"', schema.flattened)
+        self.assertEquals(schema.bundle, [])
+
+        v8r = val.Validator.from_schema_name("microscopy-incl.xsd",
+                                             use_cache=False)
+        self.assertEquals(len(v8r._bundle), 0)
+        self.assertEquals(len(v8r.dependencies), 0)
+
+    def test_resolve_dependencies(self):
+        loader = create_loader("microscopy.xsd")
+        loader.max_workers = 3
+        urls = [ "file://" + os.path.abspath(os.path.join(datadir, f))
+                 for f in "experiments.xsd goober.xsd mylab.xsd".split() ]
+        deps = loader.resolve_dependencies([ (u, None, None) for u in urls ])
+
+        # results are in the order requested
+        self.assertEquals([d.url for d in deps], urls)
+        self.assertEquals(deps[0].namespace, "urn:experiments")
+        self.assertIsNotNone(deps[0].loader)
+        self.assertIsNone(deps[1].loader)
+
+        # only the top-level loader resolves in parallel
+        self.assertEquals(deps[0].loader.max_workers, 1)
+        self.assertIsInstance(deps[1].error, schema.SchemaIngestError)
+        self.assertEquals(deps[2].namespace, "urn:mylab")
+
+        # nothing is loaded until committed
+        self.assertEquals(models.SchemaVersion.objects.count(), 0)
+        self.assertEquals(deps[0].commit(), urls[0])
+        self.assertIsNone(deps[1].commit())
+        self.assertEquals(models.SchemaVersion.objects.count(), 1)
+
+    def test_session_reuse(self):
+        loader = create_loader("microscopy.xsd")
+        url = "file://" + os.path.abspath(os.path.join(datadir,
+                                                       "experiments.xsd"))
+        deps = loader.resolve_dependencies([ (url, "a.xsd", None),
+                                             (url, "b.xsd", None) ])
+        self.assertIs(deps[0], deps[1])
+        self.assertIs(loader.resolve_dependencies([(url, None, None)])[0],
+                      deps[0])
+        self.assertEquals(loader.session.stats['fetched'], 1)
+        self.assertEquals(loader.session.stats['prepared'], 1)
+
+        # loaded once, even if committed more than once
+        name = deps[0].commit()
+        self.assertEquals(deps[1].commit(), name)
+        self.assertEquals(models.SchemaVersion.objects.count(), 1)
+
+    def test_circular_include(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            urls = {}
+            for f in "a b".split():
+                urls[f] = "file://" + os.path.join(tmpdir, f + ".xsd")
+            for f, other in (("a", "b"), ("b", "a")):
+                with open(os.path.join(tmpdir, f+".xsd"), 'w') as fd:
+                    fd.write(CIRCULAR.format(f.upper(), urls[other]))
+
+            with open(os.path.join(tmpdir, "a.xsd")) as fd:
+                loader = schema.SchemaLoader(fd.read(), "a.xsd", urls['a'])
+            self.assertFalse(loader.prepare())
+            self.assertTrue(any("Circular" in str(e) for e in loader.errors))
+
+            # the cycle is caught without preparing a.xsd a second time
+            self.assertEquals(loader.session.stats['prepared'], 1)
+            self.assertEquals(models.SchemaVersion.objects.count(), 0)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_catalog_import(self):
+        # the imported schema has not been loaded; the catalog gives a local
+        # copy of it
+        schemafile = "microscopy.xsd"
+        loader = create_loader(schemafile)
+        loader.name = schemafile
+        loader.catalog = XMLCatalog()
+        loader.catalog.add_uri("urn:experiments", "file://" +
+                      os.path.abspath(os.path.join(datadir, "experiments.xsd")))
+
+        loader.load()
+
+        schema = models.Schema.get_by_name(schemafile)
+        self.assertEquals(schema.imports, ["urn:experiments::experiments.xsd"])
+        imported = models.Schema.get_by_name("experiments.xsd")
+        self.assertIsNotNone(imported)
+        self.assertEquals(imported.namespace, "urn:experiments")
+
+        # the catalog can also point to a loaded schema by name
+        schemafile = "microscopy-incl.xsd"
+        loader = create_loader(schemafile)
+        loader.name = schemafile
+        loader.catalog = XMLCatalog()
+        loader.catalog.add_system("experiments.xsd",
+                                  SCHEMANAME_SCHEME + "experiments.xsd")
+        loader.load()
+
+        schema = models.Schema.get_by_name(schemafile)
+        self.assertEquals(schema.includes, ["experiments.xsd::experiments.xsd"])
+
+    def test_catalog_relative_include(self):
+        # a schema retrieved via the catalog resolves its relative includes
+        # against the local copy's location
+        tmpdir = tempfile.mkdtemp()
+        try:
+            for f, content in (("a", RELATIVE_A), ("b", RELATIVE_B)):
+                with open(os.path.join(tmpdir, f+".xsd"), 'w') as fd:
+                    fd.write(content)
+            loader = schema.SchemaLoader(RELATIVE_MAIN, "main.xsd", 
+                                         "main.xsd")
+            loader.catalog = XMLCatalog()
+            loader.catalog.add_mirror("http://example.com/rel", tmpdir)
+            loader.load()
+
+            imported = models.Schema.get_by_name(
+                "http://example.com/rel/a.xsd")
+            self.assertIsNotNone(imported)
+            self.assertEquals(imported.includes,
+                              ["b.xsd::http://example.com/rel/b.xsd"])
+            self.assertIsNotNone(
+                models.Schema.get_by_name("http://example.com/rel/b.xsd"))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_same_relative_include(self):
+        # the same relative location under different base URLs refers to
+        # different schemas
+        tmpdir = tempfile.mkdtemp()
+        try:
+            for d in ("x", "y"):
+                os.mkdir(os.path.join(tmpdir, d))
+                with open(os.path.join(tmpdir, d, "a.xsd"), 'w') as fd:
+                    fd.write(COMMON_A.format(d))
+                with open(os.path.join(tmpdir, d, "common.xsd"), 'w') as fd:
+                    fd.write(COMMON.format(d))
+            loader = schema.SchemaLoader(COMMON_MAIN, "main.xsd",
+                                         "main.xsd")
+            loader.catalog = XMLCatalog()
+            loader.catalog.add_mirror("http://example.com/common", tmpdir)
+            loader.load()
+
+            for d in ("x", "y"):
+                a = models.Schema.get_by_name(
+                    "http://example.com/common/{0}/a.xsd".format(d))
+                self.assertIsNotNone(a)
+                common = "http://example.com/common/{0}/common.xsd".format(d)
+                self.assertEquals(a.includes, ["common.xsd::"+common])
+                common = models.Schema.get_by_name(common)
+                self.assertIsNotNone(common)
+                self.assertIn('name="Common_{0}"'.format(d), common.content)
+        finally:
+            shutil.rmtree(tmpdir)
+
     def test_fmt_qname(self):
         schemafile = "mylab.xsd"
         loader = create_loader(schemafile)
@@ -353,14 +768,6 @@ class TestSchemaLoaderDB(test.TestCase):
         base = loader._get_super_type(ct[0])
         self.assertEquals(base, "{urn:experiments}Equipment")
 
-    def test_find_type_in_schemadoc(self):
-        loader = create_loader("experiments.xsd")
-        loader.load()
-        # pdb.set_trace()
-        ansc = loader._find_type_in_schemadoc("{urn:experiments}Equipment",
-                                              "experiments.xsd")
-        self.assertEquals(ansc, [])
-        
     def test_trace_anscestors_noparent(self):
         loader = create_loader("experiments.xsd")
 
@@ -408,6 +815,18 @@ class TestSchemaLoaderDB(test.TestCase):
         self.assertTrue("VacuumPump" in lu)
         self.assertEquals(lu["VacuumPump"], ["{urn:experiments}Equipment"])
 
+    def test_prefetch_external_types(self):
+        loader = create_loader("experiments.xsd")
+        loader.load()
+        loader = create_loader("microscopy.xsd")
+        loader.resolve_imports()
+
+        extern = loader.prefetch_external_types()
+        self.assertEquals(sorted(extern.keys()),
+                          ["{urn:experiments}Equipment",
+                           "{urn:experiments}LabSetup"])
+        self.assertEquals(extern["{urn:experiments}Equipment"], [])
+
     def test_abstract(self):
         loader = create_loader("absexp.xsd")
         loader.load()
@@ -476,6 +895,53 @@ def tearDownMongo(mc):
         pass
 
     
+CIRCULAR = """<xs:schema targetNamespace="urn:circular"
+           xmlns:xs="http://www.w3.org/2001/XMLSchema">
+  <xs:include schemaLocation="{1}"/>
+  <xs:complexType name="{0}"/>
+</xs:schema>
+"""
+
+RELATIVE_MAIN = """<xs:schema targetNamespace="urn:main"
+           xmlns:xs="http://www.w3.org/2001/XMLSchema">
+  <xs:import namespace="urn:rel"
+             schemaLocation="http://example.com/rel/a.xsd"/>
+</xs:schema>
+"""
+
+RELATIVE_A = """<xs:schema targetNamespace="urn:rel"
+           xmlns:xs="http://www.w3.org/2001/XMLSchema">
+  <xs:include schemaLocation="b.xsd"/>
+  <xs:complexType name="A"/>
+</xs:schema>
+"""
+
+RELATIVE_B = """<xs:schema targetNamespace="urn:rel"
+           xmlns:xs="http://www.w3.org/2001/XMLSchema">
+  <xs:complexType name="B"/>
+</xs:schema>
+"""
+
+COMMON_MAIN = """<xs:schema targetNamespace="urn:main"
+           xmlns:xs="http://www.w3.org/2001/XMLSchema">
+  <xs:include schemaLocation="http://example.com/common/x/a.xsd"/>
+  <xs:include schemaLocation="http://example.com/common/y/a.xsd"/>
+</xs:schema>
+"""
+
+COMMON_A = """<xs:schema targetNamespace="urn:main"
+           xmlns:xs="http://www.w3.org/2001/XMLSchema">
+  <xs:include schemaLocation="common.xsd"/>
+  <xs:complexType name="A_{0}"/>
+</xs:schema>
+"""
+
+COMMON = """<xs:schema targetNamespace="urn:main"
+           xmlns:xs="http://www.w3.org/2001/XMLSchema">
+  <xs:complexType name="Common_{0}"/>
+</xs:schema>
+"""
+
 def create_loader(schemafile, name=None):
     with open(os.path.join(datadir, schemafile)) as fd:
         content = fd.read()
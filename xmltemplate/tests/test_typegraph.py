@@ -0,0 +1,109 @@
+import unittest as test
+import os, pdb
+
+from xmltemplate import validate as val
+from xmltemplate.typegraph import TypeGraph, MISSING, split_qname
+
+NS = "urn:experiments"
+XS = "{" + val.XSD_NS + "}"
+
+def q(name):
+    return "{" + NS + "}" + name
+
+class TestTypeGraph(test.TestCase):
+
+    def test_split_qname(self):
+        self.assertEquals(list(split_qname(q("Lab"))), [NS, "Lab"])
+        self.assertEquals(list(split_qname("ex:Lab")), ["ex", "Lab"])
+        self.assertEquals(list(split_qname("Lab")), ["", "Lab"])
+
+    def test_noparent(self):
+        graph = TypeGraph(NS)
+        graph.add("LabSetup")
+        self.assertIn("LabSetup", graph)
+        self.assertEquals(graph.ancestors("LabSetup"), [])
+
+    def test_builtin(self):
+        graph = TypeGraph(NS)
+        graph.add("Code", XS+"string")
+        self.assertEquals(graph.ancestors("Code"), [XS+"string"])
+
+    def test_local_chain(self):
+        graph = TypeGraph(NS)
+        # declared before their base types
+        graph.add("C", q("B"))
+        graph.add("B", q("A"))
+        graph.add("A", XS+"string")
+        graph.add("D", q("B"))
+
+        out = graph.trace_all()
+        self.assertEquals(out.keys(), ["C", "B", "A", "D"])
+        self.assertEquals(out["C"], [q("B"), q("A"), XS+"string"])
+        self.assertEquals(out["B"], [q("A"), XS+"string"])
+        self.assertEquals(out["A"], [XS+"string"])
+        self.assertEquals(out["D"], [q("B"), q("A"), XS+"string"])
+
+    def test_missing(self):
+        graph = TypeGraph(NS)
+        graph.add("B", q("A"))
+        graph.add("C", q("B"))
+        self.assertEquals(graph.ancestors("C"), [q("B"), q("A"), MISSING])
+
+    def test_external(self):
+        looked = []
+        def external(qname):
+            looked.append(qname)
+            if qname == "{urn:other}Base":
+                return ["{urn:other}Root"]
+            return None
+
+        graph = TypeGraph(NS, external)
+        graph.add("A", "{urn:other}Base")
+        graph.add("B", q("A"))
+        graph.add("C", q("A"))
+        out = graph.trace_all()
+        self.assertEquals(out["B"],
+                          [q("A"), "{urn:other}Base", "{urn:other}Root"])
+        self.assertEquals(out["C"], out["B"])
+        self.assertEquals(looked, ["{urn:other}Base"])
+
+    def test_duplicate(self):
+        graph = TypeGraph(NS)
+        graph.add("A")
+        with self.assertRaises(val.SchemaValidationError):
+            graph.add("A", XS+"string")
+
+    def test_circular(self):
+        graph = TypeGraph(NS)
+        graph.add("A", q("C"))
+        graph.add("B", q("A"))
+        graph.add("C", q("B"))
+        graph.add("D", q("C"))
+        with self.assertRaises(val.SchemaValidationError):
+            graph.ancestors("D")
+
+        graph = TypeGraph(NS)
+        graph.add("A", q("A"))
+        with self.assertRaises(val.SchemaValidationError):
+            graph.trace_all()
+
+    def test_deep(self):
+        # deep enough to overflow a recursive implementation
+        depth = 5000
+        graph = TypeGraph(NS)
+        for i in xrange(depth, 0, -1):
+            graph.add("T%d" % i, q("T%d" % (i-1)))
+        graph.add("T0")
+        self.assertEquals(len(graph.ancestors("T%d" % depth)), depth)
+        self.assertEquals(graph.ancestors("T1"), [q("T0")])
+
+
+TESTS = "TestTypeGraph".split()
+
+def test_suite():
+    suite = test.TestSuite()
+    suite.addTests([test.makeSuite(TestTypeGraph)])
+    return suite
+
+if __name__ == '__main__':
+    test.main()
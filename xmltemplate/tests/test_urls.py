@@ -1,8 +1,10 @@
 # import mgi.settings as settings
 # from django import test
 import unittest as test
-import os, pdb, json
+import os, pdb, json, gzip, tempfile
+from cStringIO import StringIO
 from django.test import Client
+from django.test.utils import override_settings
 from mongoengine import connect
 
 if 'DJANGO_SETTINGS_MODULE' not in os.environ:
@@ -286,6 +288,30 @@ class TestSchemaDoc(test.TestCase):
         self.assertEqual(rdata['version'], 2)
         self.assertFalse(rdata['is_current'])
 
+    def test_put_gzip(self):
+        client = Client()
+        content = self.get_file_content("mylab.xsd")
+        buf = StringIO()
+        with gzip.GzipFile(fileobj=buf, mode='wb') as fd:
+            fd.write(content)
+
+        res = client.put('/schemas/mylab?location=mylab.xsd',
+                         content_type='application/xml', data=buf.getvalue(),
+                         HTTP_CONTENT_ENCODING='gzip')
+        rdata = json.loads(res.content)
+        self.assertTrue(rdata['ok'])
+        self.assertEqual(rdata['version'], 1)
+        self.assertEqual(models.Schema.get_by_name('mylab').content, content)
+
+    def test_put_too_large(self):
+        client = Client()
+        content = self.get_file_content("mylab.xsd")
+        with override_settings(SCHEMA_MAX_UPLOAD_SIZE=len(content)-1):
+            res = client.put('/schemas/mylab', content_type='application/xml',
+                             data=content)
+        self.assertEqual(res.status_code, 413)
+        self.assertIsNone(models.Schema.get_by_name('mylab'))
+
     def test_patch(self):
         client = Client()
         filename = "mylab.xsd"
@@ -310,6 +336,26 @@ class TestSchemaDoc(test.TestCase):
         self.assertTrue(rdata['ok'])
         self.assertEqual(rdata['description'], '4Rlab')
 
+    def test_diagnostics(self):
+        client = Client()
+        content = self.get_file_content("microscopy.xsd")
+        res = client.put('/schemas/mic?location=microscopy.xsd',
+                         content_type='application/xml', data=content)
+        self.assertEqual(res.status_code, 400)
+        rdata = json.loads(res.content)
+
+        res = client.get('/diagnostics/' + rdata['digest'])
+        self.assertEqual(res.status_code, 200)
+        diag = json.loads(res.content)
+        self.assertTrue(diag['ok'])
+        self.assertFalse(diag['ready'])
+        self.assertEqual(diag['name'], 'mic')
+        self.assertEqual(diag['errors'], rdata['errors'])
+        self.assertEqual(diag['unresolved'][0]['namespace'], "urn:experiments")
+
+        res = client.get('/diagnostics/goober')
+        self.assertEqual(res.status_code, 404)
+
     def test_badmethod(self):
         client = Client()
         filename = "mylab.xsd"
@@ -577,6 +623,118 @@ class TestSchemaComponents(test.TestCase):
         res = client.get('/schemas/mylab/2/elements')
         self.assertEqual(res.status_code, 404)
 
+    def test_resolve_qname(self):
+        client = Client()
+        filename = "mylab.xsd"
+        content = self.get_file_content(filename)
+
+        data = json.dumps({'location': filename, 
+                           'about': "4R lab", 'content': content})
+        res = client.put('/schemas/mylab', content_type='application/json',
+                         data=data)
+        rdata = json.loads(res.content)
+        self.assertTrue(rdata['ok'])
+
+        res = client.get('/qnames?ns=urn:mylab&name=MyLab')
+        self.assertEqual(res.status_code, 200)
+        rdata = json.loads(res.content)
+        self.assertEqual(rdata['qname'], "{urn:mylab}MyLab")
+        self.assertEqual(rdata['elements'], [{'schema': 'mylab',
+                                              'version': 1}])
+
+        res = client.get('/qnames?ns=urn:mylab&name=Goober')
+        self.assertEqual(res.status_code, 404)
+
+        res = client.get('/qnames?ns=urn:mylab')
+        self.assertEqual(res.status_code, 400)
+
+class TestInstanceValidation(test.TestCase):
+
+    valid = '<MyLab xmlns="urn:mylab"><title>4R</title><type>em</type></MyLab>'
+    invalid = '<MyLab xmlns="urn:mylab"><title>4R</title></MyLab>'
+
+    def setUp(self):
+        self.mc = setUpMongo()
+        filepath = os.path.join(datadir, "mylab.xsd")
+        with open(filepath) as fd:
+            api.loadSchemaDoc(fd.read(), "mylab", "mylab.xsd")
+
+    def tearDown(self):
+        tearDownMongo(self.mc)
+        self.mc.close()
+        self.mc = None
+
+    def test_validate(self):
+        client = Client()
+        res = client.post('/schemas/mylab/validate',
+                          content_type='application/xml', data=self.valid)
+        self.assertEqual(res.status_code, 200)
+        rdata = json.loads(res.content)
+        self.assertTrue(rdata['ok'])
+        self.assertTrue(rdata['valid'])
+        self.assertEqual(rdata['errors'], [])
+        self.assertEqual(rdata['version'], 1)
+
+        res = client.post('/schemas/mylab/1/validate',
+                          content_type='application/xml', data=self.invalid)
+        self.assertEqual(res.status_code, 200)
+        rdata = json.loads(res.content)
+        self.assertTrue(rdata['ok'])
+        self.assertFalse(rdata['valid'])
+        self.assertEqual(len(rdata['errors']), 1)
+
+    def test_not_xml(self):
+        client = Client()
+        res = client.post('/schemas/mylab/validate',
+                          content_type='application/xml', data="not XML")
+        self.assertEqual(res.status_code, 200)
+        rdata = json.loads(res.content)
+        self.assertFalse(rdata['valid'])
+        self.assertEqual(len(rdata['errors']), 1)
+
+    def test_path_body(self):
+        # a body that looks like a path is not read from the server's disk
+        filepath = os.path.join(datadir, "mylab.xsd")
+        client = Client()
+        for query in ('', '?max_errors=1'):
+            res = client.post('/schemas/mylab/validate'+query,
+                              content_type='application/xml', data=filepath)
+            self.assertEqual(res.status_code, 200)
+            rdata = json.loads(res.content)
+            self.assertFalse(rdata['valid'])
+            self.assertNotIn("urn:mylab", res.content)
+
+    def test_external_entity(self):
+        # an instance cannot pull a file from the server's disk into the 
+        # document (and so into the error messages)
+        fd, secret = tempfile.mkstemp(suffix=".txt")
+        try:
+            os.write(fd, "TOPSECRET")
+            os.close(fd)
+            doc = '<!DOCTYPE MyLab [<!ENTITY x SYSTEM "file://{0}">]>' \
+                  '<MyLab xmlns="urn:mylab"><title>&x;</title>' \
+                  '<type>em</type></MyLab>'.format(secret)
+            client = Client()
+            for query in ('', '?max_errors=1'):
+                res = client.post('/schemas/mylab/validate'+query,
+                                  content_type='application/xml', data=doc)
+                self.assertEqual(res.status_code, 200)
+                rdata = json.loads(res.content)
+                self.assertFalse(rdata['valid'])
+                self.assertEqual(len(rdata['errors']), 1)
+                self.assertNotIn("TOPSECRET", res.content)
+        finally:
+            os.remove(secret)
+
+    def test_notfound(self):
+        client = Client()
+        res = client.post('/schemas/goober/validate',
+                          content_type='application/xml', data=self.valid)
+        self.assertEqual(res.status_code, 404)
+        res = client.post('/schemas/mylab/2/validate',
+                          content_type='application/xml', data=self.valid)
+        self.assertEqual(res.status_code, 404)
+
 def setUpMongo():
     return connect(host=os.environ['MONGO_TESTDB_URL'])
 
@@ -1,6 +1,8 @@
 import unittest as test
-import os, pdb
+import os, pdb, mmap, tempfile, shutil, threading
+from cStringIO import StringIO
 from mongoengine import connect
+from lxml import etree
 
 from xmltemplate import validate as val
 
@@ -18,6 +20,14 @@ def tearDownMongo(mc):
     except Exception, ex:
         pass
 
+LAB_VALID = """<Lab xmlns="urn:experiments">
+  <equipment><vendor>FEI</vendor><model>Titan</model></equipment>
+</Lab>"""
+
+LAB_INVALID = """<Lab xmlns="urn:experiments">
+  <equipment><vendor>FEI</vendor></equipment>
+</Lab>"""
+
 def getContent(datafile, dir=datadir):
     filepath = os.path.join(dir, datafile)
     with open(filepath) as fd:
@@ -54,7 +64,558 @@ class TestValidatorNoDB(test.TestCase):
 
         v8r = val.lxmlValidator(content)
         
-        
+class TestInstanceValidation(test.TestCase):
+
+    def setUp(self):
+        self.v8r = val.lxmlValidator(getContent("experiments.xsd"))
+
+    def test_check(self):
+        res = self.v8r.check(LAB_VALID)
+        self.assertTrue(res)
+        self.assertEquals(res.errors, [])
+
+        res = self.v8r.check(LAB_INVALID)
+        self.assertFalse(res)
+        self.assertEquals(len(res.errors), 1)
+
+        res = self.v8r.check("<Lab>")
+        self.assertFalse(res)
+        self.assertEquals(len(res.errors), 1)
+
+    def test_options(self):
+        # two missing model elements
+        doc = '<Lab xmlns="urn:experiments">' + \
+              '<equipment><vendor>FEI</vendor></equipment>' * 2 + '</Lab>'
+        res = self.v8r.check(doc)
+        self.assertFalse(res)
+        self.assertEquals(len(res.errors), 2)
+        self.assertEquals(res.errors[0].line, 1)
+        self.assertIsNotNone(res.errors[0].path)
+        self.assertIn("model", res.errors[0].to_dict()['message'])
+
+        res = self.v8r.check(doc, options=val.ValidationOptions.capped(1))
+        self.assertEquals(len(res.errors), 1)
+        res = self.v8r.check(doc, options=val.STOP_AT_FIRST)
+        self.assertFalse(res)
+        self.assertEquals(len(res.errors), 1)
+        res = self.v8r.check(memoryview(doc), options=val.STOP_AT_FIRST)
+        self.assertEquals(len(res.errors), 1)
+        self.assertTrue(self.v8r.check(LAB_VALID, options=val.STOP_AT_FIRST))
+
+        with self.assertRaises(ValueError):
+            val.ValidationOptions(0)
+
+    def test_error_locations(self):
+        # the second equipment element is missing its model
+        doc = '<Lab xmlns="urn:experiments">\n' + \
+              '<equipment><vendor>FEI</vendor><model>Titan</model>' + \
+              '</equipment>\n' + \
+              '<equipment><vendor>FEI</vendor>\n</equipment>\n</Lab>'
+        expected = self.v8r.check(doc).errors
+        self.assertEquals(len(expected), 1)
+        self.assertEquals(expected[0].line, 3)
+        self.assertEquals(expected[0].path, "/*/*[2]")
+
+        # a stream that cannot be rewound is only read once
+        class Unseekable(object):
+            def __init__(self, content):
+                self._fd = StringIO(content)
+            def read(self, size):
+                return self._fd.read(size)
+
+        for res in (self.v8r.check(doc, options=val.STOP_AT_FIRST),
+                    self.v8r.check(StringIO(doc), streaming=True),
+                    self.v8r.check(Unseekable(doc), streaming=True)):
+            self.assertFalse(res)
+            self.assertEquals(len(res.errors), 1)
+            self.assertEquals(res.errors[0].message, expected[0].message)
+            self.assertEquals(res.errors[0].line, 3)
+            self.assertEquals(res.errors[0].path, "/*/*[2]")
+
+        # a document that is not well-formed
+        res = self.v8r.check(StringIO('<Lab xmlns="urn:experiments">\n'
+                                      '<equipment>\n</Lab>'), streaming=True)
+        self.assertFalse(res)
+        self.assertEquals(res.errors[0].line, 3)
+
+    def test_nonascii_errors(self):
+        # libxml2 quotes the offending (non-ASCII) element name
+        doc = u'<Lab xmlns="urn:experiments"><\xe9quipement/></Lab>'
+        res = self.v8r.check(doc)
+        self.assertFalse(res)
+        self.assertEquals(len(res.errors), 1)
+        self.assertIn(u"\xe9quipement", res.errors[0].message)
+        self.assertIn(u"\xe9quipement", unicode(res.errors[0]))
+        self.assertIn("\xc3\xa9quipement", str(res.errors[0]))
+
+        res = self.v8r.check_stream(StringIO(doc.encode('utf-8')))
+        self.assertFalse(res)
+        self.assertIn(u"\xe9quipement", res.errors[0].message)
+
+    def test_check_stream(self):
+        res = self.v8r.check(StringIO(LAB_VALID), streaming=True)
+        self.assertTrue(res)
+
+        res = self.v8r.check_stream(StringIO(LAB_INVALID))
+        self.assertFalse(res)
+        self.assertEquals(len(res.errors), 1)
+
+        res = self.v8r.check_stream(StringIO("<Lab>"))
+        self.assertFalse(res)
+
+        self.assertTrue(self.v8r.validate(StringIO(LAB_VALID), streaming=True))
+        self.assertFalse(self.v8r.validate_stream(StringIO(LAB_INVALID)))
+
+    def test_check_stream_large(self):
+        # many repeated children; the elements are discarded as they are read
+        doc = '<Lab xmlns="urn:experiments">' + \
+              '<equipment><vendor>FEI</vendor><model>Titan</model></equipment>'\
+              * 10000 + '</Lab>'
+        self.assertTrue(self.v8r.check_stream(StringIO(doc)))
+
+    def test_input_forms(self):
+        declared = '<?xml version="1.0" encoding="UTF-8"?>\n' + LAB_VALID
+        self.assertTrue(self.v8r.validate(LAB_VALID))
+        self.assertTrue(self.v8r.validate(unicode(LAB_VALID)))
+        self.assertTrue(self.v8r.validate(unicode(declared)))
+        self.assertTrue(self.v8r.validate(memoryview(LAB_VALID)))
+        self.assertTrue(self.v8r.validate(bytearray(LAB_VALID)))
+        self.assertTrue(self.v8r.validate(StringIO(LAB_VALID)))
+        self.assertFalse(self.v8r.validate(memoryview(LAB_INVALID)))
+
+        schemafile = os.path.join(datadir, "experiments.xsd")
+        tree = val.Validator.parse(schemafile, is_file=True)
+        self.assertEquals(tree.getroot().tag, XSDPRE+"schema")
+        fd, instfile = tempfile.mkstemp(suffix=".xml")
+        try:
+            os.write(fd, LAB_VALID)
+            os.close(fd)
+            self.assertTrue(self.v8r.check(instfile, is_file=True))
+            self.assertTrue(self.v8r.check(instfile, is_file=True,
+                                           streaming=True))
+        finally:
+            os.remove(instfile)
+
+        # a str is never taken to be a file path unless it is said to be
+        with self.assertRaises(val.ValidationError):
+            val.Validator.parse(schemafile)
+        self.assertFalse(self.v8r.check(schemafile))
+        self.assertFalse(self.v8r.check(schemafile, options=val.STOP_AT_FIRST))
+        with open(schemafile, 'rb') as fd:
+            mm = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                tree = val.Validator.parse(mm)
+            finally:
+                mm.close()
+        self.assertEquals(tree.getroot().tag, XSDPRE+"schema")
+
+        with self.assertRaises(val.ValidationError):
+            val.Validator.parse(memoryview("<Lab>"))
+        with self.assertRaises(TypeError):
+            val.Validator.parse(42)
+
+    def test_external_entity(self):
+        # an instance may not pull in the contents of a local file
+        fd, secret = tempfile.mkstemp(suffix=".txt")
+        try:
+            os.write(fd, "TOPSECRET")
+            os.close(fd)
+            doc = '<!DOCTYPE Lab [<!ENTITY x SYSTEM "file://{0}">]>\n' \
+                  '<Lab xmlns="urn:experiments"><equipment>' \
+                  '<vendor>&x;</vendor><model>Titan</model>' \
+                  '</equipment></Lab>'.format(secret)
+
+            for res in (self.v8r.check(doc),
+                        self.v8r.check(doc, streaming=True),
+                        self.v8r.check(doc, options=val.STOP_AT_FIRST)):
+                self.assertFalse(res)
+                self.assertNotIn("TOPSECRET", str(res.errors))
+                self.assertEquals(res.errors[0].line, 2)
+            try:
+                self.assertFalse(self.v8r.validate(doc))
+            except etree.XMLSyntaxError, ex:
+                # the external entity is not declared
+                self.assertNotIn("TOPSECRET", str(ex))
+        finally:
+            os.remove(secret)
+
+    def test_unreadable(self):
+        # a path is only read when it is said to be one
+        secret = os.path.join(datadir, "experiments.xsd")
+        for opts in (None, val.STOP_AT_FIRST):
+            res = self.v8r.check(secret, options=opts)
+            self.assertFalse(res)
+            self.assertNotIn("targetNamespace", str(res.errors))
+
+            res = self.v8r.check("not XML at all", options=opts)
+            self.assertFalse(res)
+            self.assertEquals(len(res.errors), 1)
+
+            res = self.v8r.check("/no/such/file.xml", options=opts,
+                                 is_file=True)
+            self.assertFalse(res)
+            self.assertIn("Unable to read", res.errors[0].message)
+
+    def test_unicode_encoding_decl(self):
+        # the declared encoding no longer applies to decoded text
+        doc = u'<?xml version="1.0" encoding="ISO-8859-1"?>\n' + \
+              u'<Lab xmlns="urn:experiments"><equipment>' + \
+              u'<vendor>Caf\xe9</vendor><model>Titan</model></equipment></Lab>'
+        tree = val.Validator.parse(doc)
+        vendor = tree.getroot()[0][0]
+        self.assertEquals(vendor.text, u"Caf\xe9")
+        self.assertEquals(vendor.sourceline, 2)
+        self.assertTrue(self.v8r.validate(doc))
+
+    def test_validate_many(self):
+        docs = [LAB_VALID, LAB_INVALID, LAB_VALID, "<Lab>"] * 5
+
+        batch = self.v8r.validate_many(docs, workers=3)
+        self.assertEquals(len(batch), len(docs))
+        self.assertEquals([r.valid for r in batch],
+                          [True, False, True, False] * 5)
+        self.assertEquals(batch.valid_count, 10)
+        self.assertEquals(batch.workers, 3)
+        self.assertGreater(batch.throughput, 0)
+
+        batch = self.v8r.validate_many(iter(docs), workers=1)
+        self.assertEquals([r.valid for r in batch],
+                          [True, False, True, False] * 5)
+
+        # copies of the compiled schema are kept for later batches and 
+        # counted in the footprint
+        self.assertLessEqual(self.v8r.copies, 3)
+        self.v8r.validate_many(docs, workers=3)
+        self.assertLessEqual(self.v8r.copies, 3)
+        self.assertEquals(self.v8r.footprint,
+                          self.v8r.copies * self.v8r._copy_footprint)
+
+    def test_shared_across_threads(self):
+        # a validator compiled (i.e. warmed) in one thread is used as is by
+        # the others
+        built = []
+        warmer = threading.Thread(target=lambda: built.append(
+            val.lxmlValidator(getContent("experiments.xsd"))))
+        warmer.start()
+        warmer.join()
+        v8r = built[0]
+
+        def fail():
+            raise AssertionError("schema recompiled")
+        v8r._compile = fail
+
+        results = []
+        def validate():
+            results.append(v8r.check(LAB_VALID).valid)
+            results.append(v8r.check(LAB_INVALID).valid)
+            results.append(v8r.validate(LAB_VALID))
+            results.append(v8r.check(StringIO(LAB_INVALID),
+                                     streaming=True).valid)
+        thread = threading.Thread(target=validate)
+        thread.start()
+        thread.join()
+        self.assertEquals(results, [True, False, True, False])
+
+class TestLRUCache(test.TestCase):
+
+    def test_get_put(self):
+        cache = val.LRUCache(3)
+        self.assertIsNone(cache.get("a"))
+        self.assertEquals(cache.misses, 1)
+
+        cache.put("a", 1)
+        self.assertEquals(cache.get("a"), 1)
+        self.assertEquals(cache.hits, 1)
+        self.assertIn("a", cache)
+        self.assertEquals(len(cache), 1)
+
+        cache.discard("a")
+        self.assertNotIn("a", cache)
+        self.assertEquals(cache.size, 0)
+
+    def test_evict(self):
+        cache = val.LRUCache(10)
+        cache.put("a", 1, 4)
+        cache.put("b", 2, 4)
+        cache.get("a")
+        cache.put("c", 3, 4)
+        self.assertEquals(cache.keys(), ["a", "c"])
+        self.assertEquals(cache.evictions, 1)
+        self.assertEquals(cache.size, 8)
+
+        # too big to cache at all
+        cache.put("d", 4, 11)
+        self.assertNotIn("d", cache)
+        self.assertEquals(cache.keys(), ["a", "c"])
+
+        stats = cache.stats()
+        self.assertEquals(stats['items'], 2)
+        self.assertEquals(stats['evictions'], 1)
+
+class _FakeSchema(object):
+    def __init__(self, name, content, includes=(), imports=(), doctored=""):
+        self.name = name
+        self.version = 1
+        self.content = content
+        self.includes = list(includes)
+        self.imports = list(imports)
+        self.doctored = doctored
+
+class _PinningResolver(object):
+    def __init__(self, schema):
+        self.pinned = { schema.name: schema }
+        self.incls = {}
+        self.imps = {}
+
+FORMS_INCLUDED = """<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema"
+           targetNamespace="urn:forms" elementFormDefault="qualified">
+  <xs:complexType name="Box" xmlns:f="urn:forms">
+    <xs:sequence>
+      <xs:element name="size" type="f:Size"/>
+    </xs:sequence>
+  </xs:complexType>
+  <xs:simpleType name="Size">
+    <xs:restriction base="xs:int"/>
+  </xs:simpleType>
+</xs:schema>
+"""
+
+FORMS_INCLUDING = """<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema"
+           xmlns:fm="urn:forms" targetNamespace="urn:forms"%s>
+  <xs:include schemaLocation="box.xsd"/>
+  <xs:element name="box" type="fm:Box"/>
+</xs:schema>
+"""
+
+FORMS_INSTANCE = '<box xmlns="urn:forms"><size>3</size></box>'
+
+class TestSchemaFlattener(test.TestCase):
+
+    def flatten(self, including):
+        incl = _FakeSchema("box", FORMS_INCLUDED)
+        sch = _FakeSchema("forms", including, includes=["box.xsd::box"])
+        flattener = val.SchemaFlattener({"box": incl})
+        flat = flattener.flatten(sch)
+        return flat, flattener.bundle
+
+    def original(self, including):
+        # compile the schema as written, resolving the include from disk
+        tmpdir = tempfile.mkdtemp()
+        try:
+            with open(os.path.join(tmpdir, "box.xsd"), 'w') as fd:
+                fd.write(FORMS_INCLUDED)
+            path = os.path.join(tmpdir, "forms.xsd")
+            with open(path, 'w') as fd:
+                fd.write(including)
+            return etree.XMLSchema(etree.parse(path))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_inline(self):
+        # same defaults:  the include is inlined, with the prefix declared
+        # on the definition itself
+        including = FORMS_INCLUDING % ' elementFormDefault="qualified"'
+        flat, bundle = self.flatten(including)
+        self.assertNotIn("xs:include", flat)
+        self.assertEquals(len(bundle), 0)
+
+        inst = etree.fromstring(FORMS_INSTANCE)
+        self.assertTrue(self.original(including).validate(inst))
+        self.assertTrue(val.lxmlValidator(flat, bundle=bundle)
+                           .validate(FORMS_INSTANCE))
+
+    def test_mismatched_form_default(self):
+        including = FORMS_INCLUDING % ''
+        flat, bundle = self.flatten(including)
+        self.assertIn('schemaLocation="schemaname:box"', flat)
+        self.assertEquals(bundle.keys(), ["box"])
+
+        inst = etree.fromstring(FORMS_INSTANCE)
+        self.assertTrue(self.original(including).validate(inst))
+        self.assertTrue(val.lxmlValidator(flat, bundle=bundle)
+                           .validate(FORMS_INSTANCE))
+
+class TestSchemaProvider(test.TestCase):
+
+    def test_get_cached(self):
+        content = getContent("microscopy.xsd")
+        sch = _FakeSchema("micro", content,
+                          imports=["urn:experiments::experiments.xsd"])
+        resolver = _PinningResolver(sch)
+
+        val.doctored_cache.clear()
+        hits = val.doctored_cache.hits
+        doctored = val.SchemaProvider.get("schemaname:micro", resolver)
+        self.assertIn('schemaLocation="schemaname:experiments.xsd"', doctored)
+        self.assertEquals(len(val.doctored_cache), 1)
+
+        again = val.SchemaProvider.get("schemaname:micro", resolver)
+        self.assertIs(again, doctored)
+        self.assertEquals(val.doctored_cache.hits, hits + 1)
+
+    def test_get_persisted(self):
+        sch = _FakeSchema("micro", "<schema/>", doctored="<doctored/>",
+                          imports=["urn:experiments::experiments.xsd"])
+        out = val.SchemaProvider.get("schemaname:micro", _PinningResolver(sch))
+        self.assertEquals(out, "<doctored/>")
+
+UNITS_INCLUDED = """<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema">
+  <xs:simpleType name="Units">
+    <xs:restriction base="xs:string">
+      <xs:enumeration value="nm"/>
+      <xs:enumeration value="um"/>
+    </xs:restriction>
+  </xs:simpleType>
+</xs:schema>
+"""
+
+UNITS_IMPORTED = """<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema"
+           xmlns:u="urn:%(ns)s" targetNamespace="urn:%(ns)s">
+  <xs:include schemaLocation="units.xsd"/>
+  <xs:element name="%(ns)s" type="u:Units"/>
+</xs:schema>
+"""
+
+UNITS_IMPORTING = """<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema"
+           xmlns:a="urn:a" xmlns:b="urn:b" targetNamespace="urn:lab"
+           elementFormDefault="qualified">
+  <xs:import namespace="urn:a" schemaLocation="a.xsd"/>
+  <xs:import namespace="urn:b" schemaLocation="b.xsd"/>
+  <xs:element name="lab">
+    <xs:complexType>
+      <xs:sequence>
+        <xs:element ref="a:a"/>
+        <xs:element ref="b:b"/>
+      </xs:sequence>
+    </xs:complexType>
+  </xs:element>
+</xs:schema>
+"""
+
+UNITS_INSTANCE = """<lab xmlns="urn:lab" xmlns:a="urn:a" xmlns:b="urn:b">
+  <a:a>nm</a:a><b:b>um</b:b>
+</lab>"""
+
+SIZE_INCLUDED = """<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema"
+           targetNamespace="urn:forms">
+  <xs:simpleType name="Size">
+    <xs:restriction base="xs:int"/>
+  </xs:simpleType>
+</xs:schema>
+"""
+
+BOX_INCLUDED = """<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema"
+           xmlns:f="urn:forms" targetNamespace="urn:forms">
+  <xs:include schemaLocation="size.xsd"/>
+  <xs:complexType name="Box">
+    <xs:sequence>
+      <xs:element name="size" type="f:Size"/>
+    </xs:sequence>
+  </xs:complexType>
+</xs:schema>
+"""
+
+BOX_INCLUDING = """<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema"
+           xmlns:f="urn:forms" targetNamespace="urn:forms"
+           elementFormDefault="qualified">
+  <xs:include schemaLocation="box.xsd"/>
+  <xs:include schemaLocation="size.xsd"/>
+  <xs:element name="box" type="f:Box"/>
+  <xs:element name="size" type="f:Size"/>
+</xs:schema>
+"""
+
+class TestSchemaFlattenerSharing(test.TestCase):
+
+    def test_imports_share_include(self):
+        # two imported schemas include the same file; each must get it
+        units = _FakeSchema("units", UNITS_INCLUDED)
+        pinned = { "units": units }
+        for ns in "a b".split():
+            pinned[ns] = _FakeSchema(ns, UNITS_IMPORTED % {"ns": ns},
+                                     includes=["units.xsd::units"])
+        sch = _FakeSchema("lab", UNITS_IMPORTING,
+                          imports=["urn:a::a", "urn:b::b"])
+        flattener = val.SchemaFlattener(pinned)
+        flat = flattener.flatten(sch)
+        bundle = flattener.bundle
+        self.assertIn('schemaLocation="schemaname:units"', bundle["a"])
+        self.assertIn('schemaLocation="schemaname:units"', bundle["b"])
+
+        v8r = val.lxmlValidator(flat, bundle=bundle)
+        self.assertTrue(v8r.validate(UNITS_INSTANCE))
+        self.assertFalse(v8r.check(UNITS_INSTANCE.replace("um", "km")).valid)
+
+    def test_bundled_include_shares_include(self):
+        # box.xsd has different defaults and so is bundled as a document 
+        # of its own with size.xsd inlined; size.xsd must then not be 
+        # defined a second time
+        pinned = { "box": _FakeSchema("box", BOX_INCLUDED,
+                                      includes=["size.xsd::size"]),
+                   "size": _FakeSchema("size", SIZE_INCLUDED) }
+        sch = _FakeSchema("forms", BOX_INCLUDING,
+                          includes=["box.xsd::box", "size.xsd::size"])
+        flattener = val.SchemaFlattener(pinned)
+        flat = flattener.flatten(sch)
+        self.assertIn('schemaLocation="schemaname:box"', flat)
+        self.assertNotIn('schemaLocation="schemaname:size"', flat)
+        self.assertNotIn('xs:include', flattener.bundle["box"])
+        self.assertIn('name="Size"', flattener.bundle["box"])
+        self.assertEquals(flattener.bundle.keys(), ["box"])
+
+        v8r = val.lxmlValidator(flat, bundle=flattener.bundle)
+        self.assertTrue(v8r.validate(
+            '<size xmlns="urn:forms">3</size>'))
+
+class _FakeValidator(object):
+    def __init__(self, deps=(), footprint=1):
+        self.dependencies = frozenset(deps)
+        self.footprint = footprint
+
+class TestValidatorCache(test.TestCase):
+
+    def test_get_validator(self):
+        cache = val.ValidatorCache(100)
+        built = []
+        def build():
+            built.append(_FakeValidator(footprint=10))
+            return built[-1]
+
+        v1 = cache.get_validator(("goob", 1, "xxx"), build)
+        v2 = cache.get_validator(("goob", 1, "xxx"), build)
+        self.assertIs(v1, v2)
+        self.assertEquals(len(built), 1)
+        self.assertEquals(cache.size, 10)
+        self.assertEquals(cache.hits, 1)
+        self.assertEquals(cache.misses, 1)
+
+    def test_footprint_grows(self):
+        cache = val.ValidatorCache(100)
+        v8r = _FakeValidator(footprint=10)
+        cache.get_validator(("goob", 1, "xxx"), lambda: v8r)
+        v8r.footprint = 30
+        self.assertIs(cache.get_validator(("goob", 1, "xxx"), None), v8r)
+        self.assertEquals(cache.size, 30)
+
+    def test_invalidate(self):
+        cache = val.ValidatorCache(100)
+        cache.put(("goob", 1, "xxx"), _FakeValidator())
+        cache.put(("gurn", 1, "yyy"), _FakeValidator(["goob"]))
+        cache.put(("foo", 2, "zzz"), _FakeValidator(["bar"]))
+
+        cache.invalidate("goob")
+        self.assertEquals(cache.keys(), [("foo", 2, "zzz")])
+
+    def test_invalidate_explicit(self):
+        cache = val.ValidatorCache(100)
+        cache.put(("goob", 1, "xxx", True), _FakeValidator())
+        cache.put(("goob", 2, "www", False), _FakeValidator())
+        cache.put(("gurn", 1, "yyy", True), _FakeValidator(["goob"]))
+        cache.put(("gurn", 2, "vvv", True), _FakeValidator())
+
+        cache.invalidate("goob")
+        self.assertEquals(sorted(cache.keys()), 
+                          [("goob", 1, "xxx", True), ("gurn", 2, "vvv", True)])
         
 
 
@@ -0,0 +1,127 @@
+import unittest as test
+import os, pdb, threading, time
+from mongoengine import connect
+
+from xmltemplate import models
+from xmltemplate import schema
+from xmltemplate import validate as val
+from xmltemplate import warmup
+
+datadir = os.path.join(os.path.dirname(__file__), "data")
+
+def setUpMongo():
+    return connect(host=os.environ['MONGO_TESTDB_URL'])
+
+def tearDownMongo(mc):
+    try:
+        db = mc.get_default_database()
+        mc.drop_database(db.name)
+    except Exception, ex:
+        pass
+
+class Unbuildable(object):
+    # a validator class whose validators can never be compiled
+    @classmethod
+    def from_schema_name(cls, name):
+        raise val.ValidationError("Unable to build validator for "+name)
+
+class TestWarmerFailures(test.TestCase):
+
+    def test_schedule_no_lookup(self):
+        # scheduling must not touch the database
+        warmer = warmup.ValidatorWarmer(Unbuildable)
+        warmer.schedule("goober")
+        self.assertEquals(warmer.queued, 1)
+        self.assertEquals(warmer._queue.get(), ("goober", True))
+
+    def test_failed_warm_up(self):
+        outage = threading.Event()
+        outage.set()
+        class Broken(warmup.ValidatorWarmer):
+            def warm_all(self):
+                if outage.is_set():
+                    raise RuntimeError("database unavailable")
+
+        warmer = Broken()
+        warmer.retry_delay = 0.01
+        warmer.started = time.time()
+        thread = threading.Thread(target=warmer._run)
+        thread.daemon = True
+        thread.start()
+        for i in range(500):
+            if warmer.error:
+                break
+            time.sleep(0.01)
+
+        # not ready while the warm-up keeps failing
+        time.sleep(0.05)
+        prog = warmer.progress()
+        self.assertFalse(prog['ready'])
+        self.assertEquals(prog['error'], "database unavailable")
+
+        # the warm-up is retried
+        outage.clear()
+        for i in range(500):
+            if warmer.ready:
+                break
+            time.sleep(0.01)
+        prog = warmer.progress()
+        self.assertTrue(prog['ready'])
+        self.assertNotIn('error', prog)
+
+    def test_failed_bounded(self):
+        warmer = warmup.ValidatorWarmer(Unbuildable)
+        for i in range(warmup.MAX_FAILED + 10):
+            self.assertFalse(warmer.warm("s{0}".format(i)))
+        self.assertEquals(len(warmer.failed), warmup.MAX_FAILED)
+        self.assertEquals(warmer.failed[0], "s10")
+
+        # a schema that fails again is listed once
+        warmer.warm("s10")
+        self.assertEquals(len(warmer.failed), warmup.MAX_FAILED)
+        self.assertEquals(warmer.failed[-1], "s10")
+
+@test.skipIf(not os.environ.get('MONGO_TESTDB_URL'),
+             "test mongodb not available")
+class TestValidatorWarmer(test.TestCase):
+
+    def setUp(self):
+        self.mc = setUpMongo()
+        val.validator_cache.clear()
+        for schemafile in "experiments.xsd microscopy.xsd".split():
+            schemapath = os.path.join(datadir, schemafile)
+            schema.SchemaLoader.load_from_file(schemapath, schemafile,
+                                               schemafile)
+
+    def tearDown(self):
+        tearDownMongo(self.mc)
+        self.mc.close()
+        self.mc = None
+
+    def test_warm_all(self):
+        warmer = warmup.ValidatorWarmer()
+        self.assertFalse(warmer.ready)
+        warmer.warm_all()
+
+        prog = warmer.progress()
+        self.assertEquals(prog['queued'], 2)
+        self.assertEquals(prog['compiled'], 2)
+        self.assertEquals(prog['pending'], 0)
+        self.assertEquals(prog['failed'], [])
+        self.assertEquals(len(val.validator_cache), 2)
+
+    def test_warm_missing(self):
+        warmer = warmup.ValidatorWarmer()
+        self.assertFalse(warmer.warm("goober"))
+        self.assertEquals(warmer.progress()['failed'], ["goober"])
+
+    def test_schedule(self):
+        warmer = warmup.ValidatorWarmer()
+        warmer.schedule("experiments.xsd")
+        self.assertEquals(warmer.queued, 1)
+        self.assertEquals(warmer._queue.get(), ("experiments.xsd", True))
+
+        # dependents are found by the background thread
+        warmer._schedule_dependents("experiments.xsd")
+        self.assertEquals(warmer.queued, 2)
+        self.assertEquals(warmer._queue.get(), ("microscopy.xsd", False))
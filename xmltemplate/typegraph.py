@@ -0,0 +1,161 @@
+"""
+a module for computing the derivation ancestry of the global types defined
+in a schema.
+
+The TypeGraph class in this module indexes a schema's global types by local
+name and follows each type's base-type chain iteratively, memoizing the
+ancestry of every type it visits so that each derivation link is followed
+only once.  Base types defined outside of the schema (i.e. in included or
+imported schemas) are looked up via a callback.
+"""
+from collections import OrderedDict as ODict
+
+from .validate import XSD_NS, SchemaValidationError
+
+MISSING = "__missing__"
+
+def split_qname(qname):
+    """
+    split a type name into its namespace and local name.  The name can be
+    of the form "{NS}LOCAL-NAME", "PREFIX:LOCAL-NAME" or "LOCAL-NAME"; in
+    the last case, the namespace is returned as an empty string.
+    """
+    if '}' in qname and qname.startswith('{'):
+        return qname.lstrip('{').split('}', 1)
+    elif ':' in qname:
+        return qname.split(':', 1)
+    return ('', qname)
+
+class TypeGraph(object):
+    """
+    a class for computing the ancestry of the global types defined in a
+    schema.
+
+    Add each global type defined in the schema with add(), giving the
+    qualified name of its base type (of the form "{NS}LOCAL-NAME").  The
+    ancestry of a type is the list of the qualified names of its base type,
+    that type's base type, and so on.  A built-in XML Schema type ends the
+    list.  When a base type is not defined in the schema, the external
+    resolver is asked for its ancestry; if it cannot find the type, the list
+    ends with MISSING.
+    """
+
+    def __init__(self, namespace, external=None):
+        """
+        create an empty graph
+
+        :param namespace str:   the target namespace of the schema
+        :param external func:   a function that takes the qualified name of a
+                                  type not defined in the schema and returns
+                                  the list of its ancestors, or None if the
+                                  type cannot be found.  If None, all such
+                                  types are considered missing.
+        """
+        if namespace is None:
+            namespace = ''
+        self.namespace = namespace
+        self.external = external
+
+        # keys are local type names, values are base type qnames (or None)
+        self._parents = ODict()
+
+        # keys are local type names, values are their traced ancestors
+        self._ancestors = {}
+
+    def add(self, name, parent=None):
+        """
+        add a global type defined in the schema.
+
+        :param name   str:  the local name of the type
+        :param parent str:  the qualified name of its base type, or None if
+                              it has none
+        :raises SchemaValidationError:  if the type was already added
+        """
+        if name in self._parents:
+            raise SchemaValidationError("Multiple definitions found for "+
+                                        "global type, " + name)
+        self._parents[name] = parent
+
+    def __contains__(self, name):
+        return name in self._parents
+
+    def __len__(self):
+        return len(self._parents)
+
+    def _local_parent(self, parent):
+        # return the local name of the given base type if it is defined in
+        # this schema, or None otherwise.
+        if not parent:
+            return None
+        ns, ln = split_qname(parent)
+        if ns == self.namespace and ln in self._parents:
+            return ln
+        return None
+
+    def _terminal(self, parent):
+        # return the ancestry of a type whose base type is not defined in
+        # this schema
+        if not parent:
+            return []
+        ns, ln = split_qname(parent)
+        if ns == XSD_NS:
+            return [parent]
+
+        found = None
+        if self.external:
+            found = self.external(parent)
+        if found is None:
+            return [parent, MISSING]
+        return [parent] + list(found)
+
+    def ancestors(self, name):
+        """
+        return the ancestry of the named type defined in this schema
+
+        :param name str:  the local name of the type
+        :raises KeyError:  if the type was not added
+        :raises SchemaValidationError:  if the type derives (indirectly) from
+                                        itself
+        """
+        if name in self._ancestors:
+            return self._ancestors[name]
+        if name not in self._parents:
+            raise KeyError(name)
+
+        # follow the chain of local base types until reaching one that has
+        # already been traced or whose base is not local
+        chain = []
+        onchain = set()
+        cur = name
+        while True:
+            if cur in self._ancestors:
+                tail = self._ancestors[cur]
+                break
+            if cur in onchain:
+                raise SchemaValidationError("Circular derivation detected: " +
+                                            cur + " derives from itself.")
+            chain.append(cur)
+            onchain.add(cur)
+
+            nxt = self._local_parent(self._parents[cur])
+            if nxt is None:
+                tail = self._terminal(self._parents[cur])
+                self._ancestors[chain.pop()] = tail
+                break
+            cur = nxt
+
+        # unwind the chain, memoizing the ancestry of each type on it
+        for cur in reversed(chain):
+            tail = [self._parents[cur]] + tail
+            self._ancestors[cur] = tail
+
+        return self._ancestors[name]
+
+    def trace_all(self):
+        """
+        return the ancestries of all the types in the schema
+
+        :return dict:  a dictionary with the local type names as keys and
+                       their ancestries as values
+        """
+        return ODict([(name, self.ancestors(name)) for name in self._parents])
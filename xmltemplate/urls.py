@@ -4,10 +4,16 @@ from xmltemplate import api
 
 urlpatterns = [
     url(r'^admin/', include(admin.site.urls)),
+    url(r'^ready/?$', api.readiness),
+    url(r'^qnames/?$', api.resolve_qname),
+    url(r'^diagnostics/(?P<digest>\w+)/?$', api.schema_diagnostics),
     url(r'^schemas/$', api.AllSchemaDocs.as_view()),
     url(r'^schemas/(?P<name>[^/]+)/?$', api.SchemaDoc.as_view()),
     url(r'^schemas/(?P<name>[^/]+)/(?P<version>\d+)/?$',
         api.SchemaDocVersion.as_view()),
+    url(r'^schemas/(?P<name>[^/]+)/validate/?$', api.validate_instance),
+    url(r'^schemas/(?P<name>[^/]+)/(?P<version>\d+)/validate/?$',
+        api.validate_instance),
     url(r'^schemas/(?P<schemaname>[^/]+)/elements/?$', api.list_elements_in),
     url(r'^schemas/(?P<schemaname>[^/]+)/(?P<version>\d+)/elements/?$',
         api.list_elements_in)
@@ -6,16 +6,56 @@ the particular validating parser library being used, allowing for multiple
 implementations to be leveraged.   Currently, the default implementation is 
 based on lxml.  
 """
-import os, sys, abc
+import os, sys, abc, re, mmap, threading, time, logging
+from itertools import islice
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
 from cStringIO import StringIO
 from abc import abstractmethod, ABCMeta
 from lxml import etree
 from collections import OrderedDict
 
-from .models import Schema
+from .models import Schema, SchemaVersion, on_current_change
+from .canon import QNAME_ATTRS, QNAMES_ATTRS
+from .cache import LRUCache
 
 XSD_NS = "http://www.w3.org/2001/XMLSchema"
 
+logger = logging.getLogger(__name__)
+
+# a rough multiplier for estimating the memory held by a compiled schema from 
+# the size of the schema documents (including includes and imports) that 
+# went into it.
+COMPILED_SIZE_FACTOR = 8
+
+# the default memory budget for the process-wide cache of compiled validators
+DEFAULT_VALIDATOR_CACHE_BYTES = 128 * 1024 * 1024
+
+# the default memory budget for the process-wide cache of doctored schemas
+DEFAULT_DOCTORED_CACHE_BYTES = 32 * 1024 * 1024
+
+# the size of the pieces that buffer-like inputs are fed to the parser in
+FEED_CHUNK_SIZE = 64 * 1024
+
+# the options for parsing a document that must not be allowed to pull in
+# content from elsewhere:  no DTD is loaded, external entities are not 
+# resolved, and nothing is fetched over the network.  An instance document
+# submitted for validation could otherwise read local files (which could 
+# then leak out through error messages).  lxml 5 can refuse just the 
+# external entities (as undefined); with resolve_entities=False, it drops 
+# the well-formedness errors found while a schema validates a stream.  
+# Older versions leave all entity references unresolved.
+SAFE_PARSER_OPTIONS = { "no_network": True, "load_dtd": False,
+                        "resolve_entities": etree.LXML_VERSION >= (5,) and 
+                                            "internal" }
+
+# splits a piece of a document into pieces that each end with at most one 
+# tag (see lxmlValidator.check_stream())
+_TAG_RE = re.compile(r'[^>]*>|[^>]+')
+
+# matches the XML declaration at the start of a unicode document
+_XML_DECL_RE = re.compile(u'^\ufeff?<\\?xml[^>]*\\?>')
+
 class ValidationError(Exception):
     """
     An indication that the XML is invalid.
@@ -39,6 +79,154 @@ class SchemaValidationError(ValidationError):
     """
     pass
 
+class ValidationOptions(object):
+    """
+    options that control how much effort goes into reporting the errors 
+    found in an invalid instance document.  
+
+    :property max_errors int:  the maximum number of errors to report; if 
+                               None, all errors are reported.  When this is
+                               1, validation stops at the first error 
+                               (where the input allows it), making it a 
+                               cheap gatekeeping check.
+    :property huge_tree bool:  if True, libxml2's limits on the depth of the
+                               document and the size of its text nodes are
+                               lifted.  This should only be set for trusted
+                               input.
+    """
+    def __init__(self, max_errors=None, huge_tree=False):
+        if max_errors is not None and max_errors < 1:
+            raise ValueError("ValidationOptions: max_errors must be positive")
+        self.max_errors = max_errors
+        self.huge_tree = huge_tree
+
+    @property
+    def fail_fast(self):
+        """
+        True if validation should stop at the first error
+        """
+        return self.max_errors == 1
+
+    @classmethod
+    def capped(cls, max_errors):
+        """
+        return options for collecting at most the given number of errors
+        """
+        return cls(max_errors)
+
+    def collect(self, entries):
+        """
+        return a list of InstanceErrors for the entries of an lxml error log,
+        limited to the maximum number of errors requested.
+        """
+        return [InstanceError.from_log_entry(e)
+                for e in islice(entries, self.max_errors)]
+
+COLLECT_ALL = ValidationOptions()
+STOP_AT_FIRST = ValidationOptions(1)
+
+class InstanceError(object):
+    """
+    a description of a single problem found in an instance document
+
+    :property message unicode:  the description of the problem
+    :property line    int:  the line in the document where the problem was 
+                              found (or None, if unknown)
+    :property column  int:  the column in that line (or None, if unknown)
+    :property path    str:  an XPath to the offending element (or None, if 
+                              unknown)
+    """
+    def __init__(self, message, line=None, column=None, path=None):
+        self.message = message
+        self.line = line
+        self.column = column
+        self.path = path
+
+    @classmethod
+    def from_log_entry(cls, entry):
+        """
+        create an instance from an entry from an lxml error log
+        """
+        return cls(entry.message, entry.line or None, 
+                   entry.column or None, getattr(entry, 'path', None))
+
+    def to_dict(self):
+        """
+        return the contents of this error as a dictionary
+        """
+        return { 'message': self.message, 'line': self.line,
+                 'column': self.column, 'path': self.path }
+
+    def __unicode__(self):
+        if self.line:
+            return u"line {0}: {1}".format(self.line, self.message)
+        return unicode(self.message)
+
+    def __str__(self):
+        return unicode(self).encode('utf-8')
+
+    def __repr__(self):
+        return "InstanceError({0!r})".format(unicode(self))
+
+class ValidationResult(object):
+    """
+    the outcome of validating a single instance document.  An instance 
+    evaluates as True if the document was found to be valid.
+
+    :property valid  bool:  True if the document is valid
+    :property errors list:  the InstanceErrors describing why the document is 
+                              invalid
+    """
+    def __init__(self, valid, errors=None):
+        self.valid = valid
+        if errors is None:
+            errors = []
+        self.errors = errors
+
+    def __nonzero__(self):
+        return bool(self.valid)
+
+class BatchValidationResult(object):
+    """
+    the outcome of validating a batch of instance documents via 
+    BaseValidator.validate_many().
+
+    :property results list:  a ValidationResult for each document, in the 
+                               order the documents were given
+    :property elapsed float: the wall-clock time, in seconds, it took to 
+                               validate the batch
+    :property workers int:   the number of workers used
+    """
+    def __init__(self, results, elapsed, workers):
+        self.results = results
+        self.elapsed = elapsed
+        self.workers = workers
+
+    @property
+    def throughput(self):
+        """
+        the number of documents validated per second
+        """
+        if self.elapsed <= 0:
+            return float(len(self.results))
+        return len(self.results) / self.elapsed
+
+    @property
+    def valid_count(self):
+        """
+        the number of documents found to be valid
+        """
+        return len(filter(lambda r: r.valid, self.results))
+
+    def __len__(self):
+        return len(self.results)
+
+    def __iter__(self):
+        return iter(self.results)
+
+    def __getitem__(self, i):
+        return self.results[i]
+
 
 class _SchemaResolver(etree.Resolver):
     """
@@ -49,9 +237,30 @@ class _SchemaResolver(etree.Resolver):
     provide to resolve() the location (system-id) and never namespace 
     (public-id).  
     """
-    def __init__(self, includes, imports):
+    def __init__(self, includes, imports, pinned=None, bundle=None):
         self.incls = includes.copy()
         self.imps = imports.copy()
+
+        # keys are schema names, values are flattened schema content to 
+        # provide for them without consulting the database (see 
+        # SchemaFlattener)
+        if bundle is None:
+            bundle = {}
+        self.bundle = bundle
+
+        # keys are schema names, values are the SchemaVersion records to use 
+        # for them in lieu of the current version
+        if pinned is None:
+            pinned = {}
+        self.pinned = pinned
+
+        # keys are the names of the schemas pulled in by this resolver; 
+        # values are the size of the content provided for it.
+        self.resolved = {}
+
+        # the names of the schemas that were resolved to their current 
+        # (rather than a pinned) version
+        self.floating = set()
         
     def resolve(self, location, namespace, context):
         schema = None
@@ -65,16 +274,27 @@ class _SchemaResolver(etree.Resolver):
             # In this case, the location with start with "schemaname:", followed
             # by the name of the schema in the database
             if location.startswith(SchemaProvider.CACHE_SCHEME):
+                name = location[len(SchemaProvider.CACHE_SCHEME):]
+                if name in self.bundle:
+                    content = self.bundle[name]
+                    self.resolved[name] = len(content)
+                    return self.resolve_string(content, context)
+
                 content = SchemaProvider.get(location, self)
                 if not content:
                     # should not happen; LOG a warning?
                     return None
+                self.resolved[name] = len(content)
+                if name not in self.pinned:
+                    self.floating.add(name)
                 return self.resolve_string(content, context)
 
             elif location in self.incls:
                 schema = Schema.get_by_name( self.incls[location] )
 
         if schema:
+            self.resolved[schema.name] = len(schema.content)
+            self.floating.add(schema.name)
             return self.resolve_string(schema.content, context)
 
         return None
@@ -172,10 +392,427 @@ class SchemaProvider(object):
     def get(cls, schemaname, resolver=None):
         if schemaname.startswith(cls.CACHE_SCHEME):
             schemaname = schemaname[len(cls.CACHE_SCHEME):]
-        schema = Schema.get_by_name(schemaname)
+        schema = None
+        if resolver is not None:
+            schema = resolver.pinned.get(schemaname)
+        if not schema:
+            schema = Schema.get_by_name(schemaname)
         if not schema:
             return None
-        return cls.from_schema(schema, resolver).transform_schema(schema.content)
+
+        provider = cls.from_schema(schema, resolver)
+        if getattr(schema, 'doctored', None):
+            # doctored when it was loaded
+            return schema.doctored
+        if len(provider.incls) == 0 and len(provider.imps) == 0:
+            return schema.content
+
+        key = (schema.name, schema.version,
+               tuple(schema.includes), tuple(schema.imports))
+        content = doctored_cache.get(key)
+        if content is None:
+            content = provider.transform_schema(schema.content)
+            doctored_cache.put(key, content, len(content))
+        return content
+
+class SchemaFlattener(object):
+    """
+    a class that produces a self-contained version of a schema for
+    compiling validators without consulting the database.
+
+    Includes of schemas with the same target namespace are replaced by the
+    content of the included schema (recursively), so that they need not be
+    resolved at all.  lxml cannot compile more than one target namespace
+    from a single document, so the schemas that are imported (and any
+    chameleon includes) are instead flattened themselves and collected into
+    a bundle, keyed by schema name; the flattened content refers to them via
+    doctored schemaLocations (see SchemaProvider), and the resolver serves
+    them from the bundle.  An included schema whose defaults (e.g. 
+    elementFormDefault) differ from those of the including schema is 
+    bundled in the same way, as its definitions would mean something 
+    different if inlined.
+    """
+
+    CACHE_SCHEME = SchemaProvider.CACHE_SCHEME
+
+    # the schema attributes that set defaults for the definitions within 
+    # it, with the values that apply when they are absent
+    SCHEMA_DEFAULTS = (("elementFormDefault", "unqualified"),
+                       ("attributeFormDefault", "unqualified"),
+                       ("blockDefault", ""), ("finalDefault", ""))
+
+    def __init__(self, pinned=None):
+        """
+        create the flattener
+
+        :param pinned dict:  a dictionary mapping schema names to the
+                               SchemaVersion records to use for them;
+                               schemas not listed are drawn from their
+                               current versions.
+        """
+        if pinned is None:
+            pinned = {}
+        self.pinned = pinned
+
+        # keys are schema names, values are their flattened content
+        self.bundle = OrderedDict()
+        self._pending = set()
+
+        # (name, namespace) pairs for the schemas whose definitions are 
+        # already part of the flattened schema or its bundle
+        self._defined = set()
+
+    def flatten(self, schema):
+        """
+        flatten the given schema.  Afterward, the bundle property will
+        contain the schemas it refers to.
+
+        :param schema Schema:  the schema to flatten (a Schema,
+                                 SchemaVersion, or SchemaLoader)
+        :return str:  the flattened content
+        """
+        self._pending.add(schema.name)
+        tree = self._parse(schema)
+        self._defined.add((schema.name, 
+                           tree.getroot().get('targetNamespace', '')))
+        return etree.tostring(self._flatten_tree(schema, set([schema.name]),
+                                                 tree))
+
+    def _lookup(self, name):
+        return self.pinned.get(name) or Schema.get_by_name(name)
+
+    def _includes_of(self, schema):
+        if isinstance(schema.includes, dict):
+            return schema.includes
+        return SchemaProvider._strmap_to_dict(schema.includes)
+
+    def _imports_of(self, schema):
+        if isinstance(schema.imports, dict):
+            return schema.imports
+        return SchemaProvider._strmap_to_dict(schema.imports)
+
+    def _parse(self, schema):
+        return etree.parse(StringIO(schema.content))
+
+    def _flatten_tree(self, schema, inlined, tree=None):
+        # inlined holds the names of the schemas already inlined into the 
+        # document being built; each bundled document gets its own.
+        if tree is None:
+            tree = self._parse(schema)
+        root = tree.getroot()
+        tns = root.get('targetNamespace', '')
+        incls = self._includes_of(schema)
+        imps = self._imports_of(schema)
+        nsm = {"xs": XSD_NS}
+
+        imported = set()
+        for imp in root.findall("xs:import", nsm):
+            imported.add(imp.get('namespace'))
+            self._bundle_import(imp, imps)
+
+        for incl in root.findall("xs:include", nsm):
+            name = incls.get(incl.get('schemaLocation'))
+            dep = name and self._lookup(name)
+            if not dep:
+                # leave it for the resolver
+                continue
+            if name in inlined or (name, tns) in self._defined:
+                # already inlined (or a circular include), or its 
+                # definitions are already in this namespace elsewhere in 
+                # the bundle
+                root.remove(incl)
+                continue
+            self._defined.add((name, tns))
+
+            deptree = self._parse(dep)
+            deproot = deptree.getroot()
+            if deproot.get('targetNamespace', '') != tns or \
+               not self._same_defaults(root, deproot):
+                # a chameleon include, or one with different defaults; 
+                # these must be resolved.  As a separate document, the 
+                # bundled schema gets its own set of inlined schemas.
+                incl.set('schemaLocation', self.CACHE_SCHEME+name)
+                if name not in self.bundle and name not in self._pending:
+                    self._pending.add(name)
+                    deproot = self._flatten_tree(dep, set([name]),
+                                                 deptree).getroot()
+                    self._add_to_bundle(name, deproot)
+                continue
+
+            inlined.add(name)
+            deproot = self._flatten_tree(dep, inlined, deptree).getroot()
+            pos = root.index(incl)
+            root.remove(incl)
+            for child in list(deproot):
+                if not isinstance(child.tag, basestring):
+                    # comment or processing instruction
+                    continue
+                if child.tag == "{%s}import" % XSD_NS:
+                    # imports must appear before any definitions
+                    if child.get('namespace') not in imported:
+                        imported.add(child.get('namespace'))
+                        root.insert(0, child)
+                        pos += 1
+                elif child.tag == "{%s}include" % XSD_NS:
+                    root.insert(0, child)
+                    pos += 1
+                else:
+                    root.insert(pos, self._transplant(child, root))
+                    pos += 1
+
+        return tree
+
+    def _bundle_import(self, imp, imps):
+        name = imps.get(imp.get('namespace'))
+        if not name:
+            return
+        imp.set('schemaLocation', self.CACHE_SCHEME+name)
+        if name in self.bundle or name in self._pending:
+            return
+
+        dep = self._lookup(name)
+        if not dep:
+            return
+        self._pending.add(name)
+        tree = self._parse(dep)
+        self._defined.add((name, tree.getroot().get('targetNamespace', '')))
+        self._add_to_bundle(name,
+                            self._flatten_tree(dep, set([name]),
+                                               tree).getroot())
+
+    def _same_defaults(self, root, deproot):
+        for attr, default in self.SCHEMA_DEFAULTS:
+            if root.get(attr, default) != deproot.get(attr, default):
+                return False
+        return True
+
+    def _add_to_bundle(self, name, root):
+        if name not in self.bundle:
+            self.bundle[name] = etree.tostring(root)
+
+    def _transplant(self, el, dest):
+        # The definitions in an inlined schema may contain QName-valued
+        # attributes (e.g. type="ex:Foo") whose prefixes are declared on
+        # its root element or on the definition itself; recreate the 
+        # element so that it carries those declarations with it.  When it 
+        # is inserted, lxml drops its declarations of namespaces that are 
+        # already declared at the destination (perhaps with other 
+        # prefixes), so QNames in those namespaces are first rewritten to 
+        # use the destination's prefixes.
+        self._requalify(el, dest.nsmap)
+        out = etree.Element(el.tag, dict(el.attrib), nsmap=el.nsmap)
+        out.text = el.text
+        out.tail = el.tail
+        for child in list(el):
+            out.append(child)
+        return out
+
+    def _requalify(self, el, destmap):
+        prefixes = {}
+        for prefix, ns in destmap.iteritems():
+            prefixes.setdefault(ns, prefix)
+        for desc in el.iter(etree.Element):
+            if not desc.tag.startswith("{%s}" % XSD_NS):
+                continue
+            for attr, value in desc.attrib.items():
+                if attr in QNAME_ATTRS:
+                    desc.set(attr, self._requalify_qname(value.strip(), desc,
+                                                         destmap, prefixes))
+                elif attr in QNAMES_ATTRS:
+                    desc.set(attr, " ".join(
+                        [self._requalify_qname(q, desc, destmap, prefixes)
+                         for q in value.split()]))
+
+    def _requalify_qname(self, qname, el, destmap, prefixes):
+        if ':' in qname:
+            prefix, local = qname.split(':', 1)
+        else:
+            prefix, local = None, qname
+        ns = el.nsmap.get(prefix)
+        if ns is None or destmap.get(prefix) == ns or ns not in prefixes:
+            # the prefix is still bound as needed at the destination
+            return qname
+        prefix = prefixes[ns]
+        return (prefix and prefix+":"+local) or local
+
+    def bundle_records(self):
+        """
+        return the bundle as a list of dictionaries, each with a "name"
+        and "content" (as stored in SchemaVersion.bundle)
+        """
+        return [{"name": n, "content": c} for n, c in self.bundle.iteritems()]
+
+def _parse_instance(source, parser=None, is_file=False):
+    """
+    parse an instance document from any of the supported input forms, 
+    handing the data to libxml2 with as little copying as possible.  The 
+    supported forms are:
+      *  a str containing the XML document; this is parsed in place.
+      *  a unicode string containing the XML document; this is parsed in 
+           place.  Its XML declaration, if any, is dropped, as the encoding
+           it declares no longer applies to the decoded text.
+      *  a str containing a file path, if is_file is True; the file is read
+           directly by libxml2 without passing through Python.
+      *  an object supporting the buffer interface (e.g. a memoryview, 
+           bytearray, or mmap); this is fed to the parser in chunks.
+      *  an open file or other object with a read() method.
+
+    :param parser XMLParser:  the parser to use; if None, one that does 
+                          not load DTDs or resolve external entities is used
+    :param is_file bool:  if True, a str source is a file path rather than 
+                          the document itself
+    :return ElementTree:  the parsed document
+    :raises XMLSyntaxError:  if the document is not well-formed
+    """
+    if parser is None:
+        parser = _instance_parser()
+    if isinstance(source, unicode):
+        # lxml refuses unicode strings with an encoding declaration
+        source = _XML_DECL_RE.sub(u'', source, 1)
+        return etree.fromstring(source, parser).getroottree()
+
+    if isinstance(source, str):
+        if is_file:
+            return etree.parse(source, parser)
+        return etree.fromstring(source, parser).getroottree()
+
+    if isinstance(source, bytearray):
+        source = memoryview(source)
+    if isinstance(source, (memoryview, buffer, mmap.mmap)):
+        return _feed_buffer(source, parser)
+
+    if hasattr(source, 'read'):
+        return etree.parse(source, parser)
+
+    raise TypeError("Unsupported type for XML instance: " + str(type(source)))
+
+def _instance_parser(huge_tree=False):
+    # return a parser for an instance document (see SAFE_PARSER_OPTIONS)
+    return etree.XMLParser(huge_tree=huge_tree, **SAFE_PARSER_OPTIONS)
+
+def _entity_errors(doc):
+    # return InstanceErrors for the entity references that were left 
+    # unresolved when doc was parsed (see SAFE_PARSER_OPTIONS); libxml2 
+    # cannot validate a document containing them.  Entities can only be 
+    # declared in a DOCTYPE, so other documents need not be searched.
+    if not doc.docinfo.doctype:
+        return []
+    return [_entity_error(ent, doc.getpath(ent.getparent()))
+            for ent in doc.iter(etree.Entity)]
+
+def _entity_error(ent, path):
+    return InstanceError(u"Entity reference not allowed: " + ent.text,
+                         ent.sourceline, None, path)
+
+def _stream_path(steps):
+    # return an XPath to an element given its position among its siblings 
+    # and those of each of its ancestors
+    return "/*" + "".join(["/*[{0}]".format(i) for i in steps[1:]])
+
+def _as_stream(source, is_file=False):
+    # return a form of an instance document that can be read incrementally 
+    # (a file path or file-like object) without copying it, or None if 
+    # that is not possible.
+    if isinstance(source, str):
+        if is_file:
+            return source
+        # cStringIO wraps a str without copying it
+        return StringIO(source)
+    if hasattr(source, 'read'):
+        return source
+    return None
+
+def _tell(stream):
+    # return the position that a file-like object can be rewound to, or 
+    # None if it cannot be
+    try:
+        return stream.tell()
+    except (AttributeError, IOError):
+        return None
+
+def _read_error(ex):
+    # return an InstanceError for a failure to read an instance document
+    return InstanceError(u"Unable to read XML instance: " + 
+                         unicode(getattr(ex, 'strerror', None) or ex))
+
+def _feed_buffer(buf, parser=None):
+    # feed the contents of a memoryview, buffer, or mmap to a parser in 
+    # chunks so that only one chunk is ever copied at a time.
+    if parser is None:
+        parser = _instance_parser()
+    for i in xrange(0, len(buf), FEED_CHUNK_SIZE):
+        chunk = buf[i:i+FEED_CHUNK_SIZE]
+        if isinstance(chunk, memoryview):
+            chunk = chunk.tobytes()
+        parser.feed(chunk)
+    return parser.close().getroottree()
+
+class ValidatorCache(LRUCache):
+    """
+    a cache of compiled validators keyed by the name, version, and digest of 
+    the schema they validate against.  The cache's budget is an estimate of 
+    the memory (in bytes) held by the compiled validators.  
+
+    Cached validators that depend on a schema--either directly or through 
+    an include or import--are dropped when the version of that schema 
+    considered current changes (see invalidate()).  A key may carry a fourth
+    item, which, if True, marks a validator built for an explicitly 
+    requested version; such a validator is only dropped if it resolved one 
+    of its dependencies to a current version.  
+    """
+
+    def __init__(self, max_bytes=DEFAULT_VALIDATOR_CACHE_BYTES):
+        super(ValidatorCache, self).__init__(max_bytes)
+
+    def get_validator(self, key, build):
+        """
+        return the validator cached under the given key, building and caching
+        it if necessary.
+
+        :param key tuple:        the (name, version, digest, explicit) for 
+                                   the schema
+        :param build function:   a no-argument function that returns a new 
+                                   validator
+        """
+        valid8r = self.get(key)
+        if valid8r is None:
+            # compile outside the lock so that other lookups are not blocked
+            valid8r = build()
+            self.put(key, valid8r, getattr(valid8r, 'footprint', 1))
+            return valid8r
+
+        # a validator compiles more copies of its schema as more threads 
+        # use it at once, so its footprint can grow after it is cached
+        footprint = getattr(valid8r, 'footprint', 1)
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[1] != footprint:
+                self._remove(key)
+                self.put(key, valid8r, footprint)
+        return valid8r
+
+    def invalidate(self, name):
+        """
+        remove all validators for the current version of the schema with the 
+        given name as well as those for schemas that include or import its 
+        current version.  Validators for explicitly requested versions of the
+        named schema are kept as their content never changes.
+        """
+        with self._lock:
+            for key in self._data.keys():
+                valid8r = self._data[key][0]
+                explicit = len(key) > 3 and key[3]
+                if (key[0] == name and not explicit) or \
+                   name in getattr(valid8r, 'dependencies', ()):
+                    self._remove(key)
+
+validator_cache = ValidatorCache()
+on_current_change(validator_cache.invalidate)
+
+# doctored schema content (see SchemaProvider) keyed by schema name, version,
+# includes, and imports.  As the content of a given version never changes, 
+# this cache needs no invalidation.
+doctored_cache = LRUCache(DEFAULT_DOCTORED_CACHE_BYTES)
 
 class BaseValidator(object):
     """
@@ -191,15 +828,63 @@ class BaseValidator(object):
     __metaclass__ = ABCMeta
 
     @classmethod
-    def from_schema_name(cls, schemaname):
+    def from_schema_name(cls, schemaname, version=None, use_cache=True):
         """
-        create a validator for a named schema in the databbase
+        create a validator for a named schema in the databbase.  Unless 
+        use_cache is False, the validator is drawn from (or added to) the 
+        process-wide cache of compiled validators, validator_cache.
+
+        :param schemaname str:  the name of the schema
+        :param version    int:  the version of the schema to use; if None,
+                                  the current version is used.
+        :param use_cache bool:  if False, always compile a new validator
         """
-        schema = Schema.get_by_name(schemaname)
+        schema = Schema.get_by_name(schemaname, version)
         if not schema:
             raise ValidationError("schema not found: " + schemaname)
 
-        return cls(schema.content, schema.includes, schema.imports)
+        if not use_cache:
+            return cls.from_schema(schema)
+
+        key = (schema.name, schema.version, schema.digest, 
+               version is not None)
+        return validator_cache.get_validator(key,
+                                             lambda: cls.from_schema(schema))
+
+    @classmethod
+    def from_schema(cls, schema):
+        """
+        create a validator for a Schema instance drawn from the database.  
+        If the schema was flattened when it was loaded, the validator is 
+        compiled from the flattened content and its bundle without any 
+        database lookups.  Otherwise, the schemas it depends on are resolved
+        to the versions recorded in its closure, all of which are retrieved 
+        with a single query.  The returned validator records the name and 
+        version of the schema it was compiled from as its schema_name and
+        schema_version attributes.
+        """
+        out = None
+        if getattr(schema, 'flattened', None):
+            bundle = dict([(p['name'], p['content']) for p in schema.bundle])
+            try:
+                out = cls(schema.flattened, bundle=bundle)
+            except ValidationError, ex:
+                # fall back to compiling from the original content
+                logger.warn("Unable to compile flattened schema, %s/%s "
+                            "(falling back to original content): %s",
+                            schema.name, schema.version, ex.message)
+
+        if out is None:
+            pinned = None
+            if schema.closure:
+                pinned = SchemaVersion.get_pinned(schema.closure)
+            out = cls(schema.content, 
+                      SchemaProvider._strmap_to_dict(schema.includes),
+                      SchemaProvider._strmap_to_dict(schema.imports), pinned)
+
+        out.schema_name = schema.name
+        out.schema_version = schema.version
+        return out
 
     @abstractmethod
     def validate(self, inst_content):
@@ -209,6 +894,80 @@ class BaseValidator(object):
         """
         return True
 
+    @abstractmethod
+    def check(self, inst_content, streaming=False, options=None, 
+              is_file=False):
+        """
+        validate the given instance document, returning a ValidationResult 
+        that describes any problems found.  Unlike validate(), a document 
+        that is not well-formed is reported as invalid rather than raised.  
+
+        :param streaming bool:  if True, inst_content is validated 
+                                  incrementally (see check_stream()).
+        :param options ValidationOptions:  options controlling how errors are 
+                                  collected; if None, all are collected.
+        :param is_file bool:    if True, inst_content is a file path rather 
+                                  than the document itself
+        """
+        raise NotImplementedError("BaseValidator.check()")
+
+    @abstractmethod
+    def check_stream(self, source, options=None, is_file=False):
+        """
+        validate an instance document incrementally as it is read from a 
+        file or stream, without building the full document in memory.  This
+        is intended for very large documents.  
+
+        :param source str|file:  a file-like object to read the document 
+                                   from, the document as a str, or (if 
+                                   is_file is True) a file path
+        :param options ValidationOptions:  options controlling how errors are 
+                                  collected; if None, all are collected.
+        :param is_file bool:     if True, source is a file path
+        :return ValidationResult:
+        """
+        raise NotImplementedError("BaseValidator.check_stream()")
+
+    def validate_stream(self, source, is_file=False):
+        """
+        return True if the instance document read from the given file-like 
+        object (or, if is_file is True, file path) is valid, reading it 
+        incrementally (see check_stream()).
+        """
+        return self.check_stream(source, is_file=is_file).valid
+
+    def validate_many(self, instances, workers=None, options=None):
+        """
+        validate a batch of instance documents, spreading them across a pool 
+        of worker threads.  The workers share the validator's compiled 
+        copies of the schema; each holds one only while validating a 
+        document, and copies compiled for one batch are kept for the next.
+
+        :param instances iterable:  the instance documents to validate
+        :param workers int:         the number of workers to use; if None, 
+                                      the number of CPUs is used.  
+        :param options ValidationOptions:  options controlling how errors are 
+                                      collected for each document
+        :return BatchValidationResult:  the per-document results (in input 
+                                      order) and the throughput achieved
+        """
+        if not workers or workers < 1:
+            workers = cpu_count()
+        check = lambda inst: self.check(inst, options=options)
+
+        start = time.time()
+        if workers == 1:
+            results = [check(inst) for inst in instances]
+        else:
+            pool = ThreadPool(workers)
+            try:
+                results = pool.map(check, instances)
+            finally:
+                pool.close()
+                pool.join()
+
+        return BatchValidationResult(results, time.time() - start, workers)
+
     @abstractmethod
     def parse(self, inst_content):
         """
@@ -229,7 +988,8 @@ class lxmlValidator(BaseValidator):
     To validate an instance, pass the XML instance document to validate.  
     """
 
-    def __init__(self, schema_content, includes=None, imports=None):
+    def __init__(self, schema_content, includes=None, imports=None,
+                 pinned=None, bundle=None):
         """
         construct a validator from a given schema
 
@@ -244,45 +1004,408 @@ class lxmlValidator(BaseValidator):
                                       and maps a schema location URL
                                       to a name of a schema already loaded into
                                       the database.
+        :param pinned   dict:      a dictionary mapping schema names to the 
+                                      SchemaVersion records to use for them 
+                                      when they are included or imported; 
+                                      schemas not listed are resolved to 
+                                      their current versions.
+        :param bundle   dict:      a dictionary mapping schema names to 
+                                      flattened schema content that should 
+                                      be used for them without consulting 
+                                      the database (see SchemaFlattener).
         """
         if includes is None:
             includes = {}
         if imports is None:
             imports = {}
+        if pinned is None:
+            pinned = {}
+
+        self._content = schema_content
+        self._incls = includes
+        self._imps = imports
+        self._pinned = pinned
+        self._bundle = bundle
+
+        self._share(self._compile())
+
+    @classmethod
+    def schema_resolver(cls, includes, imports):
+        """
+        return a resolver for parsing a schema with parse() so that a 
+        validator can later be compiled from the parsed tree (see 
+        from_parsed()).  The resolver refers to (rather than copies) the 
+        given include and import maps, so they may be filled in after the 
+        schema is parsed.
+
+        :param includes dict:  the include map (see the constructor)
+        :param imports  dict:  the import map (see the constructor)
+        """
+        out = _SchemaResolver({}, {})
+        out.incls = includes
+        out.imps = imports
+        return out
+
+    @classmethod
+    def from_parsed(cls, schema_content, tree, resolver):
+        """
+        construct a validator from a schema that has already been parsed 
+        via parse() with a resolver from schema_resolver().  The tree is 
+        compiled directly rather than re-parsed from the content; the 
+        schemaLocations in it are doctored only for the duration of the 
+        compilation.  
 
-        xp = etree.XMLParser()  # (any options needed?)
-        xp.resolvers.add(_SchemaResolver(includes, imports))
+        :param schema_content str:  the XML schema document as a string; this
+                                      is only re-parsed if the validator is 
+                                      used by several threads at once.
+        :param tree ElementTree:    the parsed schema document
+        :param resolver:            the resolver that tree was parsed with
+        """
+        out = cls.__new__(cls)
+        out._content = schema_content
+        out._incls = resolver.incls
+        out._imps = resolver.imps
+        out._pinned = resolver.pinned
+        out._bundle = resolver.bundle
+        out._share(out._compile_tree(tree, resolver))
+        return out
+
+    def _share(self, valid8r):
+        # an lxml compiled schema collects the errors found in a parsed 
+        # document in a single log, so only one thread at a time may use it 
+        # to validate one.  The compiled copies not in use are shared by all
+        # threads; another is only compiled when they are all in use (see 
+        # _checkout()).  A streamed document's errors are collected by its
+        # parser, so any thread may stream with the first copy.
+        self._valid8r = valid8r
+        self._idle = [valid8r]
+        self._idle_lock = threading.Lock()
+        self.copies = 1
+
+    def _compile(self):
+        # parse the schema and compile it into an lxml validator
+        xp = etree.XMLParser(**SAFE_PARSER_OPTIONS)
+        resolver = _SchemaResolver(self._incls, self._imps, self._pinned,
+                                   self._bundle)
+        xp.resolvers.add(resolver)
         try:
-            tree = etree.parse(StringIO(schema_content), parser=xp)
+            tree = etree.parse(StringIO(self._content), parser=xp)
         except etree.XMLSyntaxError, ex:
             raise ValidationError("XML Schema document is not well-formed: " +
                                   ex.message, [ex.message])
+        return self._compile_tree(tree, resolver)
 
-        sp = SchemaProvider(includes, imports)
+    def _compile_tree(self, tree, resolver):
+        # compile a schema tree parsed with the given resolver, doctoring its
+        # schemaLocations only while it is compiled
+        nsm = {"xs": XSD_NS }
+        saved = [(el, el.get('schemaLocation')) for el in 
+                 tree.getroot().xpath("xs:import|xs:include", namespaces=nsm)]
+        sp = SchemaProvider(self._incls, self._imps)
         sp.update_includes(tree)
         
         try:
-            self._valid8r = etree.XMLSchema(tree)
+            out = etree.XMLSchema(tree)
         except etree.XMLSchemaError, ex:
             raise SchemaValidationError("XML Schema compliance error: " +
                                         ex.message, [ex.message])
+        finally:
+            for el, loc in saved:
+                if loc is None:
+                    el.attrib.pop('schemaLocation', None)
+                else:
+                    el.set('schemaLocation', loc)
 
-    def validate(self, inst_content):
+        # record what went into the compiled schema to support caching; only 
+        # the schemas resolved to their current versions can go stale.
+        self.dependencies = frozenset(resolver.floating)
+        self._copy_footprint = COMPILED_SIZE_FACTOR * \
+                        (len(self._content) + sum(resolver.resolved.values()))
+        return out
+
+    @property
+    def footprint(self):
+        """
+        an estimate of the memory (in bytes) held by all the compiled copies
+        of the schema (see _checkout())
+        """
+        return self._copy_footprint * self.copies
+
+    def _checkout(self):
+        # return a compiled copy of the schema for the current thread's 
+        # exclusive use, compiling one if none are idle; it must be handed 
+        # back via _checkin().
+        with self._idle_lock:
+            if self._idle:
+                return self._idle.pop()
+        out = self._compile()
+        with self._idle_lock:
+            self.copies += 1
+        return out
+
+    def _checkin(self, valid8r):
+        with self._idle_lock:
+            self._idle.append(valid8r)
+
+    def validate(self, inst_content, streaming=False, is_file=False):
         """
         validate that the given instance document is compliant with the 
         configured XML Schema
+
+        :param streaming bool:  if True, inst_content is validated 
+                                  incrementally (see check_stream()).
+        :param is_file bool:    if True, inst_content is a file path rather 
+                                  than the document itself
+        """
+        if streaming:
+            return self.validate_stream(inst_content, is_file)
+        doc = _parse_instance(inst_content, is_file=is_file)
+        if _entity_errors(doc):
+            return False
+        valid8r = self._checkout()
+        try:
+            return valid8r.validate(doc)
+        finally:
+            self._checkin(valid8r)
+
+    def check(self, inst_content, streaming=False, options=None, 
+              is_file=False):
+        """
+        validate the given instance document, returning a ValidationResult 
+        that describes any problems found.  
+
+        :param streaming bool:  if True, inst_content is validated 
+                                  incrementally (see check_stream()).
+        :param options ValidationOptions:  options controlling how errors are 
+                                  collected; if None, all are collected.  
+                                  When stopping at the first error, the 
+                                  document is validated as it is parsed so 
+                                  that parsing can be abandoned early.
+        :param is_file bool:    if True, inst_content is a file path rather 
+                                  than the document itself
+        """
+        if options is None:
+            options = COLLECT_ALL
+        if streaming:
+            return self.check_stream(inst_content, options, is_file)
+        if options.fail_fast:
+            source = _as_stream(inst_content, is_file)
+            if source is not None:
+                return self.check_stream(source, options, is_file)
+
+        # the errors are drawn from the parser's own log; the log attached 
+        # to the exception accumulates the errors of earlier parses
+        parser = _instance_parser(options.huge_tree)
+        try:
+            doc = _parse_instance(inst_content, parser, is_file)
+        except etree.XMLSyntaxError, ex:
+            errors = options.collect(parser.error_log)
+            if not errors:
+                errors = [InstanceError(ex.message)]
+            return ValidationResult(False, errors)
+        except IOError, ex:
+            return ValidationResult(False, [_read_error(ex)])
+
+        errors = _entity_errors(doc)
+        if errors:
+            return ValidationResult(False, errors[:options.max_errors])
+
+        valid8r = self._checkout()
+        try:
+            if valid8r.validate(doc):
+                return ValidationResult(True)
+            return ValidationResult(False, options.collect(valid8r.error_log))
+        finally:
+            self._checkin(valid8r)
+
+    def check_stream(self, source, options=None, is_file=False):
         """
-        doc = etree.parse(StringIO(inst_content))
-        return self._valid8r.validate(doc)
+        validate an instance document incrementally as it is read from a 
+        file or stream.  The compiled schema is attached to the parser so 
+        that validation happens as the document is parsed; each element is 
+        discarded once it has been read so that memory use stays bounded 
+        regardless of the size of the document.  Parsing stops as soon as 
+        an error is found; a document found to be invalid is then read 
+        again (where the input can be rewound) to locate its errors, 
+        stopping once the maximum number requested have been found.
+
+        :param source str|file:  a file-like object to read the document 
+                                   from, the document as a str, or (if 
+                                   is_file is True) a file path
+        :param options ValidationOptions:  options controlling how errors are 
+                                  collected; if None, all are collected.
+        :param is_file bool:     if True, source is a file path
+        :return ValidationResult:
+        """
+        if options is None:
+            options = COLLECT_ALL
+        stream = _as_stream(source, is_file)
+        if stream is None:
+            raise TypeError("Unsupported type for streamed XML instance: " +
+                            str(type(source)))
+        try:
+            if isinstance(stream, str):
+                with open(stream, 'rb') as fd:
+                    return self._check_stream(fd, options)
+            return self._check_stream(stream, options)
+        except IOError, ex:
+            return ValidationResult(False, [_read_error(ex)])
+
+    def _check_stream(self, stream, options):
+        # a valid document is read once, in whole chunks; the slower pass 
+        # that locates errors is only needed once the document is found 
+        # to be invalid (or if it cannot be read twice)
+        start = _tell(stream)
+        if start is not None:
+            if self._scan_stream(stream, options):
+                return ValidationResult(True)
+            stream.seek(start)
+        return self._locate_errors(stream, options)
+
+    def _stream_parser(self, events, options):
+        return etree.XMLPullParser(events=events, 
+                                   schema=self._valid8r,
+                                   huge_tree=options.huge_tree,
+                                   **SAFE_PARSER_OPTIONS)
+
+    def _scan_stream(self, stream, options):
+        # return True if the document read from stream is valid, stopping at
+        # the first chunk of it in which an error is found
+        parser = self._stream_parser(("end",), options)
+        doctype = None
+        try:
+            while True:
+                chunk = stream.read(FEED_CHUNK_SIZE)
+                if not chunk:
+                    parser.close()
+                    return True
+                parser.feed(chunk)
+                for event, el in parser.read_events():
+                    if doctype is None:
+                        doctype = bool(el.getroottree().docinfo.doctype)
+                    if doctype and \
+                       next(el.iterchildren(etree.Entity), None) is not None:
+                        # see _entity_errors()
+                        return False
+                    el.clear()
+                    while el.getprevious() is not None:
+                        del el.getparent()[0]
+                for entry in parser.feed_error_log:
+                    if entry.level >= etree.ErrorLevels.ERROR:
+                        return False
+        except etree.XMLSyntaxError:
+            return False
+
+    def _locate_errors(self, stream, options):
+        # libxml2 records neither the line nor the element of the validity 
+        # errors it finds while streaming, so the document is fed to the 
+        # parser a tag at a time:  an error that shows up in the log after 
+        # a tag is fed belongs to the element that tag opens or closes.
+        parser = self._stream_parser(("start", "end"), options)
+        errors = []
+        line = 1
+        counts = [0]    # the number of children seen so far at each level
+        steps = []      # the position of each open element among its siblings
+        ended = False   # True if the last event was the end of an element
+        doctype = None
+        seen = 0        # the number of log entries already looked at
+
+        def add_errors(log):
+            # record the errors newly added to the parser's log
+            path = _stream_path(steps + [counts[-1]] if ended else steps)
+            for entry in islice(log, seen, None):
+                if entry.level >= etree.ErrorLevels.ERROR:
+                    errors.append(InstanceError(entry.message, 
+                                                entry.line or line,
+                                                entry.column or None, 
+                                                entry.path or path))
+            return len(log)
+
+        def done():
+            return options.max_errors and len(errors) >= options.max_errors
+
+        try:
+            while not done():
+                chunk = stream.read(FEED_CHUNK_SIZE)
+                if not chunk:
+                    parser.close()
+                    break
+                for piece in _TAG_RE.findall(chunk):
+                    parser.feed(piece)
+                    for event, el in parser.read_events():
+                        ended = event == "end"
+                        if not ended:
+                            counts[-1] += 1
+                            steps.append(counts[-1])
+                            counts.append(0)
+                            continue
+
+                        if doctype is None:
+                            doctype = bool(el.getroottree().docinfo.doctype)
+                        if doctype:
+                            # see _entity_errors()
+                            path = _stream_path(steps)
+                            errors.extend([_entity_error(ent, path) for ent
+                                           in el.iterchildren(etree.Entity)])
+                        counts.pop()
+                        steps.pop()
+                        el.clear()
+                        while el.getprevious() is not None:
+                            del el.getparent()[0]
+
+                    log = parser.feed_error_log
+                    if len(log) > seen:
+                        seen = add_errors(log)
+                    line += piece.count('\n')
+                    if done():
+                        break
+        except etree.XMLSyntaxError, ex:
+            # raised for well-formedness errors, and at the end of the 
+            # document for validity errors
+            add_errors(parser.feed_error_log)
+            if not errors:
+                errors = [InstanceError(ex.message, ex.lineno or None)]
+
+        if errors:
+            return ValidationResult(False, errors[:options.max_errors])
+        return ValidationResult(True)
 
     @classmethod
-    def parse(cls, xmlstr):
+    def feed_parser(cls, resolver=None):
+        """
+        return a parser that a document can be fed to incrementally (via 
+        its feed() and close() methods), e.g. as it is read from a stream.
+
+        :param resolver:  a resolver from schema_resolver() to parse a 
+                          schema document with, so that a validator can be 
+                          compiled from the result via from_parsed().
+        """
+        parser = etree.XMLParser()
+        if resolver is not None:
+            parser.resolvers.add(resolver)
+        return parser
+
+    @classmethod
+    def parse(cls, xmlstr, resolver=None, is_file=False):
         """
         return a XML-parsed version of the given XML document, raising an 
         exception if it is not well-formed.  
+
+        :param xmlstr:  the XML document, given as a str or unicode string,
+                          an object supporting the buffer interface (e.g. 
+                          memoryview or mmap), an open file, or (if is_file 
+                          is True) a file path.  
+        :param resolver:  a resolver from schema_resolver() to parse a 
+                          schema document with, so that a validator can be 
+                          compiled from the result via from_parsed().
+        :param is_file bool:  if True, xmlstr is a file path
         """
+        parser = None
+        if resolver is not None:
+            parser = etree.XMLParser()
+            parser.resolvers.add(resolver)
         try:
-            return etree.parse(StringIO(xmlstr))
+            return _parse_instance(xmlstr, parser, is_file)
         except etree.XMLSyntaxError, ex:
             raise ValidationError("XML is not well-formed: "+ex.message,
                                   [ex.message])
@@ -0,0 +1,203 @@
+"""
+a module for compiling validators ahead of their first use.
+
+Compiling a validator for a schema with many includes and imports can be
+expensive; without warm-up, that cost is paid by the first request that
+needs the validator after the server starts or after a schema's current
+version changes.  The ValidatorWarmer in this module compiles (and caches)
+validators for all current schemas in a background thread at startup and
+recompiles them whenever a schema's current version changes.  Its progress
+can be reported via a readiness endpoint.
+"""
+import threading, logging, time
+from Queue import Queue
+
+from .models import Schema, on_current_change
+from .validate import Validator, ValidationError
+
+logger = logging.getLogger(__name__)
+
+# the maximum number of names of schemas that failed to compile that are 
+# remembered for reporting (see ValidatorWarmer.progress())
+MAX_FAILED = 100
+
+# the number of seconds to wait before retrying a warm-up that failed
+RETRY_DELAY = 30
+
+class ValidatorWarmer(object):
+    """
+    a class that compiles validators for schemas in a background thread.
+    The compiled validators are placed in the process-wide validator cache
+    (see validate.validator_cache).
+
+    The warmer is "ready" once the validators for all the schemas that were
+    current when it was started have been compiled.  If the warm-up itself
+    fails (e.g. because the database is unreachable), it is not ready; its
+    progress reports the error, and the warm-up is retried after a delay
+    (see RETRY_DELAY).
+    """
+
+    def __init__(self, validator_class=Validator):
+        """
+        create the warmer
+
+        :param validator_class class:  the validator class to compile
+                                         validators with
+        """
+        self.validator_class = validator_class
+        self._queue = Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._initial = 0
+
+        self.queued = 0
+        self.compiled = 0
+        self.failed = []
+        self.error = None
+        self.started = None
+        self.ready_at = None
+        self.retry_delay = RETRY_DELAY
+
+    @property
+    def ready(self):
+        """
+        True if the validators for all the schemas that were current at
+        startup have been compiled (or have failed to compile).
+        """
+        return self.ready_at is not None
+
+    def start(self):
+        """
+        start warming up validators for all current schemas in a background
+        thread, and begin listening for changes to current versions.
+        Calling this more than once has no further effect.
+        """
+        with self._lock:
+            if self._thread is not None:
+                return
+            self.started = time.time()
+            self._thread = threading.Thread(target=self._run,
+                                            name="ValidatorWarmer")
+            self._thread.daemon = True
+
+        on_current_change(self.schedule)
+        self._thread.start()
+
+    def schedule(self, name):
+        """
+        request that the validators for the named schema and for the schemas
+        that include or import it be recompiled.  As this is called when a 
+        schema's current version changes, it only queues the name; the 
+        schemas that depend on it are looked up by the background thread.
+        """
+        self._enqueue(name, True)
+
+    def _enqueue(self, name, dependents=False):
+        with self._lock:
+            self.queued += 1
+        self._queue.put((name, dependents))
+
+    def _schedule_dependents(self, name):
+        # queue the schemas that include or import the named schema
+        try:
+            schema = Schema.get_by_name(name)
+            if not schema:
+                return
+            names = schema.find_including_schema_names() + \
+                    schema.find_importing_schema_names()
+        except Exception, ex:
+            logger.exception("Unable to find schemas that depend on %s", name)
+            return
+        for dep in names:
+            self._enqueue(dep)
+
+    def warm_all(self):
+        """
+        compile validators for all current schemas in the calling thread.
+        The names of the schemas that failed in earlier passes are 
+        forgotten.
+        """
+        names = [s.name for s in Schema.get_all_current()]
+        with self._lock:
+            self.queued += len(names)
+            self.failed = []
+        for name in names:
+            self.warm(name)
+
+    def warm(self, name):
+        """
+        compile the validator for the current version of the named schema
+        in the calling thread, placing it in the validator cache.
+
+        :return bool:  True if the validator was compiled successfully
+        """
+        try:
+            self.validator_class.from_schema_name(name)
+            ok = True
+        except ValidationError, ex:
+            # includes a schema that was deleted after being queued
+            logger.warn("Unable to warm up validator for %s: %s",
+                        name, ex.message)
+            ok = False
+        except Exception, ex:
+            logger.exception("Unexpected failure warming validator for %s",
+                             name)
+            ok = False
+
+        with self._lock:
+            self.compiled += 1
+            if name in self.failed:
+                self.failed.remove(name)
+            if not ok:
+                self.failed.append(name)
+                del self.failed[:-MAX_FAILED]
+        return ok
+
+    def _run(self):
+        while True:
+            try:
+                self.warm_all()
+                break
+            except Exception, ex:
+                logger.exception("Unable to warm up validators (retrying in"
+                                 " %s seconds): %s", self.retry_delay, str(ex))
+                with self._lock:
+                    self.error = str(ex)
+            time.sleep(self.retry_delay)
+        with self._lock:
+            self.error = None
+            self.ready_at = time.time()
+        logger.info("warmed up %d validators in %.2f seconds", self.compiled,
+                    self.ready_at - self.started)
+
+        while True:
+            name, dependents = self._queue.get()
+            if dependents:
+                self._schedule_dependents(name)
+            self.warm(name)
+
+    def progress(self):
+        """
+        return a dictionary describing the progress of the warm-up
+        """
+        with self._lock:
+            out = {
+                "ready": self.ready, "queued": self.queued,
+                "compiled": self.compiled, "failed": list(self.failed),
+                "pending": self.queued - self.compiled
+            }
+            if self.error:
+                out["error"] = self.error
+        if self.started:
+            end = self.ready_at or time.time()
+            out["elapsed"] = end - self.started
+        return out
+
+warmer = ValidatorWarmer()
+
+def start():
+    """
+    start warming up the validators for all current schemas using the
+    process-wide warmer
+    """
+    warmer.start()
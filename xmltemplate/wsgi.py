@@ -14,3 +14,20 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "xmltemplate.settings")
 
 application = get_wsgi_application()
+
+# make sure the model queries are served by indexes
+from xmltemplate import audit
+audit.audit_at_startup()
+
+# fill in the fields that the queries rely on but that records saved by
+# earlier versions lack; by default, this is left to the sync_records 
+# management command.
+from django.conf import settings
+if getattr(settings, 'SCHEMA_SYNC_RECORDS', False):
+    from xmltemplate import models
+    models.sync_records()
+
+# compile the validators for the current schemas in the background so that
+# the first requests do not pay for it
+from xmltemplate import warmup
+warmup.start()